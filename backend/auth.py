@@ -0,0 +1,208 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+
+from .query_cache import TTLCache
+
+load_dotenv()
+
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "false").lower() == "true"
+
+
+class HasherBusy(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=8)
+def build_context(schemes: Tuple[str, ...], rounds: Optional[int]) -> CryptContext:
+    """The first scheme hashes new passwords. Hashes made with any other
+    scheme, or with a cost other than ``rounds``, verify but need an update.
+    """
+    settings = {}
+    if rounds:
+        scheme = schemes[0]
+        for option in ("default_rounds", "min_rounds", "max_rounds"):
+            settings[f"{scheme}__{option}"] = rounds
+    return CryptContext(schemes=list(schemes), deprecated="auto", **settings)
+
+
+def _hash(config, password: str) -> str:
+    return build_context(*config).hash(password)
+
+
+def _verify(config, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    try:
+        return build_context(*config).verify_and_update(password, hashed)
+    except ValueError:
+        return False, None
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords in a dedicated process pool.
+
+    Password hashing is deliberately CPU-bound, so it runs outside the
+    server process and a login burst cannot take threads or the GIL from
+    other endpoints. At most ``max_pending`` calls are admitted at once;
+    beyond that callers get ``HasherBusy`` instead of queueing.
+    """
+
+    def __init__(
+        self,
+        schemes: Sequence[str] = ("bcrypt",),
+        rounds: Optional[int] = None,
+        workers: int = 2,
+        max_pending: int = 64,
+    ):
+        self.config = (tuple(schemes), rounds)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+        build_context(*self.config)
+
+    @classmethod
+    def from_env(cls) -> "PasswordHasher":
+        rounds = os.getenv("PASSWORD_HASH_ROUNDS")
+        return cls(
+            schemes=os.getenv("PASSWORD_HASH_SCHEMES", "bcrypt").split(","),
+            rounds=int(rounds) if rounds else None,
+            workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+            max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64")),
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise HasherBusy(f"{self._pending} password hashes pending")
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), functools.partial(func, self.config, *args)
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(_hash, password)
+        with self._lock:
+            self._stats["hashed"] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Returns whether ``password`` matches and, if the hash was made
+        with outdated settings, a replacement hash to store.
+        """
+        valid, new_hash = await self._run(_verify, password, hashed)
+        with self._lock:
+            self._stats["verified"] += 1
+            if new_hash:
+                self._stats["rehashed"] += 1
+        return valid, new_hash
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        stats["workers"] = self.workers
+        stats["max_pending"] = self.max_pending
+        stats["scheme"] = self.config[0][0]
+        stats["rounds"] = self.config[1]
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_access_token(data: dict) -> str:
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+class TokenVerifier:
+    """Decodes bearer tokens, caching the claims of each token until it
+    expires so repeat requests skip the signature check.
+    """
+
+    def __init__(
+        self, secret: str = SECRET_KEY, algorithm: str = ALGORITHM, maxsize=10000
+    ):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.cache = TTLCache(maxsize=maxsize)
+
+    def claims(self, token: str) -> Dict[str, object]:
+        claims, _ = self.cache.get(token)
+        if claims is None:
+            try:
+                claims = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+            except JWTError:
+                raise HTTPException(
+                    status_code=401,
+                    detail="Invalid or expired token",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+            ttl = claims.get("exp", 0) - time.time()
+            if ttl > 0:
+                self.cache.set(token, claims, ttl)
+        return dict(claims)
+
+
+bearer_scheme = HTTPBearer(auto_error=False)
+token_verifier = TokenVerifier()
+
+
+async def current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> Dict[str, object]:
+    if credentials is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return token_verifier.claims(credentials.credentials)
+
+
+async def authorize(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> Optional[Dict[str, object]]:
+    """Route dependency enforcing a bearer token when ``AUTH_REQUIRED``."""
+    if not AUTH_REQUIRED:
+        return None
+    return await current_user(credentials)
@@ -0,0 +1,446 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .db import connect_from_env
+from .embedding_bench import SAMPLE_TEXTS, benchmark
+from .ingest import copy_users
+from .vector_index import EMBEDDING_DIMENSIONS, _percentile, create_index
+
+BENCH_PREFIX = "bench-"
+OPTIMIZER_QUERIES = [
+    "SELECT * FROM users WHERE age + 1 > 30",
+    "SELECT name, description FROM users WHERE age > 40 ORDER BY name LIMIT 20",
+    "SELECT u.name FROM users u JOIN users f ON f.id = u.id WHERE u.age - 2 >= 18",
+    "SELECT count(*) FROM users WHERE description LIKE '%engineer%'",
+    "UPDATE users SET age = age + 1",
+]
+NL_QUERIES = [
+    "top 5 users over 30 similar to '{}'",
+    "users aged 25 to 35 similar to '{}'",
+    "10 users under 60 whose name starts with bench similar to '{}'",
+]
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    return {
+        "latency_ms_p50": round(_percentile(latencies, 50), 3),
+        "latency_ms_p95": round(_percentile(latencies, 95), 3),
+        "latency_ms_p99": round(_percentile(latencies, 99), 3),
+        "latency_ms_max": round(max(latencies), 3),
+    }
+
+
+@contextlib.contextmanager
+def _env(name: str, value: Optional[str]):
+    previous = os.environ.get(name)
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = value
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = previous
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_users(connection, rows: int, batch_size: int = 10000) -> Dict[str, object]:
+    """Tops ``users`` up to ``rows`` synthetic ``bench-*`` rows with random
+    unit vectors, so runs at growing sizes reuse the rows already loaded.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT count(*) FROM users WHERE name LIKE %s", (BENCH_PREFIX + "%",)
+        )
+        existing = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        connection.rollback()
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(existing)
+    for start in range(existing, rows, batch_size):
+        count = min(batch_size, rows - start)
+        vectors = rng.standard_normal((count, EMBEDDING_DIMENSIONS)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        copy_users(
+            connection,
+            [
+                {
+                    "row_no": i,
+                    "id": None,
+                    "name": f"{BENCH_PREFIX}{start + i}",
+                    "age": int(rng.integers(18, 80)),
+                    "description": SAMPLE_TEXTS[(start + i) % len(SAMPLE_TEXTS)],
+                    "embedding": vector.round(6).tolist(),
+                }
+                for i, vector in enumerate(vectors)
+            ],
+        )
+    cursor = connection.cursor()
+    try:
+        cursor.execute("ANALYZE users")
+        connection.commit()
+    finally:
+        cursor.close()
+    return {
+        "rows": rows,
+        "inserted": max(rows - existing, 0),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def cleanup(connection) -> Dict[str, int]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM users WHERE name LIKE %s", (BENCH_PREFIX + "%",))
+        users = cursor.rowcount
+        cursor.execute(
+            "DELETE FROM auth_users WHERE username LIKE %s", (BENCH_PREFIX + "%",)
+        )
+        accounts = cursor.rowcount
+        connection.commit()
+    finally:
+        cursor.close()
+    return {"users": users, "auth_users": accounts}
+
+
+def bench_embeddings(batch_sizes: Sequence[int], rounds: int = 5) -> Dict[str, object]:
+    from .embeddings import ModelLoader
+
+    try:
+        model = ModelLoader.from_env().get()
+    except Exception as e:
+        return {"skipped": f"model unavailable: {e}"}
+    return {"throughput": benchmark(model, SAMPLE_TEXTS, batch_sizes, rounds)}
+
+
+def bench_optimizer(rounds: int = 20, explain: bool = True) -> Dict[str, object]:
+    """``optimize_query`` throughput with the analysis cache bypassed. Without
+    EXPLAIN the optimizer runs in ``ENV=test`` mode (rules and rewrites only).
+    """
+    from .optimizer import optimize_query
+
+    latencies = []
+    with _env("ENV", None if explain else "test"):
+        for query in OPTIMIZER_QUERIES:
+            optimize_query(query, use_cache=False)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for query in OPTIMIZER_QUERIES:
+                began = time.perf_counter()
+                optimize_query(query, use_cache=False)
+                latencies.append((time.perf_counter() - began) * 1000)
+        elapsed = time.perf_counter() - started
+    return {
+        "explain": explain,
+        "queries": len(latencies),
+        "queries_per_second": round(len(latencies) / elapsed, 1),
+        **_latency_summary(latencies),
+    }
+
+
+async def run_load(
+    client, path: str, payloads: Sequence[Dict], concurrency: int
+) -> Dict[str, object]:
+    """Sends every payload to ``path`` from ``concurrency`` parallel workers
+    and reports throughput and latency percentiles.
+    """
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    pending = iter(payloads)
+
+    async def worker():
+        for payload in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "path": path,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "errors": sum(n for status, n in statuses.items() if status != "200"),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        **_latency_summary(latencies),
+    }
+
+
+def _client(base_url: Optional[str]):
+    import httpx
+
+    if base_url:
+        return httpx.AsyncClient(base_url=base_url, timeout=60)
+    from .main import app
+
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60
+    )
+
+
+async def bench_search(
+    base_url: Optional[str], requests: int, concurrency: int, label: object
+) -> Dict[str, object]:
+    """Unique descriptions per request, so the result and embedding caches
+    miss and every request pays for the embedding and the k-NN query.
+    """
+    texts = [
+        f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} ({label} {i})" for i in range(requests)
+    ]
+    async with _client(base_url) as client:
+        similar = await run_load(
+            client,
+            "/search-similar",
+            [{"description": text, "limit": 10} for text in texts],
+            concurrency,
+        )
+        nl_query = await run_load(
+            client,
+            "/nl-query",
+            [
+                {"query": NL_QUERIES[i % len(NL_QUERIES)].format(text)}
+                for i, text in enumerate(texts)
+            ],
+            concurrency,
+        )
+    return {"search_similar": similar, "nl_query": nl_query}
+
+
+async def bench_auth(
+    base_url: Optional[str], requests: int, concurrency: int
+) -> Dict[str, object]:
+    run = time.time_ns()
+    accounts = [
+        {
+            "username": f"{BENCH_PREFIX}{run}-{i}",
+            "email": f"{BENCH_PREFIX}{run}-{i}@example.com",
+            "password": "bench-password",
+        }
+        for i in range(requests)
+    ]
+    async with _client(base_url) as client:
+        register = await run_load(client, "/register", accounts, concurrency)
+        login = await run_load(
+            client,
+            "/login",
+            [{"email": a["email"], "password": a["password"]} for a in accounts],
+            concurrency,
+        )
+    return {"register": register, "login": login}
+
+
+async def run_suite(
+    sizes: Sequence[int],
+    base_url: Optional[str] = None,
+    requests: int = 200,
+    concurrency: int = 16,
+    auth_requests: int = 50,
+    batch_sizes: Sequence[int] = (1, 8, 32, 128),
+    optimizer_rounds: int = 20,
+    index: bool = False,
+    skip: Sequence[str] = (),
+) -> Dict[str, object]:
+    report = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "target": base_url or "in-process",
+            "requests": requests,
+            "concurrency": concurrency,
+        },
+        "sizes": [],
+    }
+    if "embeddings" not in skip:
+        report["embeddings"] = bench_embeddings(batch_sizes)
+    if "optimizer" not in skip:
+        report["optimizer"] = bench_optimizer(optimizer_rounds, explain=False)
+    if "auth" not in skip:
+        report["auth"] = await bench_auth(base_url, auth_requests, concurrency)
+
+    connection = connect_from_env()
+    try:
+        for rows in sorted(sizes):
+            entry = {"rows": rows, "seed": seed_users(connection, rows)}
+            if index:
+                started = time.perf_counter()
+                create_index(connection, "hnsw", "l2")
+                entry["index_seconds"] = round(time.perf_counter() - started, 3)
+            if "optimizer" not in skip:
+                entry["optimizer"] = bench_optimizer(optimizer_rounds, explain=True)
+            if "search" not in skip:
+                entry.update(await bench_search(base_url, requests, concurrency, rows))
+            report["sizes"].append(entry)
+    finally:
+        connection.close()
+    return report
+
+
+_HIGHER_IS_BETTER = ("per_second",)
+_LOWER_IS_BETTER = ("latency_ms", "errors")
+
+
+def _metrics(node, path: str = "") -> Dict[str, float]:
+    if isinstance(node, dict):
+        metrics = {}
+        for name, value in node.items():
+            if name not in ("meta", "seed"):
+                metrics.update(_metrics(value, f"{path}/{name}"))
+        return metrics
+    if isinstance(node, list):
+        metrics = {}
+        for position, item in enumerate(node):
+            key = position
+            if isinstance(item, dict):
+                key = item.get("rows", item.get("batch_size", position))
+            metrics.update(_metrics(item, f"{path}/{key}"))
+        return metrics
+    name = path.rsplit("/", 1)[-1]
+    if isinstance(node, (int, float)) and not isinstance(node, bool):
+        if any(tag in name for tag in _HIGHER_IS_BETTER + _LOWER_IS_BETTER):
+            return {path: float(node)}
+    return {}
+
+
+def compare_reports(old: Dict, new: Dict, threshold: float = 0.1) -> Dict[str, object]:
+    """Relative change of every latency/throughput metric present in both
+    reports; a metric regresses when it moves the wrong way by more than
+    ``threshold``.
+    """
+    before, after = _metrics(old), _metrics(new)
+    changes = []
+    for path in sorted(set(before) & set(after)):
+        was, now = before[path], after[path]
+        higher_is_better = any(tag in path for tag in _HIGHER_IS_BETTER)
+        change = (now - was) / was if was else None
+        if change is None:
+            regression = now < was if higher_is_better else now > was
+        else:
+            regression = (-change if higher_is_better else change) > threshold
+        changes.append(
+            {
+                "metric": path,
+                "old": was,
+                "new": now,
+                "change_pct": None if change is None else round(change * 100, 2),
+                "regression": regression,
+            }
+        )
+    return {
+        "old_commit": old.get("meta", {}).get("git_commit"),
+        "new_commit": new.get("meta", {}).get("git_commit"),
+        "threshold_pct": threshold * 100,
+        "regressions": sum(c["regression"] for c in changes),
+        "metrics": changes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark embeddings, the optimizer and the API endpoints"
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    run = subparsers.add_parser("run", help="Run the suite and write a JSON report")
+    run.add_argument(
+        "--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000]
+    )
+    run.add_argument(
+        "--base-url", help="Benchmark a running server instead of the app in-process"
+    )
+    run.add_argument("--requests", type=int, default=200)
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--auth-requests", type=int, default=50)
+    run.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32, 128])
+    run.add_argument("--optimizer-rounds", type=int, default=20)
+    run.add_argument(
+        "--index", action="store_true", help="Build an HNSW index after seeding"
+    )
+    run.add_argument(
+        "--skip",
+        nargs="+",
+        default=[],
+        choices=["embeddings", "optimizer", "search", "auth"],
+    )
+    run.add_argument(
+        "--cleanup", action="store_true", help="Delete bench rows afterwards"
+    )
+    run.add_argument("--output", help="Write the report here instead of stdout")
+    diff = subparsers.add_parser("compare", help="Compare two JSON reports")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.action == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        result = compare_reports(old, new, args.threshold)
+        print(json.dumps(result, indent=2))
+        sys.exit(1 if result["regressions"] else 0)
+
+    report = asyncio.run(
+        run_suite(
+            args.sizes,
+            args.base_url,
+            args.requests,
+            args.concurrency,
+            args.auth_requests,
+            args.batch_sizes,
+            args.optimizer_rounds,
+            args.index,
+            args.skip,
+        )
+    )
+    if args.cleanup:
+        connection = connect_from_env()
+        try:
+            report["cleanup"] = cleanup(connection)
+        finally:
+            connection.close()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
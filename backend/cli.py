@@ -1,7 +1,202 @@
+import asyncio
+import contextlib
+import os
 import sys
 import requests
 import json
 import argparse
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+JSON_PATHS = {
+    "optimize": "/optimize",
+    "search": "/search-similar",
+    "upload": "/upload-embedding",
+    "nl-query": "/nl-query",
+    "register": "/register",
+    "login": "/login",
+}
+BATCH_FIELDS = {"optimize": "query", "search": "description", "nl-query": "query"}
+
+
+def json_payload(args, search_options: Dict) -> Dict:
+    if args.command == "optimize":
+        return {
+            "query": args.query,
+            "rules": args.rules,
+            "disabled_rules": args.disable_rules,
+            "advise_indexes": args.advise_indexes,
+            "advisor_mode": args.advisor_mode,
+            "analyze": args.analyze,
+        }
+    if args.command == "search":
+        return {"description": args.description, **search_options}
+    if args.command == "nl-query":
+        return {"query": args.query, **search_options}
+    if args.command == "upload":
+        return {"user_id": args.user_id, "description": args.description}
+    if args.command == "register":
+        return {
+            "username": args.username,
+            "email": args.email,
+            "password": args.password,
+        }
+    return {"email": args.email, "password": args.password}
+
+
+def build_request(args, search_options: Dict) -> Tuple[str, Dict]:
+    """Validates the arguments of a single command and returns the endpoint
+    and request options (``json``, or ``file`` with ``params``/``headers``).
+    """
+    # Imported here: both modules pull in psycopg2, numpy and the database
+    # layer, which the plain request path never needs
+    if args.command == "optimize" and args.workload:
+        from .workload import detect_workload_format
+
+        return "/optimize-workload", {
+            "params": {
+                "format": detect_workload_format(filename=args.workload),
+                "top": args.top,
+                "workers": args.workers,
+                "max_explains": args.max_explains,
+            },
+            "file": args.workload,
+            "headers": {"Content-Type": "application/octet-stream"},
+        }
+    if args.command == "upload" and args.file:
+        from .ingest import detect_format
+
+        fmt = args.format or detect_format(filename=args.file)
+        return "/bulk-upload-embeddings", {
+            "params": {"format": fmt},
+            "file": args.file,
+            "headers": {"Content-Type": CONTENT_TYPES[fmt]},
+        }
+    required = {
+        "optimize": (["query"], "--query or --workload"),
+        "search": (["description"], "--description"),
+        "upload": (
+            ["user_id", "description"],
+            "--user-id and --description (or --file)",
+        ),
+        "nl-query": (["query"], "--query"),
+        "register": (
+            ["username", "email", "password"],
+            "--username, --email, and --password",
+        ),
+        "login": (["email", "password"], "--email and --password"),
+    }
+    fields, flags = required[args.command]
+    if not all(getattr(args, field) for field in fields):
+        print(f"Error: {flags} required for {args.command}")
+        sys.exit(1)
+    return JSON_PATHS[args.command], {"json": json_payload(args, search_options)}
+
+
+def read_batch(source: str, command: str) -> Iterator[Union[Dict, ValueError]]:
+    """One item per non-empty line of ``source`` (``-`` for stdin): either
+    the query/description itself, or a JSON object of request fields. A
+    malformed JSON line yields a ``ValueError`` instead, so the batch
+    reports it for that item and goes on.
+    """
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if line.startswith("{"):
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f"Line {number}: invalid JSON: {e}")
+            elif line:
+                yield {BATCH_FIELDS[command]: line}
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+@contextlib.asynccontextmanager
+async def _client(base_url: Optional[str], concurrency: int, headers: Dict):
+    """A keep-alive connection pool to ``base_url``, or the app itself
+    in-process when ``base_url`` is None.
+    """
+    import httpx
+
+    if base_url:
+        limits = httpx.Limits(
+            max_connections=concurrency, max_keepalive_connections=concurrency
+        )
+        async with httpx.AsyncClient(
+            base_url=base_url, headers=headers, timeout=None, limits=limits
+        ) as client:
+            yield client
+        return
+
+    from .main import app
+
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://local",
+            headers=headers,
+            timeout=None,
+        ) as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+
+
+async def run_batch(
+    path: str,
+    payloads: Iterable[Union[Dict, Exception]],
+    concurrency: int,
+    base_url: Optional[str],
+    headers: Dict,
+    out=None,
+) -> int:
+    """Posts every payload from ``concurrency`` parallel workers and writes
+    one NDJSON line per response as it completes. A payload that is an
+    exception is reported as that item's error without a request. Returns
+    the failure count.
+    """
+    out = out or sys.stdout
+    pending = enumerate(payloads)
+    failures = 0
+
+    async def worker(client):
+        nonlocal failures
+        for index, payload in pending:
+            try:
+                if isinstance(payload, Exception):
+                    raise payload
+                response = await client.post(path, json=payload)
+                line = {"index": index, "status": response.status_code}
+                line["result"] = response.json()
+                ok = response.is_success
+            except Exception as e:
+                line = {"index": index, "error": str(e) or type(e).__name__}
+                ok = False
+            failures += not ok
+            out.write(json.dumps(line, default=str) + "\n")
+            out.flush()
+
+    async with _client(base_url, concurrency, headers) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return failures
+
+
+async def send_local(path: str, request: Dict, headers: Dict):
+    file = request.pop("file", None)
+    if file:
+        with open(file, "rb") as f:
+            request["content"] = f.read()
+    async with _client(None, 1, headers) as client:
+        response = await client.post(path, **request)
+    return response.json()
 
 
 def main():
@@ -16,77 +211,172 @@ def main():
     parser.add_argument(
         "--query", help="SQL query for optimize or NL query for nl-query"
     )
+    parser.add_argument(
+        "--workload",
+        help="pg_stat_statements export (CSV/NDJSON), Postgres log or .sql file "
+        "to analyse with optimize",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Analysis processes for --workload"
+    )
+    parser.add_argument(
+        "--max-explains",
+        type=int,
+        default=2,
+        help="Maximum concurrent EXPLAINs for --workload",
+    )
+    parser.add_argument(
+        "--top", type=int, default=50, help="Statements to report for --workload"
+    )
+    parser.add_argument(
+        "--rules", nargs="+", help="Only run these optimizer rules for optimize"
+    )
+    parser.add_argument(
+        "--disable-rules", nargs="+", help="Optimizer rules to skip for optimize"
+    )
+    parser.add_argument(
+        "--advise-indexes",
+        action="store_true",
+        help="Run the what-if index advisor for optimize",
+    )
+    parser.add_argument(
+        "--advisor-mode",
+        choices=["auto", "hypopg", "rollback"],
+        default="auto",
+        help="Hypothetical (HypoPG) or rolled-back throwaway indexes",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Run EXPLAIN (ANALYZE, BUFFERS) in a rolled-back transaction for optimize",
+    )
     parser.add_argument("--description", help="Description for search/upload")
     parser.add_argument("--user-id", type=int, help="User ID for upload")
-    parser.add_argument("--limit", type=int, default=5, help="Limit for search results")
+    parser.add_argument(
+        "--file", help="JSON, NDJSON or CSV file of users for bulk upload"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "ndjson", "csv"],
+        help="Format of --file (default: inferred from the extension)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="Limit for search results (default 5; nl-query defaults to the "
+        "count in the query, e.g. 'top 10 users ...')",
+    )
+    parser.add_argument(
+        "--distance",
+        choices=["l2", "cosine", "ip"],
+        default="l2",
+        help="Distance operator for search/nl-query",
+    )
+    parser.add_argument(
+        "--ef-search", type=int, help="HNSW ef_search for search/nl-query"
+    )
+    parser.add_argument("--probes", type=int, help="IVFFlat probes for search/nl-query")
+    parser.add_argument(
+        "--cursor", help="next_cursor from a previous search/nl-query page"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream search/nl-query results as NDJSON lines as they arrive",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=["full", "halfvec", "binary"],
+        help="Vectors to search for search/nl-query (compact modes re-rank "
+        "candidates at full precision)",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=["auto", "index", "prefilter", "overfetch", "iterative"],
+        default="auto",
+        help="Filtered search strategy for nl-query",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run optimize/search/nl-query for every line of FILE ('-' for stdin): "
+        "a query/description or a JSON object of request fields. Prints NDJSON",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Parallel requests (and keep-alive connections) for --batch",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Run the app in-process instead of calling IQUERIO_BASE_URL",
+    )
     parser.add_argument("--username", help="Username for register")
     parser.add_argument("--email", help="Email for register/login")
     parser.add_argument("--password", help="Password for register/login")
     args = parser.parse_args()
 
-    import os
-
     BASE_URL = os.getenv("IQUERIO_BASE_URL", "http://127.0.0.1:8000")
     headers = {"Content-Type": "application/json"}
+    if os.getenv("IQUERIO_TOKEN"):
+        headers["Authorization"] = f"Bearer {os.environ['IQUERIO_TOKEN']}"
+    search_options = {"distance": args.distance}
+    if args.limit is not None or args.command != "nl-query":
+        search_options["limit"] = args.limit or 5
+    if args.command == "nl-query":
+        search_options["strategy"] = args.strategy
+    if args.cursor:
+        search_options["cursor"] = args.cursor
+    if args.stream and not (args.batch or args.local):
+        search_options["stream"] = True
+    if args.ef_search is not None:
+        search_options["ef_search"] = args.ef_search
+    if args.probes is not None:
+        search_options["probes"] = args.probes
+    if args.storage:
+        search_options["storage"] = args.storage
 
     try:
-        if args.command == "optimize":
-            if not args.query:
-                print("Error: --query required for optimize")
-                sys.exit(1)
-            response = requests.post(
-                f"{BASE_URL}/optimize", json={"query": args.query}, headers=headers
-            )
-        elif args.command == "search":
-            if not args.description:
-                print("Error: --description required for search")
+        if args.batch:
+            if args.command not in BATCH_FIELDS:
+                print(f"Error: --batch is not supported for {args.command}")
                 sys.exit(1)
-            response = requests.post(
-                f"{BASE_URL}/search-similar",
-                json={"description": args.description, "limit": args.limit},
-                headers=headers,
+            path, base = JSON_PATHS[args.command], json_payload(args, search_options)
+            payloads = (
+                item if isinstance(item, ValueError) else {**base, **item}
+                for item in read_batch(args.batch, args.command)
             )
-        elif args.command == "upload":
-            if not args.user_id or not args.description:
-                print("Error: --user-id and --description required for upload")
-                sys.exit(1)
-            response = requests.post(
-                f"{BASE_URL}/upload-embedding",
-                json={"user_id": args.user_id, "description": args.description},
-                headers=headers,
-            )
-        elif args.command == "nl-query":
-            if not args.query:
-                print("Error: --query required for nl-query")
-                sys.exit(1)
-            response = requests.post(
-                f"{BASE_URL}/nl-query", json={"query": args.query}, headers=headers
-            )
-        elif args.command == "register":
-            if not args.username or not args.email or not args.password:
-                print(
-                    "Error: --username, --email, and --password required for register"
+            failures = asyncio.run(
+                run_batch(
+                    path,
+                    payloads,
+                    args.concurrency,
+                    None if args.local else BASE_URL,
+                    headers,
                 )
-                sys.exit(1)
-            response = requests.post(
-                f"{BASE_URL}/register",
-                json={
-                    "username": args.username,
-                    "email": args.email,
-                    "password": args.password,
-                },
-                headers=headers,
             )
-        elif args.command == "login":
-            if not args.email or not args.password:
-                print("Error: --email and --password required for login")
-                sys.exit(1)
-            response = requests.post(
-                f"{BASE_URL}/login",
-                json={"email": args.email, "password": args.password},
-                headers=headers,
-            )
-        print(json.dumps(response.json(), indent=2))
+            sys.exit(1 if failures else 0)
+
+        path, request = build_request(args, search_options)
+        if args.local:
+            print(json.dumps(asyncio.run(send_local(path, request, headers)), indent=2))
+            return
+
+        file = request.pop("file", None)
+        request["headers"] = {**headers, **request.get("headers", {})}
+        if file:
+            with open(file, "rb") as f:
+                response = requests.post(f"{BASE_URL}{path}", data=f, **request)
+        else:
+            response = requests.post(f"{BASE_URL}{path}", stream=args.stream, **request)
+        if args.stream and response.ok:
+            for line in response.iter_lines():
+                if line:
+                    print(line.decode("utf-8"), flush=True)
+        else:
+            print(json.dumps(response.json(), indent=2))
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
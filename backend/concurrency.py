@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class BoundedExecutor:
+    """Dedicated thread pool for one kind of blocking work.
+
+    Async endpoints ``await executor.run(func, ...)`` instead of calling
+    blocking code directly, so slow work of one kind (e.g. an EXPLAIN) can
+    only occupy this executor's ``max_workers`` threads and never starves
+    the event loop or other executors. Callers beyond ``max_workers`` wait
+    on the executor queue without holding a thread.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "running": 0, "completed": 0, "failed": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix=self.name
+                    )
+        return self._executor
+
+    def _call(self, func: Callable, args, kwargs):
+        with self._lock:
+            self._stats["running"] += 1
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats["running"] -= 1
+                self._stats["completed"] += 1
+        return result
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            self._stats["submitted"] += 1
+        return self._get_executor().submit(
+            contextvars.copy_context().run, self._call, func, args, kwargs
+        )
+
+    async def run(self, func: Callable, *args, **kwargs):
+        with self._lock:
+            self._stats["submitted"] += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(),
+            functools.partial(
+                contextvars.copy_context().run, self._call, func, args, kwargs
+            ),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_workers"] = self.max_workers
+        stats["queued"] = stats["submitted"] - stats["completed"] - stats["running"]
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class SingleFlight:
+    """Collapses concurrent async calls with the same key into one.
+
+    The first caller for a key runs ``func``; callers arriving while it is
+    in flight await the same result (or exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.shared = 0
+
+    async def do(
+        self, key: Hashable, func: Callable[[], Awaitable]
+    ) -> Tuple[Any, bool]:
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.shared += 1
+            try:
+                return await asyncio.shield(inflight), True
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+            return await self.do(key, func)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[key]
+
+
+db_executor = BoundedExecutor("db", int(os.getenv("DB_POOL_MAX", "10")))
@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
+
+from .embeddings import MODEL_VERSION
+from .metrics import record_stage
+
+load_dotenv()
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+def connect_from_env(model_version: str = MODEL_VERSION):
+    """Connections declare the embedding model version they write with, which
+    the ``users`` trigger records in ``embedding_model`` (see ``reembed``).
+    """
+    version = model_version.replace("\\", "\\\\").replace(" ", "\\ ")
+    return psycopg2.connect(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_NAME"),
+        options=f"-c iquerio.embedding_model={version}",
+    )
+
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool.
+
+    Connections are opened lazily up to ``maxconn`` and kept open between
+    requests. Idle connections are pinged before reuse once they have been
+    idle for ``health_check_interval`` seconds, and a checkout blocks for at
+    most ``timeout`` seconds before raising ``PoolTimeout``.
+    """
+
+    def __init__(
+        self,
+        minconn: int = 1,
+        maxconn: int = 10,
+        timeout: float = 5.0,
+        health_check_interval: float = 30.0,
+        connect: Callable = connect_from_env,
+    ):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(
+                "Invalid pool size: need 0 <= minconn <= maxconn, maxconn >= 1"
+            )
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle: List = []
+        self._idle_since: Dict[int, float] = {}
+        self._in_use = set()
+        self._opening = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_discarded": 0,
+            "health_check_failures": 0,
+            "wait_time_total": 0.0,
+            "max_in_use": 0,
+        }
+        for _ in range(minconn):
+            try:
+                conn = self._open()
+            except psycopg2.Error:
+                break
+            self._idle.append(conn)
+            self._idle_since[id(conn)] = time.monotonic()
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["connections_opened"] += 1
+        return conn
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle_for = time.monotonic() - self._idle_since.get(id(conn), 0.0)
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._stats["health_check_failures"] += 1
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._stats["connections_discarded"] += 1
+            self._idle_since.pop(id(conn), None)
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._in_use.add(id(conn))
+                    break
+                if len(self._in_use) + self._opening < self.maxconn:
+                    conn = None
+                    self._opening += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Timed out after {timeout:.2f}s waiting for a database connection"
+                    )
+                self._cond.wait(remaining)
+
+        if conn is not None and not self._is_healthy(conn):
+            with self._cond:
+                self._in_use.discard(id(conn))
+                self._opening += 1
+            self._discard(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._open()
+            finally:
+                with self._cond:
+                    self._opening -= 1
+                    if conn is None:
+                        self._cond.notify()
+
+        with self._cond:
+            self._in_use.add(id(conn))
+            self._idle_since.pop(id(conn), None)
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += time.monotonic() - start
+            self._stats["max_in_use"] = max(
+                self._stats["max_in_use"], len(self._in_use)
+            )
+        record_stage("db_connect", time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            self._in_use.discard(id(conn))
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+                self._idle_since[id(conn)] = time.monotonic()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                {
+                    "min_size": self.minconn,
+                    "max_size": self.maxconn,
+                    "in_use": len(self._in_use),
+                    "idle": len(self._idle),
+                    "size": len(self._in_use) + len(self._idle),
+                }
+            )
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = (
+            stats["wait_time_total"] / checkouts if checkouts else 0.0
+        )
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+                    health_check_interval=float(
+                        os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30")
+                    ),
+                )
+    return _pool
+
+
+def get_connection(timeout: Optional[float] = None):
+    return get_pool().getconn(timeout)
+
+
+def release_connection(connection, discard: bool = False):
+    get_pool().putconn(connection, discard=discard)
+
+
+@contextmanager
+def pooled_connection(timeout: Optional[float] = None):
+    with get_pool().connection(timeout) as connection:
+        yield connection
+
+
+def current_pool() -> Optional[ConnectionPool]:
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
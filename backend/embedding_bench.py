@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .embeddings import BACKENDS, INT8_CONFIGS, MODEL_NAME, ModelLoader
+
+SAMPLE_TEXTS = [
+    "Young tech enthusiast who loves AI and startups",
+    "Experienced software engineer interested in cloud computing",
+    "Data scientist passionate about machine learning",
+    "Product manager focused on user experience and design",
+    "Backend developer who writes Postgres extensions",
+    "Marketing lead for a developer tools company",
+    "Student learning about distributed systems and databases",
+    "Designer who sketches mobile app prototypes on weekends",
+]
+
+
+def cosine_drift(reference: np.ndarray, vectors: np.ndarray) -> Dict[str, float]:
+    reference = np.asarray(reference, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    cosine = np.sum(reference * vectors, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1)
+    )
+    return {
+        "cosine_mean": round(float(cosine.mean()), 6),
+        "cosine_min": round(float(cosine.min()), 6),
+        "max_abs_diff": round(float(np.abs(reference - vectors).max()), 6),
+    }
+
+
+def benchmark(
+    model, texts: Sequence[str], batch_sizes: Sequence[int], rounds: int = 5
+) -> List[Dict[str, float]]:
+    results = []
+    for batch_size in batch_sizes:
+        batch = [texts[i % len(texts)] for i in range(batch_size)]
+        model.encode(batch, convert_to_tensor=False, batch_size=batch_size)
+        latencies = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            model.encode(batch, convert_to_tensor=False, batch_size=batch_size)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        results.append(
+            {
+                "batch_size": batch_size,
+                "texts_per_second": round(batch_size * rounds / sum(latencies), 1),
+                "latency_ms_p50": round(latencies[len(latencies) // 2] * 1000, 3),
+                "latency_ms_max": round(latencies[-1] * 1000, 3),
+            }
+        )
+    return results
+
+
+def compare(
+    backends: Sequence[str],
+    texts: Sequence[str],
+    batch_sizes: Sequence[int] = (1, 8, 32),
+    rounds: int = 5,
+    **loader_kwargs,
+) -> Dict[str, object]:
+    reference = ModelLoader(backend="torch", warmup_batch_size=0, **loader_kwargs)
+    reference_vectors = reference.encode(list(texts), batch_size=len(texts))
+    report = {"model": MODEL_NAME, "texts": len(texts), "backends": []}
+    for backend in backends:
+        loader = (
+            reference
+            if backend == "torch"
+            else ModelLoader(backend=backend, warmup_batch_size=0, **loader_kwargs)
+        )
+        started = time.perf_counter()
+        model = loader.get()
+        load_seconds = time.perf_counter() - started
+        vectors = model.encode(
+            list(texts), convert_to_tensor=False, batch_size=len(texts)
+        )
+        report["backends"].append(
+            {
+                "backend": backend,
+                "onnx_file": loader.onnx_file_name(),
+                "load_seconds": round(load_seconds, 3),
+                "parity_vs_torch_fp32": cosine_drift(reference_vectors, vectors),
+                "throughput": benchmark(model, texts, batch_sizes, rounds),
+            }
+        )
+    return report
+
+
+def export_onnx(output: str, quantize: str = None) -> Dict[str, str]:
+    from sentence_transformers import (
+        SentenceTransformer,
+        export_dynamic_quantized_onnx_model,
+    )
+
+    model = SentenceTransformer(MODEL_NAME, backend="onnx")
+    model.save(output)
+    exported = {"model": os.path.join(output, "onnx", "model.onnx")}
+    if quantize:
+        export_dynamic_quantized_onnx_model(model, quantize, output)
+        prefix = "quint8" if quantize == "avx2" else "qint8"
+        exported["quantized"] = os.path.join(
+            output, "onnx", f"model_{prefix}_{quantize}.onnx"
+        )
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export ONNX embedding models and compare backends"
+    )
+    parser.add_argument("action", choices=["compare", "export"])
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS)
+    )
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--file", help="Text file with one sample text per line")
+    parser.add_argument("--model-path", help="Local model directory (e.g. an export)")
+    parser.add_argument("--int8-config", choices=INT8_CONFIGS, default="avx512_vnni")
+    parser.add_argument("--output", default="models/onnx", help="Export directory")
+    parser.add_argument("--quantize", choices=INT8_CONFIGS, help="Also export int8")
+    args = parser.parse_args()
+
+    if args.action == "export":
+        result = export_onnx(args.output, args.quantize)
+    else:
+        texts = SAMPLE_TEXTS
+        if args.file:
+            with open(args.file, encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()]
+        result = compare(
+            args.backends,
+            texts,
+            args.batch_sizes,
+            args.rounds,
+            path=args.model_path,
+            int8_config=args.int8_config,
+        )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+import asyncio
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .concurrency import BoundedExecutor
+from .metrics import ENCODE_BATCH_SIZE, stage
+
+load_dotenv()
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+MODEL_VERSION = os.getenv("EMBEDDING_MODEL_VERSION") or MODEL_NAME
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+BACKENDS = ("torch", "onnx", "onnx-int8")
+INT8_CONFIGS = ("avx2", "avx512", "avx512_vnni", "arm64")
+
+
+def model_namespace(name: str = MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> str:
+    return name if backend == "torch" else f"{name}+{backend}"
+
+
+def limit_threads(threads: int):
+    """Caps the intra-op threads encode uses in this process (0: library
+    default), so several workers on one node do not oversubscribe cores.
+    """
+    if threads <= 0:
+        return
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class ModelLoader:
+    """Loads the SentenceTransformer model lazily or in the background.
+
+    Importing this module never imports torch. ``start()`` loads and warms
+    the model on a background thread so the process can answer liveness
+    checks immediately; ``encode`` blocks until loading has finished.
+    """
+
+    def __init__(
+        self,
+        name: str = MODEL_NAME,
+        path: Optional[str] = None,
+        offline: bool = False,
+        warmup_batch_size: int = 8,
+        device: Optional[str] = None,
+        backend: str = "torch",
+        int8_config: str = "avx512_vnni",
+        onnx_file: Optional[str] = None,
+        threads: int = EMBEDDING_THREADS,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown embedding backend '{backend}', expected one of {BACKENDS}"
+            )
+        if int8_config not in INT8_CONFIGS:
+            raise ValueError(
+                f"Unknown int8 config '{int8_config}', expected one of {INT8_CONFIGS}"
+            )
+        self.name = name
+        self.backend = backend
+        self.int8_config = int8_config
+        self.onnx_file = onnx_file
+        self.path = path
+        self.offline = offline
+        self.warmup_batch_size = warmup_batch_size
+        self.device = device
+        self.threads = threads
+        self.error: Optional[BaseException] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "ModelLoader":
+        return cls(
+            name=MODEL_NAME,
+            path=os.getenv("EMBEDDING_MODEL_PATH") or None,
+            offline=os.getenv("EMBEDDING_OFFLINE", "false").lower() == "true",
+            warmup_batch_size=int(os.getenv("EMBEDDING_WARMUP_BATCH", "8")),
+            device=os.getenv("EMBEDDING_DEVICE") or None,
+            backend=EMBEDDING_BACKEND,
+            int8_config=os.getenv("EMBEDDING_INT8_CONFIG", "avx512_vnni"),
+            onnx_file=os.getenv("EMBEDDING_ONNX_FILE") or None,
+            threads=EMBEDDING_THREADS,
+        )
+
+    def onnx_file_name(self) -> Optional[str]:
+        if self.onnx_file:
+            return self.onnx_file
+        if self.backend == "onnx-int8":
+            prefix = "quint8" if self.int8_config == "avx2" else "qint8"
+            return f"onnx/model_{prefix}_{self.int8_config}.onnx"
+        return None
+
+    def _build(self):
+        if self.offline:
+            os.environ.setdefault("HF_HUB_OFFLINE", "1")
+            os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+        limit_threads(self.threads)
+        from sentence_transformers import SentenceTransformer
+
+        limit_threads(self.threads)
+
+        kwargs = {}
+        if self.backend != "torch":
+            kwargs["backend"] = "onnx"
+            file_name = self.onnx_file_name()
+            if file_name:
+                kwargs["model_kwargs"] = {"file_name": file_name}
+        return SentenceTransformer(
+            self.path or self.name,
+            device=self.device,
+            local_files_only=self.offline or bool(self.path),
+            **kwargs,
+        )
+
+    def load(self):
+        with self._lock:
+            if self._done.is_set():
+                return
+            try:
+                started = time.perf_counter()
+                model = self._build()
+                self.load_seconds = time.perf_counter() - started
+                if self.warmup_batch_size > 0:
+                    started = time.perf_counter()
+                    model.encode(
+                        ["warm-up"] * self.warmup_batch_size,
+                        convert_to_tensor=False,
+                        batch_size=self.warmup_batch_size,
+                    )
+                    self.warmup_seconds = time.perf_counter() - started
+                self._model = model
+            except Exception as e:
+                self.error = e
+            finally:
+                self._done.set()
+
+    def start(self):
+        if self._thread is None and not self._done.is_set():
+            self._thread = threading.Thread(
+                target=self.load, name="model-loader", daemon=True
+            )
+            self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self._model is not None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def get(self):
+        if not self._done.is_set():
+            if self._thread is None:
+                self.load()
+            self._done.wait()
+        if self._model is None:
+            raise RuntimeError(f"Embedding model failed to load: {self.error}")
+        return self._model
+
+    def encode(self, texts: Sequence[str], convert_to_tensor: bool = False, **kwargs):
+        return self.get().encode(list(texts), convert_to_tensor=False, **kwargs)
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "model": self.path or self.name,
+            "backend": self.backend,
+            "onnx_file": self.onnx_file_name(),
+            "ready": self.ready,
+            "loading": self._thread is not None and not self._done.is_set(),
+            "error": str(self.error) if self.error else None,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "threads": self.threads or None,
+        }
+
+
+inference_executor = BoundedExecutor(
+    "inference", int(os.getenv("INFERENCE_WORKERS", "1"))
+)
+
+
+def normalize_text(text: str, lowercase: bool = False) -> str:
+    text = unicodedata.normalize("NFC", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    if lowercase:
+        text = text.lower()
+    return text
+
+
+class EmbeddingCache:
+    """Two-tier text -> embedding cache.
+
+    The memory tier is an LRU bounded by ``maxsize`` entries. When ``path`` is
+    set, vectors are also written to a SQLite file so they survive restarts.
+    Keys include ``namespace`` (model name and backend) so switching models never
+    serves stale vectors. Vectors are stored as the raw float32 bytes the
+    model produced, so a hit returns exactly the vector computed on the miss.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        path: Optional[str] = None,
+        namespace: Optional[str] = None,
+        lowercase: bool = False,
+    ):
+        self.maxsize = maxsize
+        self.path = path
+        self.namespace = namespace or model_namespace()
+        self.lowercase = lowercase
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._disk = None
+        self._disk_pid = None
+        if path:
+            self._connect()
+
+    def _connect(self):
+        self._disk = sqlite3.connect(self.path, check_same_thread=False)
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "namespace TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (namespace, text))"
+        )
+        self._disk.commit()
+        self._disk_pid = os.getpid()
+
+    def _database(self):
+        """This process's SQLite connection; forked workers open their own."""
+        if self._disk is not None and self._disk_pid != os.getpid():
+            self._connect()
+        return self._disk
+
+    @classmethod
+    def from_env(cls) -> "EmbeddingCache":
+        return cls(
+            maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+            path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+            lowercase=os.getenv("EMBEDDING_CACHE_LOWERCASE", "false").lower() == "true",
+        )
+
+    def normalize(self, text: str) -> str:
+        return normalize_text(text, self.lowercase)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                return vector
+            disk = self._database()
+            if disk is not None:
+                row = disk.execute(
+                    "SELECT vector FROM embeddings WHERE namespace = ? AND text = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return vector
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, vector) -> np.ndarray:
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._remember(key, vector)
+            disk = self._database()
+            if disk is not None:
+                disk.execute(
+                    "INSERT OR REPLACE INTO embeddings (namespace, text, vector) "
+                    "VALUES (?, ?, ?)",
+                    (self.namespace, key, vector.tobytes()),
+                )
+                disk.commit()
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            disk = self._database()
+            if disk is not None:
+                disk.execute(
+                    "DELETE FROM embeddings WHERE namespace = ?", (self.namespace,)
+                )
+                disk.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._memory)
+            stats["maxsize"] = self.maxsize
+            stats["persistent"] = self._disk is not None
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class CachedEncoder:
+    def __init__(self, model, cache: Optional[EmbeddingCache] = None):
+        self.model = model
+        self.cache = cache or EmbeddingCache()
+
+    def _lookup(self, texts: Sequence[str]):
+        keys = [self.cache.normalize(text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        seen = set()
+        for key in keys:
+            if key in seen:
+                continue
+            seen.add(key)
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.append(key)
+            else:
+                vectors[key] = cached
+        return keys, vectors, missing
+
+    def _store(self, missing: List[str], encoded, vectors: Dict[str, np.ndarray]):
+        for key, vector in zip(missing, encoded):
+            vectors[key] = self.cache.put(key, vector)
+
+    def encode(self, texts: Sequence[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        if missing:
+            with stage("encode"):
+                encoded = self.model.encode(missing, convert_to_tensor=False)
+            self._store(missing, encoded, vectors)
+        return [vectors[key].tolist() for key in keys]
+
+    def encode_one(self, text: str) -> List[float]:
+        return self.encode([text])[0]
+
+    async def aencode(self, texts: Sequence[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        if missing:
+            submit = getattr(self.model, "submit", None)
+            with stage("encode"):
+                if submit is not None:
+                    encoded = await asyncio.wrap_future(submit(missing))
+                else:
+                    encoded = await inference_executor.run(
+                        self.model.encode, missing, convert_to_tensor=False
+                    )
+            self._store(missing, encoded, vectors)
+        return [vectors[key].tolist() for key in keys]
+
+    async def aencode_one(self, text: str) -> List[float]:
+        return (await self.aencode([text]))[0]
+
+
+class _EncodeJob:
+    __slots__ = ("texts", "kwargs", "future")
+
+    def __init__(self, texts: List[str], kwargs: Dict[str, object]):
+        self.texts = texts
+        self.kwargs = kwargs
+        self.future: Future = Future()
+
+    def resolve(self, result=None, error: Optional[BaseException] = None):
+        try:
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        except InvalidStateError:
+            pass
+
+
+class MicroBatcher:
+    """Collects concurrent encode calls into batched forward passes.
+
+    Wraps a model and exposes the same ``encode`` signature, so it can sit
+    under ``CachedEncoder``. A single worker thread takes the first waiting
+    job, then keeps collecting jobs until ``max_batch_size`` texts are queued
+    or ``max_wait`` seconds have passed, runs one ``model.encode`` and hands
+    each caller back its own slice of the result. Only jobs with the same
+    ``encode`` keyword arguments share a batch; the others wait for the next
+    one. Jobs cancelled before their batch starts are dropped.
+
+    Texts are padded to the longest one in the batch, so a vector is not
+    bit-for-bit the one ``model.encode([text])`` gives; components agree to
+    within 1e-4.
+    """
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait: float = 0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Optional[_EncodeJob]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._deferred: "deque[_EncodeJob]" = deque()
+        self._stats = {"batches": 0, "texts": 0, "direct": 0, "largest_batch": 0}
+
+    @classmethod
+    def from_env(cls, model) -> "MicroBatcher":
+        return cls(
+            model,
+            max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32")),
+            max_wait=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5")) / 1000,
+        )
+
+    def encode(self, texts: Sequence[str], convert_to_tensor: bool = False, **kwargs):
+        texts = list(texts)
+        if len(texts) >= self.max_batch_size:
+            with self._lock:
+                self._stats["direct"] += 1
+            ENCODE_BATCH_SIZE.observe(len(texts))
+            with stage("model_encode"):
+                return self.model.encode(texts, convert_to_tensor=False, **kwargs)
+        return self.submit(texts, **kwargs).result()
+
+    def submit(self, texts: Sequence[str], **kwargs) -> Future:
+        job = _EncodeJob(list(texts), kwargs)
+        self._ensure_worker()
+        self._queue.put(job)
+        return job.future
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self, first: _EncodeJob) -> List[_EncodeJob]:
+        jobs = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)
+                break
+            if job.kwargs != first.kwargs:
+                self._deferred.append(job)
+                continue
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs
+
+    def _run(self):
+        while True:
+            first = self._deferred.popleft() if self._deferred else self._queue.get()
+            if first is None:
+                return
+            jobs = [
+                job
+                for job in self._collect(first)
+                if job.future.set_running_or_notify_cancel()
+            ]
+            if not jobs:
+                continue
+            texts = [text for job in jobs for text in job.texts]
+            kwargs = {"batch_size": len(texts), **first.kwargs}
+            ENCODE_BATCH_SIZE.observe(len(texts))
+            try:
+                with stage("model_encode"):
+                    vectors = self.model.encode(
+                        texts, convert_to_tensor=False, **kwargs
+                    )
+            except Exception as e:
+                for job in jobs:
+                    job.resolve(error=e)
+                continue
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["largest_batch"] = max(
+                    self._stats["largest_batch"], len(texts)
+                )
+            offset = 0
+            for job in jobs:
+                job.resolve(vectors[offset : offset + len(job.texts)])
+                offset += len(job.texts)
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000
+        stats["queue_depth"] = self._queue.qsize() + len(self._deferred)
+        stats["avg_batch_size"] = (
+            stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        )
+        return stats
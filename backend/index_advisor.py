@@ -0,0 +1,216 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import sqlparse
+from psycopg2 import sql
+from sqlparse import sql as ast
+
+from .plan_analysis import explain_json, install_explain
+from .rules import Rule, RuleEngine
+
+ADVISOR_MODES = ("auto", "hypopg", "rollback")
+INDEX_ADVISOR_MIN_GAIN = float(os.getenv("INDEX_ADVISOR_MIN_GAIN", "0.05"))
+INDEX_ADVISOR_TIMEOUT_MS = int(os.getenv("INDEX_ADVISOR_TIMEOUT_MS", "30000"))
+INDEX_ADVISOR_ALLOW_ROLLBACK = (
+    os.getenv("INDEX_ADVISOR_ALLOW_ROLLBACK", "false").lower() == "true"
+)
+
+
+class AdvisorUnavailable(Exception):
+    pass
+
+
+def _identifiers(token) -> List[ast.Identifier]:
+    if isinstance(token, ast.IdentifierList):
+        return [t for t in token.get_identifiers() if isinstance(t, ast.Identifier)]
+    if isinstance(token, ast.Identifier):
+        return [token]
+    return []
+
+
+def _column(identifier: ast.Identifier) -> Optional[Tuple[Optional[str], str]]:
+    if isinstance(identifier.tokens[0], ast.Identifier):
+        identifier = identifier.tokens[0]
+    name = identifier.get_real_name()
+    if not name or any(isinstance(t, ast.Parenthesis) for t in identifier.tokens):
+        return None
+    return identifier.get_parent_name(), name.lower()
+
+
+class IndexCandidates(Rule):
+    """Collects columns used in WHERE predicates, JOIN conditions and ORDER BY."""
+
+    name = "index_candidates"
+    groups = (ast.Comparison, ast.Identifier, ast.IdentifierList)
+    uses_tables = True
+
+    def visit(self, token, ctx):
+        found = ctx.state.setdefault(self.name, {})
+        if isinstance(token, ast.Comparison):
+            if ctx.where_depth:
+                role = "filter"
+            elif ctx.prev_keyword in ("ON", "AND", "OR"):
+                role = "join"
+            else:
+                return
+            sides = []
+            for side in token.tokens:
+                if isinstance(side, ast.Operation):
+                    sides += [t for t in side.tokens if isinstance(t, ast.Identifier)]
+                elif isinstance(side, ast.Identifier):
+                    sides.append(side)
+        elif ctx.prev_keyword == "ORDER BY":
+            role, sides = "order", _identifiers(token)
+        else:
+            return
+        for identifier in sides:
+            column = _column(identifier)
+            if column:
+                found.setdefault(column, role)
+
+    def finish(self, ctx):
+        columns: Dict[str, List[Tuple[str, str]]] = {}
+        for (qualifier, column), role in ctx.state.get(self.name, {}).items():
+            table = ctx.resolve_table(qualifier)
+            if table and (column, role) not in columns.get(table, []):
+                columns.setdefault(table, []).append((column, role))
+        ctx.state[self.name] = columns
+
+
+def candidate_indexes(query: str, stmt=None) -> List[Dict[str, object]]:
+    stmt = stmt if stmt is not None else sqlparse.parse(query)[0]
+    ctx, _ = RuleEngine([IndexCandidates()]).run(query, stmt)
+    candidates = []
+    for table, columns in ctx.state[IndexCandidates.name].items():
+        seen = []
+        for column, role in columns:
+            if column not in seen:
+                seen.append(column)
+                candidates.append({"table": table, "columns": [column], "from": role})
+        filters = [c for c, role in columns if role == "filter"]
+        orders = [c for c, role in columns if role == "order" and c not in filters]
+        if filters and orders:
+            candidates.append(
+                {
+                    "table": table,
+                    "columns": filters + orders[:1],
+                    "from": "filter+order",
+                }
+            )
+        elif len(filters) > 1:
+            candidates.append({"table": table, "columns": filters, "from": "filter"})
+    return candidates
+
+
+def index_sql(table: str, columns: List[str], name: Optional[str] = None):
+    return sql.SQL("CREATE INDEX {name}ON {table} ({columns})").format(
+        name=sql.SQL("{} ").format(sql.Identifier(name)) if name else sql.SQL(""),
+        table=sql.Identifier(table),
+        columns=sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+    )
+
+
+def _plan_cost(cursor, query: str) -> float:
+    return explain_json(cursor, query)[0]["Plan"]["Total Cost"]
+
+
+def _has_hypopg(cursor) -> bool:
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")
+    return cursor.fetchone() is not None
+
+
+def _whatif_hypopg(cursor, query: str, statement: str) -> Tuple[float, int]:
+    cursor.execute("SELECT indexrelid FROM hypopg_create_index(%s)", (statement,))
+    oid = cursor.fetchone()[0]
+    try:
+        cost = _plan_cost(cursor, query)
+        cursor.execute("SELECT hypopg_relation_size(%s)", (oid,))
+        return cost, cursor.fetchone()[0]
+    finally:
+        cursor.execute("SELECT hypopg_drop_index(%s)", (oid,))
+
+
+def _whatif_rollback(cursor, query: str, statement, name: str) -> Tuple[float, int]:
+    cursor.execute("SAVEPOINT iquerio_whatif")
+    try:
+        cursor.execute(statement)
+        cost = _plan_cost(cursor, query)
+        cursor.execute("SELECT pg_relation_size(%s::regclass)", (name,))
+        return cost, cursor.fetchone()[0]
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT iquerio_whatif")
+
+
+def recommend_indexes(
+    connection,
+    query: str,
+    stmt=None,
+    mode: str = "auto",
+    min_gain: float = INDEX_ADVISOR_MIN_GAIN,
+) -> Dict[str, object]:
+    """What-if index analysis for ``query``.
+
+    Every candidate is planned against a hypothetical HypoPG index, or, in
+    ``rollback`` mode, a real index built inside a savepoint that is rolled
+    back. Only meant for a local/test database: building real indexes locks
+    the table against writes for the length of the build.
+    """
+    if mode not in ADVISOR_MODES:
+        raise ValueError(
+            f"Unknown advisor mode '{mode}', expected one of {ADVISOR_MODES}"
+        )
+    candidates = candidate_indexes(query, stmt)
+    report = {
+        "mode": mode,
+        "baseline_cost": None,
+        "recommendations": [],
+        "rejected": [],
+    }
+    if not candidates:
+        return report
+
+    install_explain(connection)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SET LOCAL statement_timeout = %s", (INDEX_ADVISOR_TIMEOUT_MS,))
+        if mode != "rollback" and _has_hypopg(cursor):
+            mode = "hypopg"
+        elif mode == "hypopg" or not INDEX_ADVISOR_ALLOW_ROLLBACK:
+            raise AdvisorUnavailable(
+                "The hypopg extension is not installed "
+                "(set INDEX_ADVISOR_ALLOW_ROLLBACK=true to build throwaway indexes)"
+            )
+        else:
+            mode = "rollback"
+        report["mode"] = mode
+        baseline = report["baseline_cost"] = _plan_cost(cursor, query)
+
+        for number, candidate in enumerate(candidates):
+            name = f"iquerio_whatif_{number}"
+            statement = index_sql(candidate["table"], candidate["columns"], name)
+            if mode == "hypopg":
+                cost, size = _whatif_hypopg(cursor, query, statement.as_string(cursor))
+            else:
+                cost, size = _whatif_rollback(cursor, query, statement, name)
+            gain = (baseline - cost) / baseline if baseline else 0.0
+            suggested = "idx_" + "_".join([candidate["table"], *candidate["columns"]])
+            create = index_sql(candidate["table"], candidate["columns"], suggested)
+            result = dict(
+                candidate,
+                sql=create.as_string(cursor) + ";",
+                cost_before=baseline,
+                cost_after=cost,
+                cost_delta=round(cost - baseline, 2),
+                improvement_pct=round(gain * 100, 2),
+                estimated_size_bytes=size,
+            )
+            if gain > min_gain:
+                report["recommendations"].append(result)
+            else:
+                report["rejected"].append(result)
+    finally:
+        cursor.close()
+        connection.rollback()
+
+    report["recommendations"].sort(key=lambda r: r["cost_after"])
+    return report
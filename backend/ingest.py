@@ -0,0 +1,268 @@
+import csv
+import io
+import json
+import os
+import time
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from psycopg2 import Error as PsycopgError
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+MAX_REPORTED_FAILURES = 1000
+INT4_MIN, INT4_MAX = -(2**31), 2**31 - 1
+
+FORMATS = ("json", "ndjson", "csv")
+
+STAGING_TABLE_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS users_ingest (
+        row_no INTEGER NOT NULL,
+        id INTEGER,
+        name VARCHAR(100),
+        age INTEGER,
+        description TEXT NOT NULL,
+        embedding vector(384) NOT NULL
+    ) ON COMMIT DELETE ROWS;
+"""
+
+MERGE_SQL = """
+    WITH updated AS (
+        UPDATE users u
+        SET description = s.description,
+            embedding = s.embedding,
+            name = COALESCE(s.name, u.name),
+            age = COALESCE(s.age, u.age)
+        FROM users_ingest s
+        WHERE s.id IS NOT NULL AND u.id = s.id
+        RETURNING s.row_no
+    ), inserted AS (
+        INSERT INTO users (name, age, description, embedding)
+        SELECT name, age, description, embedding
+        FROM users_ingest
+        WHERE id IS NULL
+        ORDER BY row_no
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM inserted), ARRAY(SELECT row_no FROM updated);
+"""
+
+
+def detect_format(content_type: Optional[str] = None, filename: Optional[str] = None):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in (".ndjson", ".jsonl"):
+            return "ndjson"
+        if extension == ".csv":
+            return "csv"
+    return "json"
+
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[Tuple[int, object]]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {FORMATS}")
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        for row_no, row in enumerate(csv.DictReader(text), start=1):
+            yield row_no, row
+    elif fmt == "ndjson":
+        row_no = 0
+        for line in text:
+            if not line.strip():
+                continue
+            row_no += 1
+            try:
+                yield row_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_no, ValueError(f"Invalid JSON: {e.msg}")
+    else:
+        payload = json.load(text)
+        if isinstance(payload, dict):
+            payload = payload.get("rows", payload.get("records"))
+        if not isinstance(payload, list):
+            raise ValueError("JSON payload must be a list of records")
+        for row_no, record in enumerate(payload, start=1):
+            yield row_no, record
+
+
+def _optional_int(value, field: str) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{field}' must be an integer")
+    if not INT4_MIN <= number <= INT4_MAX:
+        raise ValueError(f"'{field}' is out of range for an integer column")
+    return number
+
+
+def parse_record(record) -> Dict[str, object]:
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("Record must be an object")
+    description = record.get("description")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("'description' is required")
+    user_id = _optional_int(record.get("user_id", record.get("id")), "user_id")
+    name = record.get("name") or None
+    if name is not None and (not isinstance(name, str) or len(name) > 100):
+        raise ValueError("'name' must be a string of at most 100 characters")
+    if user_id is None and name is None:
+        raise ValueError("Either 'user_id' or 'name' is required")
+    return {
+        "id": user_id,
+        "name": name,
+        "age": _optional_int(record.get("age"), "age"),
+        "description": description,
+    }
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, list):
+        return "[" + ",".join(repr(float(x)) for x in value) + "]"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_users(connection, rows: List[Dict[str, object]]) -> Tuple[int, List[int]]:
+    buffer = io.StringIO()
+    for row in rows:
+        values = (
+            row["row_no"],
+            row["id"],
+            row["name"],
+            row["age"],
+            row["description"],
+            row["embedding"],
+        )
+        buffer.write("\t".join(_copy_value(v) for v in values) + "\n")
+    buffer.seek(0)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(STAGING_TABLE_SQL)
+        cursor.copy_expert(
+            "COPY users_ingest (row_no, id, name, age, description, embedding) "
+            "FROM STDIN",
+            buffer,
+        )
+        cursor.execute(MERGE_SQL)
+        inserted, updated_rows = cursor.fetchone()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return inserted, updated_rows
+
+
+class IngestReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.failures: List[Dict[str, object]] = []
+
+    def fail(self, row_no: int, error: str):
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_FAILURES:
+            self.failures.append({"row": row_no, "error": error})
+
+    def as_dict(self) -> Dict[str, object]:
+        elapsed = time.perf_counter() - self.started
+        written = self.inserted + self.updated
+        return {
+            "status": "Bulk upload finished",
+            "received": self.received,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "failures": self.failures,
+            "failures_truncated": self.failed > len(self.failures),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(written / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+def _flush(batch, encoder, connection, report: IngestReport):
+    if not batch:
+        return
+    by_id: Dict[int, Dict[str, object]] = {}
+    rows = []
+    for row in batch:
+        if row["id"] is not None:
+            previous = by_id.get(row["id"])
+            if previous is not None:
+                report.fail(
+                    previous["row_no"],
+                    f"Duplicate user_id {row['id']}; superseded by row {row['row_no']}",
+                )
+                rows.remove(previous)
+            by_id[row["id"]] = row
+        rows.append(row)
+    embeddings = encoder.encode([row["description"] for row in rows])
+    for row, embedding in zip(rows, embeddings):
+        row["embedding"] = list(embedding)
+    rejected = set()
+    try:
+        inserted, updated_rows = copy_users(connection, rows)
+    except PsycopgError:
+        # Retry row by row so the report names only the rows the database
+        # rejected, not every row that shared their batch.
+        inserted, updated_rows = 0, []
+        for row in rows:
+            try:
+                row_inserted, row_updated = copy_users(connection, [row])
+            except PsycopgError as e:
+                report.fail(row["row_no"], f"Database error: {str(e).strip()}")
+                rejected.add(row["row_no"])
+                continue
+            inserted += row_inserted
+            updated_rows += row_updated
+    updated = set(updated_rows)
+    report.inserted += inserted
+    report.updated += len(updated)
+    for row in rows:
+        if row["row_no"] in rejected:
+            continue
+        if row["id"] is not None and row["row_no"] not in updated:
+            report.fail(row["row_no"], f"User ID {row['id']} not found")
+
+
+def ingest_users(
+    stream: IO[bytes],
+    fmt: str,
+    encoder,
+    connection,
+    batch_size: int = INGEST_BATCH_SIZE,
+) -> Dict[str, object]:
+    report = IngestReport()
+    batch: List[Dict[str, object]] = []
+    for row_no, record in iter_records(stream, fmt):
+        report.received += 1
+        try:
+            row = parse_record(record)
+        except ValueError as e:
+            report.fail(row_no, str(e))
+            continue
+        row["row_no"] = row_no
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _flush(batch, encoder, connection, report)
+            batch = []
+    _flush(batch, encoder, connection, report)
+    return report.as_dict()
@@ -1,28 +1,171 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from .optimizer import optimize_query
-import psycopg2
+from .optimizer import analysis_cache, explain_executor, optimize_query
+from .rules import RULES
+from .db import (
+    get_connection,
+    release_connection,
+    get_pool,
+    close_pool,
+    current_pool,
+    pooled_connection,
+)
+from .metrics import MetricsMiddleware, memory_usage, registry, stage
+from .auth import (
+    HasherBusy,
+    PasswordHasher,
+    authorize,
+    create_access_token,
+    current_user,
+)
+from .embeddings import (
+    CachedEncoder,
+    EmbeddingCache,
+    MicroBatcher,
+    ModelLoader,
+    inference_executor,
+)
+from .concurrency import db_executor
+from .vector_mirror import VectorMirror
+from .reembed import reembed_status, search_model_filter
+from .nl_query import parse_nl_query, plan_filtered_search
+from .ingest import FORMATS, detect_format, ingest_users
+from .workload import (
+    WORKLOAD_FORMATS,
+    WORKLOAD_MAX_EXPLAINS,
+    WORKLOAD_MAX_WORKERS,
+    analyse_workload,
+    detect_workload_format,
+)
+from .vector_index import (
+    distance_operator,
+    list_indexes,
+    rerank_shortlist,
+    storage_mode,
+    validate_search_params,
+)
+from .search import (
+    HNSW_DEFAULT_EF_SEARCH,
+    SearchResultCache,
+    build_search_sql,
+    decode_cursor,
+    index_window,
+    iter_search_batches,
+    overfetch_window,
+    paginate,
+    search_generation,
+    search_page,
+)
 from psycopg2 import Error as PsycopgError
+from psycopg2.pool import PoolError
 from dotenv import load_dotenv
+import json
 import os
-import re
-from sentence_transformers import SentenceTransformer
-from jose import jwt
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
+import tempfile
+from typing import List, Optional
 
 load_dotenv()
 
 app = FastAPI()
-model = SentenceTransformer("all-MiniLM-L6-v2")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+model_loader = ModelLoader.from_env()
+batcher = MicroBatcher.from_env(model_loader)
+encoder = CachedEncoder(batcher, EmbeddingCache.from_env())
+search_cache = SearchResultCache.from_env()
+vector_mirror = VectorMirror.from_env()
+password_hasher = PasswordHasher.from_env()
+app.add_middleware(MetricsMiddleware)
+
+CACHES = {
+    "embedding": encoder.cache.stats,
+    "optimizer": analysis_cache.stats,
+    "search": search_cache.stats,
+}
+EXECUTORS = (db_executor, explain_executor, inference_executor)
+
+
+def _pool_stats():
+    pool = current_pool()
+    return pool.stats() if pool is not None else {}
+
+
+def _cache_samples(key: str):
+    return [({"cache": name}, stats()[key]) for name, stats in CACHES.items()]
+
+
+registry.gauge(
+    "iquerio_db_pool_connections",
+    "Pooled database connections by state",
+    lambda: [({"state": s}, _pool_stats().get(s)) for s in ("in_use", "idle")],
+)
+registry.gauge(
+    "iquerio_db_pool_max_connections",
+    "Maximum pooled database connections",
+    lambda: [({}, _pool_stats().get("max_size"))],
+)
+registry.gauge(
+    "iquerio_db_pool_timeouts_total",
+    "Checkouts that timed out waiting for a connection",
+    lambda: [({}, _pool_stats().get("timeouts"))],
+    kind="counter",
+)
+registry.gauge(
+    "iquerio_executor_tasks",
+    "Tasks per executor by state",
+    lambda: [
+        ({"executor": e.name, "state": state}, e.stats()[state])
+        for e in EXECUTORS
+        for state in ("running", "queued")
+    ],
+)
+registry.gauge(
+    "iquerio_cache_hits_total",
+    "Cache hits",
+    lambda: _cache_samples("hits"),
+    kind="counter",
+)
+registry.gauge(
+    "iquerio_cache_misses_total",
+    "Cache misses",
+    lambda: _cache_samples("misses"),
+    kind="counter",
+)
+registry.gauge(
+    "iquerio_cache_hit_ratio", "Cache hit ratio", lambda: _cache_samples("hit_ratio")
+)
+registry.gauge(
+    "iquerio_encode_queue_depth",
+    "Encode jobs waiting for the micro-batcher",
+    lambda: [({}, batcher.stats()["queue_depth"])],
+)
+registry.gauge(
+    "iquerio_process_memory_bytes",
+    "Resident memory of this worker (rss, pss: shared pages split between sharers)",
+    lambda: [
+        ({"pid": str(os.getpid()), "kind": kind}, (value or 0) * 1024)
+        for kind, value in memory_usage().items()
+    ],
+)
+registry.gauge(
+    "iquerio_vector_mirror_staleness_seconds",
+    "Seconds since the vector mirror last synced",
+    lambda: [({}, vector_mirror.staleness)],
+)
+registry.gauge(
+    "iquerio_password_hashes_pending",
+    "Password hash/verify calls admitted to the hashing pool",
+    lambda: [({}, password_hasher.stats()["pending"])],
+)
 
 
 class OptimizeRequest(BaseModel):
     query: str
+    use_cache: bool = True
+    rules: Optional[List[str]] = None
+    disabled_rules: Optional[List[str]] = None
+    advise_indexes: bool = False
+    advisor_mode: str = "auto"
+    analyze: bool = False
 
 
 class UploadEmbeddingRequest(BaseModel):
@@ -33,10 +176,24 @@ class UploadEmbeddingRequest(BaseModel):
 class SearchSimilarRequest(BaseModel):
     description: str
     limit: int = 3
+    distance: str = "l2"
+    storage: Optional[str] = None
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+    cursor: Optional[str] = None
+    stream: bool = False
 
 
 class NLQueryRequest(BaseModel):
     query: str
+    limit: int = 3
+    distance: str = "l2"
+    strategy: str = "auto"
+    storage: Optional[str] = None
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+    cursor: Optional[str] = None
+    stream: bool = False
 
 
 class RegisterRequest(BaseModel):
@@ -55,40 +212,40 @@ class Token(BaseModel):
     token_type: str
 
 
-def get_db_connection():
-    return psycopg2.connect(
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        database=os.getenv("DB_NAME"),
+@app.exception_handler(PoolError)
+async def pool_unavailable(request: Request, e: PoolError):
+    """Pool exhaustion (``PoolTimeout``) or a closed pool, from any endpoint."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Database unavailable: {e}"},
+        headers={"Retry-After": "1"},
     )
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def hashing_busy(e: HasherBusy) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"Password hashing is saturated: {e}",
+        headers={"Retry-After": "1"},
+    )
 
 
-def create_access_token(data: dict) -> str:
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+@app.post("/register")
+async def register_user(request: RegisterRequest):
+    try:
+        with stage("password_hash"):
+            password_hash = await password_hasher.hash(request.password)
+    except HasherBusy as e:
+        raise hashing_busy(e)
+    return await db_executor.run(insert_auth_user, request, password_hash)
 
 
-@app.post("/register")
-def register_user(request: RegisterRequest):
+def insert_auth_user(request: RegisterRequest, password_hash: str):
     connection = None
     cursor = None
     try:
-        connection = get_db_connection()
+        connection = get_connection()
         cursor = connection.cursor()
-        password_hash = hash_password(request.password)
         cursor.execute(
             """
             INSERT INTO auth_users (username, email, password_hash)
@@ -115,80 +272,284 @@ def register_user(request: RegisterRequest):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
 
 @app.post("/login", response_model=Token)
-def login_user(request: LoginRequest):
+async def login_user(request: LoginRequest):
+    user = await db_executor.run(fetch_auth_user, request.email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    try:
+        with stage("password_verify"):
+            valid, new_hash = await password_hasher.verify(request.password, user[3])
+    except HasherBusy as e:
+        raise hashing_busy(e)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if new_hash:
+        await db_executor.run(update_password_hash, user[0], new_hash)
+    access_token = create_access_token(data={"sub": user[2], "user_id": user[0]})
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+def fetch_auth_user(email: str):
     connection = None
     cursor = None
     try:
-        connection = get_db_connection()
+        connection = get_connection()
         cursor = connection.cursor()
         cursor.execute(
             "SELECT id, username, email, password_hash FROM auth_users WHERE email = %s",
-            (request.email,),
+            (email,),
         )
-        user = cursor.fetchone()
-        if not user or not verify_password(request.password, user[3]):
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-        access_token = create_access_token(data={"sub": user[2], "user_id": user[0]})
-        return {"access_token": access_token, "token_type": "bearer"}
+        return cursor.fetchone()
     except PsycopgError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
+
+
+def update_password_hash(user_id: int, password_hash: str):
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "UPDATE auth_users SET password_hash = %s WHERE id = %s",
+                (password_hash, user_id),
+            )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+@app.get("/me")
+async def read_current_user(claims: dict = Depends(current_user)):
+    return {
+        "user_id": claims.get("user_id"),
+        "email": claims.get("sub"),
+        "expires_at": claims.get("exp"),
+    }
+
+
+@app.get("/password-hasher")
+async def password_hasher_stats():
+    return password_hasher.stats()
+
+
+@app.on_event("startup")
+def preload_model():
+    if os.getenv("EMBEDDING_PRELOAD", "true").lower() == "true":
+        model_loader.start()
+    vector_mirror.start()
+
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    vector_mirror.close()
+    close_pool()
+    batcher.close()
+    password_hasher.shutdown()
+    db_executor.shutdown()
+    explain_executor.shutdown()
+    inference_executor.shutdown()
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "IQuerio MVP is alive."}
 
 
+@app.get("/health")
+async def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/ready")
+async def readiness():
+    status = model_loader.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not ready", **status})
+    return {"status": "ready", **status}
+
+
 @app.get("/db-test")
-def test_db_connection():
+async def test_db_connection():
+    return await db_executor.run(check_db_connection)
+
+
+def check_db_connection():
     connection = None
     cursor = None
     try:
-        connection = get_db_connection()
+        connection = get_connection()
         cursor = connection.cursor()
         cursor.execute("SELECT version();")
         version = cursor.fetchone()[0]
-        return {"status": "Connected", "version": version}
+        return {"status": "Connected", "version": version, "pool": get_pool().stats()}
     except PsycopgError as e:
         return {"status": "Failed", "error": str(e)}
     finally:
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
 
-@app.post("/optimize")
-def optimize_endpoint(request: OptimizeRequest):
-    result = optimize_query(request.query)
-    return {
+@app.get("/db-pool")
+async def db_pool_stats():
+    return {**get_pool().stats(), "executor": db_executor.stats()}
+
+
+@app.get("/search-cache")
+async def search_cache_stats():
+    return search_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/vector-mirror")
+async def vector_mirror_stats():
+    return vector_mirror.stats()
+
+
+@app.get("/reembed")
+async def reembed_progress():
+    def read_status():
+        with pooled_connection() as connection:
+            return reembed_status(connection)
+
+    try:
+        return await db_executor.run(read_status)
+    except PsycopgError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+
+@app.get("/embedding-cache")
+async def embedding_cache_stats():
+    return encoder.cache.stats()
+
+
+@app.get("/embedding-batcher")
+async def embedding_batcher_stats():
+    return batcher.stats()
+
+
+@app.get("/optimizer-cache")
+async def optimizer_cache_stats():
+    return analysis_cache.stats()
+
+
+@app.get("/optimizer-rules")
+async def optimizer_rules():
+    return [
+        {"name": rule.name, "description": rule.description} for rule in RULES.values()
+    ]
+
+
+@app.get("/vector-indexes")
+async def vector_indexes():
+    return await db_executor.run(fetch_vector_indexes)
+
+
+def fetch_vector_indexes():
+    connection = None
+    try:
+        connection = get_connection()
+        return {"indexes": list_indexes(connection)}
+    except PsycopgError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        if connection:
+            release_connection(connection)
+
+
+@app.post("/optimize", dependencies=[Depends(authorize)])
+async def optimize_endpoint(request: OptimizeRequest):
+    try:
+        result = await db_executor.run(
+            optimize_query,
+            request.query,
+            request.use_cache,
+            request.rules,
+            request.disabled_rules,
+            request.advise_indexes,
+            request.advisor_mode,
+            request.analyze,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response = {
         "query": request.query,
         "optimized_query": result["optimized_query"],
         "issues": result["issues"],
         "suggestions": result["suggestions"],
         "explain_plan": result["explain_plan"],
+        "plan_nodes": result["plan_nodes"],
+        "rewrite_check": result["rewrite_check"],
+        "rule_timings_ms": result["rule_timings_ms"],
+        "cache": result["cache"],
     }
+    if "index_advice" in result:
+        response["index_advice"] = result["index_advice"]
+    return response
+
+
+@app.post("/optimize-workload", dependencies=[Depends(authorize)])
+async def optimize_workload(
+    request: Request,
+    format: str = None,
+    top: int = 50,
+    workers: int = WORKLOAD_MAX_WORKERS,
+    max_explains: int = WORKLOAD_MAX_EXPLAINS,
+):
+    fmt = format or detect_workload_format(
+        content_type=request.headers.get("content-type")
+    )
+    if fmt not in WORKLOAD_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format, expected one of {WORKLOAD_FORMATS}",
+        )
+    # Every request starts its own process pool, so clients only get to
+    # lower the server's limits
+    workers = min(workers, WORKLOAD_MAX_WORKERS)
+    max_explains = min(max_explains, WORKLOAD_MAX_EXPLAINS)
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        try:
+            return await db_executor.run(
+                analyse_workload, body, fmt, workers, max_explains, top
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid workload: {e}")
 
 
-@app.post("/upload-embedding")
-def upload_embedding(request: UploadEmbeddingRequest):
+@app.post("/upload-embedding", dependencies=[Depends(authorize)])
+async def upload_embedding(request: UploadEmbeddingRequest):
+    embedding = await encoder.aencode_one(request.description)
+    return await db_executor.run(store_embedding, request, embedding)
+
+
+def store_embedding(request: UploadEmbeddingRequest, embedding):
     connection = None
     cursor = None
     try:
-        connection = get_db_connection()
+        connection = get_connection()
         cursor = connection.cursor()
-        embedding = model.encode([request.description], convert_to_tensor=False)[
-            0
-        ].tolist()
         cursor.execute(
             "UPDATE users SET description = %s, embedding = %s WHERE id = %s;",
             (request.description, embedding, request.user_id),
@@ -198,6 +559,7 @@ def upload_embedding(request: UploadEmbeddingRequest):
                 status_code=404, detail=f"User ID {request.user_id} not found"
             )
         connection.commit()
+        search_generation.bump()
         return {"status": "Embedding uploaded successfully", "user_id": request.user_id}
     except PsycopgError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
@@ -205,96 +567,236 @@ def upload_embedding(request: UploadEmbeddingRequest):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
 
-@app.post("/search-similar")
-def search_similar(request: SearchSimilarRequest):
+def run_bulk_upload(body, fmt: str):
     connection = None
-    cursor = None
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        embedding = model.encode([request.description], convert_to_tensor=False)[
-            0
-        ].tolist()
-        cursor.execute(
-            """
-            SELECT id, name, description, embedding <-> %s::vector AS distance
-            FROM users
-            ORDER BY distance
-            LIMIT %s;
-            """,
-            (embedding, request.limit),
-        )
-        results = cursor.fetchall()
-        return {
-            "results": [
-                {
-                    "id": row[0],
-                    "name": row[1],
-                    "description": row[2],
-                    "distance": row[3],
-                }
-                for row in results
-            ]
-        }
+        connection = get_connection()
+        # Straight to the batcher: bulk rows would only evict the request
+        # path's hot entries from the embedding cache.
+        return ingest_users(body, fmt, batcher, connection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
     except PsycopgError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
-        if cursor:
-            cursor.close()
+        search_generation.bump()
         if connection:
-            connection.close()
+            release_connection(connection)
 
 
-@app.post("/nl-query")
-def nl_query(request: NLQueryRequest):
-    connection = None
-    cursor = None
+@app.post("/bulk-upload-embeddings", dependencies=[Depends(authorize)])
+async def bulk_upload_embeddings(request: Request, format: str = None):
+    fmt = format or detect_format(request.headers.get("content-type"))
+    if fmt not in FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported format, expected one of {FORMATS}"
+        )
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        return await db_executor.run(run_bulk_upload, body, fmt)
+
+
+def _wants_stream(request: Request, stream: bool) -> bool:
+    return stream or "application/x-ndjson" in request.headers.get("accept", "")
+
+
+async def _ndjson_rows(pages):
     try:
-        query = request.query.lower()
-        age_match = re.search(r"users (?:over|older than) (\d+)", query)
-        desc_match = re.search(r'similar to ["\']?([^"\']+)["\']?', query)
-        sql = "SELECT id, name, description, embedding <-> %s::vector AS distance FROM users"
-        params = []
-        conditions = []
-        if desc_match:
-            desc = desc_match.group(1)
-            embedding = model.encode([desc], convert_to_tensor=False)[0].tolist()
-            params.append(embedding)
-        else:
-            raise HTTPException(
-                status_code=400, detail="No 'similar to' clause found in query"
+        while True:
+            page = await db_executor.run(next, pages, None)
+            if page is None:
+                break
+            rows, next_cursor = page
+            for row in rows:
+                yield json.dumps(row) + "\n"
+            if not rows:
+                yield json.dumps({"next_cursor": next_cursor}) + "\n"
+    except PsycopgError as e:
+        yield json.dumps({"error": f"Database error: {e}"}) + "\n"
+    finally:
+        await db_executor.run(pages.close)
+
+
+async def run_search(
+    http_request: Request,
+    request,
+    scope: str,
+    operator: str,
+    embedding,
+    conditions=(),
+    condition_params=(),
+    plan=None,
+):
+    plan = plan or {"name": "index"}
+    storage = storage_mode(request.storage)
+    try:
+        after = decode_cursor(request.cursor, scope) if request.cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    depth = after.depth if after is not None else 0
+    candidates = 0
+    if plan.get("overfetch"):
+        candidates = overfetch_window(plan["overfetch"], request.limit, after)
+    if storage != "full" and plan["name"] != "prefilter":
+        shortlist = rerank_shortlist(storage, request.limit, depth)
+        candidates = max(candidates, shortlist)
+    if plan["name"] == "index" and storage == "full":
+        window = index_window(request.limit, after)
+        if window > HNSW_DEFAULT_EF_SEARCH:
+            candidates = max(candidates, window)
+    ef_search = request.ef_search
+    if candidates and ef_search is None:
+        ef_search = min(candidates, 1000)
+    try:
+        sql, params = build_search_sql(
+            operator,
+            embedding,
+            request.limit,
+            conditions,
+            condition_params,
+            after,
+            plan["name"],
+            plan.get("overfetch"),
+            storage,
+        )
+        validate_search_params(ef_search, request.probes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    source = "postgres"
+    mirrored = not conditions and plan["name"] == "index" and storage == "full"
+    if mirrored and vector_mirror.fresh():
+        source, sql = "mirror", None
+        batches = vector_mirror.iter_batches(
+            embedding, operator, request.limit + 1, after
+        )
+    else:
+        batches = iter_search_batches(
+            sql,
+            params,
+            ef_search,
+            request.probes,
+            iterative_scan=plan["name"] == "iterative",
+        )
+    if _wants_stream(http_request, request.stream):
+        pages = paginate(batches, request.limit, scope, depth)
+        return StreamingResponse(_ndjson_rows(pages), media_type="application/x-ndjson")
+    try:
+        result = await db_executor.run(
+            search_page, batches, request.limit, scope, depth
+        )
+    except PsycopgError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    result["sql"] = sql
+    result["source"] = source
+    return result
+
+
+async def cached_search(http_request: Request, request, key, compute):
+    if _wants_stream(http_request, request.stream):
+        return await compute()
+    key += (
+        request.limit,
+        request.distance,
+        storage_mode(request.storage),
+        request.ef_search,
+        request.probes,
+    )
+    result, cache = await search_cache.get_or_compute(key + (request.cursor,), compute)
+    return {**result, "cache": cache}
+
+
+async def plan_search(request, conditions, params, strategy="auto"):
+    """Filtered-search plan (see ``nl_query.plan_filtered_search``)."""
+
+    def plan():
+        with pooled_connection() as connection:
+            return plan_filtered_search(
+                connection,
+                request.distance,
+                conditions,
+                params,
+                request.limit,
+                strategy,
             )
-        if age_match:
-            age = int(age_match.group(1))
-            conditions.append("age > %s")
-            params.append(age)
-        if conditions:
-            sql += " WHERE " + " AND ".join(conditions)
-        sql += " ORDER BY distance LIMIT 3"
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute(sql, params)
-        results = cursor.fetchall()
-        return {
-            "results": [
-                {
-                    "id": row[0],
-                    "name": row[1],
-                    "description": row[2],
-                    "distance": row[3],
-                }
-                for row in results
-            ],
-            "sql": sql,
-            "params": params,
-        }
+
+    try:
+        with stage("nl_plan"):
+            return await db_executor.run(plan)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except PsycopgError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+
+
+@app.post("/search-similar", dependencies=[Depends(authorize)])
+async def search_similar(request: SearchSimilarRequest, http_request: Request):
+    try:
+        operator = distance_operator(request.distance)
+        storage_mode(request.storage)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    scope = json.dumps(["search-similar", request.description, request.distance])
+
+    conditions, params = search_model_filter()
+
+    async def compute():
+        embedding = await encoder.aencode_one(request.description)
+        # The model filter skips rows of the other model while a re-embedding
+        # runs, so it needs a filtered-search plan like /nl-query's
+        plan = await plan_search(request, conditions, params) if conditions else None
+        result = await run_search(
+            http_request, request, scope, operator, embedding, conditions, params, plan
+        )
+        if isinstance(result, dict):
+            result.pop("sql")
+        return result
+
+    key = ("search-similar", encoder.cache.normalize(request.description))
+    return await cached_search(http_request, request, key, compute)
+
+
+@app.post("/nl-query", dependencies=[Depends(authorize)])
+async def nl_query(request: NLQueryRequest, http_request: Request):
+    try:
+        operator = distance_operator(request.distance)
+        storage_mode(request.storage)
+        parsed = parse_nl_query(request.query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "limit" not in request.model_fields_set and parsed.limit:
+        request = request.model_copy(update={"limit": parsed.limit})
+    scope = json.dumps(["nl-query", request.query.lower(), request.distance])
+    conditions, params = search_model_filter(parsed.conditions, parsed.params)
+
+    async def compute():
+        embedding = await encoder.aencode_one(parsed.description)
+        plan = await plan_search(request, conditions, params, request.strategy)
+        result = await run_search(
+            http_request,
+            request,
+            scope,
+            operator,
+            embedding,
+            conditions,
+            params,
+            plan,
+        )
+        if isinstance(result, dict):
+            result.update(
+                params=parsed.params, predicates=parsed.predicates, strategy=plan
+            )
+        return result
+
+    key = (
+        "nl-query",
+        encoder.cache.normalize(parsed.description),
+        tuple(parsed.conditions),
+        tuple(parsed.params),
+        request.strategy,
+    )
+    return await cached_search(http_request, request, key, compute)
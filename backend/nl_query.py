@@ -0,0 +1,186 @@
+import math
+import os
+import re
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .query_cache import TTLCache
+from .vector_index import DISTANCES, list_indexes
+
+load_dotenv()
+
+STRATEGIES = ("auto", "index", "prefilter", "overfetch", "iterative")
+NL_PREFILTER_MAX_ROWS = int(os.getenv("NL_PREFILTER_MAX_ROWS", "20000"))
+NL_OVERFETCH_MIN_SELECTIVITY = float(os.getenv("NL_OVERFETCH_MIN_SELECTIVITY", "0.05"))
+NL_OVERFETCH_FACTOR = float(os.getenv("NL_OVERFETCH_FACTOR", "2.0"))
+NL_OVERFETCH_MAX_ROWS = int(os.getenv("NL_OVERFETCH_MAX_ROWS", "1000"))
+
+_SIMILAR = re.compile(r'similar to ["\']?([^"\']+)["\']?')
+_AGE_RANGE = re.compile(
+    r"\b(?:aged?|ages?)?\s*(?:between|from)\s+(\d+)\s+(?:and|to)\s+(\d+)"
+    r"|\baged?\s+(\d+)\s*(?:-|to)\s*(\d+)"
+)
+_AGE_COMPARISONS = [
+    (re.compile(r"\b(?:aged?\s+)?at least (\d+)(?! (?:users|people|results))"), ">="),
+    (re.compile(r"\b(?:aged?\s+)?at most (\d+)(?! (?:users|people|results))"), "<="),
+    (re.compile(r"\b(?:over|older than|above)\s+(\d+)"), ">"),
+    (re.compile(r"\b(?:under|younger than|below)\s+(\d+)"), "<"),
+    (re.compile(r"\baged?\s+(\d+)\b"), "="),
+]
+_NAME_MATCHES = [
+    (re.compile(r"\bname (?:starts|starting|begins|beginning) with ([\w'-]+)"), "{}%"),
+    (re.compile(r"\bname (?:ends|ending) with ([\w'-]+)"), "%{}"),
+    (re.compile(r"\bname (?:contains|containing|includes|like) ([\w'-]+)"), "%{}%"),
+    (re.compile(r"\b(?:named|called|name is) ([\w'-]+)"), "{}"),
+]
+_COUNT = re.compile(
+    r"\b(?:top|first|limit|show(?: me)?|find|get)\s+(\d+)\b"
+    r"|\b(\d+)\s+(?:users|people|results|matches|profiles)\b"
+)
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class NLQuery:
+    def __init__(self, description: str):
+        self.description = description
+        self.conditions: List[str] = []
+        self.params: List[object] = []
+        self.predicates: List[str] = []
+        self.limit: Optional[int] = None
+
+    def add(self, condition: str, params: List[object], predicate: str):
+        self.conditions.append(condition)
+        self.params += params
+        self.predicates.append(predicate)
+
+
+def parse_nl_query(text: str) -> NLQuery:
+    """Turns e.g. "top 5 users aged 25 to 35 named sam similar to 'AI'" into
+    a description to embed plus SQL filter conditions and a result count.
+    """
+    text = text.lower()
+    similar = _SIMILAR.search(text)
+    if not similar:
+        raise ValueError("No 'similar to' clause found in query")
+    query = NLQuery(similar.group(1).strip())
+    rest = text[: similar.start()] + " " + text[similar.end() :]
+
+    age_range = _AGE_RANGE.search(rest)
+    if age_range:
+        low, high = sorted(int(g) for g in age_range.groups() if g is not None)
+        query.add("age BETWEEN %s AND %s", [low, high], f"age {low}-{high}")
+        rest = rest[: age_range.start()] + rest[age_range.end() :]
+    for pattern, operator in _AGE_COMPARISONS:
+        match = pattern.search(rest)
+        if match:
+            age = int(match.group(1))
+            query.add(f"age {operator} %s", [age], f"age {operator} {age}")
+            rest = rest[: match.start()] + rest[match.end() :]
+
+    for pattern, template in _NAME_MATCHES:
+        match = pattern.search(rest)
+        if match:
+            value = template.format(_like_escape(match.group(1)))
+            query.add("name ILIKE %s", [value], f"name ILIKE {value}")
+            rest = rest[: match.start()] + rest[match.end() :]
+            break
+
+    count = _COUNT.search(rest)
+    if count:
+        query.limit = int(count.group(1) or count.group(2))
+    return query
+
+
+_catalog = TTLCache(maxsize=8, ttl=float(os.getenv("NL_PLANNER_CATALOG_TTL", "60")))
+
+
+def _catalog_info(connection, distance: str) -> Dict[str, object]:
+    info, _ = _catalog.get(distance)
+    if info is None:
+        opclass = DISTANCES[distance][1]
+        indexes = [i for i in list_indexes(connection) if opclass in i["definition"]]
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+            )
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        version = tuple(int(p) for p in re.findall(r"\d+", row[0])[:2]) if row else ()
+        info = {
+            "index": indexes[0]["name"] if indexes else None,
+            "iterative_scan": version >= (0, 8),
+        }
+        _catalog.set(distance, info)
+    return info
+
+
+def _estimated_rows(cursor, conditions: List[str], params: List[object]) -> float:
+    sql = "EXPLAIN (FORMAT JSON) SELECT 1 FROM users WHERE embedding IS NOT NULL"
+    if conditions:
+        sql += " AND " + " AND ".join(conditions)
+    cursor.execute(sql, params)
+    return float(cursor.fetchone()[0][0]["Plan"]["Plan Rows"])
+
+
+def plan_filtered_search(
+    connection,
+    distance: str,
+    conditions: List[str],
+    params: List[object],
+    limit: int,
+    strategy: str = "auto",
+) -> Dict[str, object]:
+    """Chooses how to combine the filters with the k-NN search.
+
+    - ``prefilter``: filter first, then exact distance sort over the matches.
+      Always correct; chosen when few rows match, or for filtered searches
+      without an ANN index.
+    - ``overfetch``: ANN search for ``limit / selectivity`` candidates, then
+      filter. Chosen when the filters keep a large fraction of rows.
+    - ``iterative``: pgvector >= 0.8 iterative index scans, which keep
+      scanning the index until enough rows pass the filters.
+    - ``index``: plain top-N by distance (no filters); an ANN search if
+      there is an index, else one sequential scan.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}")
+    info = _catalog_info(connection, distance)
+    if strategy == "iterative" and not info["iterative_scan"]:
+        raise ValueError("The iterative strategy needs pgvector 0.8 or later")
+    plan = {"name": strategy, "index": info["index"], "reason": "requested"}
+    cursor = connection.cursor()
+    try:
+        total = _estimated_rows(cursor, [], [])
+        matching = _estimated_rows(cursor, conditions, params) if conditions else total
+    finally:
+        cursor.close()
+        connection.rollback()
+    selectivity = matching / total if total else 1.0
+    plan.update(estimated_rows=round(matching), selectivity=round(selectivity, 4))
+
+    if strategy == "auto":
+        if not conditions:
+            plan.update(name="index", reason="no filters")
+        elif not info["index"]:
+            plan.update(name="prefilter", reason=f"no ANN index for {distance}")
+        elif matching <= NL_PREFILTER_MAX_ROWS:
+            plan.update(name="prefilter", reason="few rows match the filters")
+        elif selectivity >= NL_OVERFETCH_MIN_SELECTIVITY:
+            plan.update(name="overfetch", reason="filters keep most rows")
+        elif info["iterative_scan"]:
+            plan.update(name="iterative", reason="selective filters on a large table")
+        else:
+            plan.update(
+                name="overfetch",
+                reason="selective filters; pgvector < 0.8 has no iterative scans",
+            )
+    if plan["name"] == "overfetch":
+        wanted = math.ceil((limit + 1) * NL_OVERFETCH_FACTOR / max(selectivity, 1e-6))
+        plan["overfetch"] = min(max(wanted, limit + 1), NL_OVERFETCH_MAX_ROWS)
+    return plan
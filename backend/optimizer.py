@@ -1,16 +1,249 @@
+import contextlib
 import sqlparse
-from sqlparse.sql import Where
-from typing import Dict, List
+from sqlparse import tokens as T
+from typing import ContextManager, Dict, List, Optional, Sequence, Tuple
 import psycopg2
 from psycopg2 import OperationalError
 from psycopg2.errors import UndefinedTable
+from psycopg2.pool import PoolError
+from .db import pooled_connection
+from .metrics import stage
+from .concurrency import BoundedExecutor
+from .query_cache import (
+    TTLCache,
+    fingerprint_query,
+    placeholder_count,
+    schema_version,
+)
+from .rules import run_rules, select_rules
+from .plan_analysis import (
+    PLAN_ANALYZE_TIMEOUT_MS,
+    analyze_plan,
+    explain_json,
+    install_explain,
+    seq_scan_relations,
+)
+from .index_advisor import ADVISOR_MODES, AdvisorUnavailable, recommend_indexes
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+analysis_cache = TTLCache(
+    maxsize=int(os.getenv("OPTIMIZER_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("OPTIMIZER_CACHE_TTL", "300")),
+)
+_cache_schema_version = None
+explain_executor = BoundedExecutor(
+    "explain", int(os.getenv("OPTIMIZER_EXPLAIN_WORKERS", "4"))
+)
 
-def optimize_query(query: str) -> Dict[str, any]:
+
+def _has_code(statement) -> bool:
+    return any(
+        not token.is_whitespace and token.ttype not in T.Comment
+        for token in statement.flatten()
+    )
+
+
+def apply_rewrites(
+    query: str,
+    rewrites: List[Tuple[str, str]],
+    edits: Sequence[Tuple[int, str, str]] = (),
+) -> str:
+    """Applies the rules' ``edits`` (``new`` for the ``old`` text at one
+    offset of ``query``) and then their ``rewrites`` (``new`` for every
+    occurrence of ``old``).
+    """
+    for offset, old, new in sorted(edits, reverse=True):
+        if query[offset : offset + len(old)] == old:
+            query = query[:offset] + new + query[offset + len(old) :]
+    optimized_query = query.strip()
+    for old, new in rewrites:
+        optimized_query = optimized_query.replace(old, new)
+    return optimized_query
+
+
+def _explain_generic(connection, cursor, query: str, parameters: int):
+    """Plan of a query with ``$n`` placeholders. PostgreSQL 16 explains it
+    directly with GENERIC_PLAN; older servers prepare it and explain a
+    forced generic plan, which never looks at the NULLs passed to EXECUTE.
+    """
+    if connection.server_version >= 160000:
+        return explain_json(cursor, query, "GENERIC_PLAN, FORMAT JSON")
+    cursor.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+    cursor.execute(
+        "SELECT pg_temp.iquerio_execute(%s)",
+        (f"PREPARE iquerio_generic AS {query}",),
+    )
+    try:
+        nulls = ", ".join(["NULL"] * parameters)
+        cursor.execute(f"EXPLAIN (FORMAT JSON) EXECUTE iquerio_generic ({nulls})")
+        return cursor.fetchall()[0][0]
+    finally:
+        # Prepared statements outlive the transaction
+        connection.rollback()
+        cursor.execute("DEALLOCATE iquerio_generic")
+
+
+def _relation_rows(cursor, relations: List[str]) -> Dict[str, float]:
+    cursor.execute(
+        "SELECT name, c.reltuples FROM unnest(%s::text[]) AS name "
+        "JOIN pg_class c ON c.oid = to_regclass(quote_ident(name))",
+        (relations,),
+    )
+    return dict(cursor.fetchall())
+
+
+def explain(
+    query: str,
+    analyze: bool = False,
+    relation_rows: Optional[Dict] = None,
+    limiter: Optional[ContextManager] = None,
+):
+    """EXPLAIN (FORMAT JSON) of ``query``. If a ``relation_rows`` dict is
+    given, it is filled with the ``reltuples`` of every relation the plan
+    scans sequentially. A ``limiter`` (e.g. a semaphore) is held around it.
+    """
+    parameters = placeholder_count(query)
+    limiter = limiter or contextlib.nullcontext()
+    with stage("explain"), limiter, pooled_connection() as connection:
+        install_explain(connection)
+        cursor = connection.cursor()
+        try:
+            if analyze:
+                cursor.execute(
+                    "SET LOCAL statement_timeout = %s", (PLAN_ANALYZE_TIMEOUT_MS,)
+                )
+                explain_plan = explain_json(
+                    cursor, query, "ANALYZE, BUFFERS, FORMAT JSON"
+                )
+            else:
+                # Plain EXPLAIN never writes, so nothing the input smuggles
+                # in can either
+                cursor.execute("SET TRANSACTION READ ONLY")
+                if parameters:
+                    explain_plan = _explain_generic(
+                        connection, cursor, query, parameters
+                    )
+                else:
+                    explain_plan = explain_json(cursor, query)
+            relations = seq_scan_relations(explain_plan[0]["Plan"])
+            if relation_rows is not None and relations and not analyze:
+                relation_rows.update(_relation_rows(cursor, relations))
+            return explain_plan
+        finally:
+            cursor.close()
+            connection.rollback()
+
+
+def _plan_estimate(explain_plan) -> Dict[str, float]:
+    plan = explain_plan[0]["Plan"]
+    return {"total_cost": plan.get("Total Cost"), "plan_rows": plan.get("Plan Rows")}
+
+
+def _result(pending):
+    """Plan from an EXPLAIN future, or the reason it has none."""
+    try:
+        return pending.result()
+    except (psycopg2.Error, PoolError) as e:
+        return f"EXPLAIN skipped: {str(e).strip()}"
+
+
+def check_rewrite(explain_plan, pending) -> Dict[str, any]:
+    check = {
+        "status": "unverified",
+        "reason": None,
+        "original": None,
+        "rewritten": None,
+    }
+    if isinstance(explain_plan, str):
+        check["reason"] = explain_plan
+        return check
+    check["original"] = _plan_estimate(explain_plan)
+    if pending is None:
+        check["reason"] = "EXPLAIN of the rewrite skipped"
+        return check
+    try:
+        check["rewritten"] = _plan_estimate(pending.result())
+    except (OperationalError, PoolError) as e:
+        check["reason"] = f"EXPLAIN of the rewrite skipped: {str(e).strip()}"
+        return check
+    except psycopg2.Error as e:
+        check["status"] = "rejected"
+        check["reason"] = f"Rewrite failed to plan: {str(e).strip()}"
+        return check
+    delta = check["rewritten"]["total_cost"] - check["original"]["total_cost"]
+    check["cost_delta"] = round(delta, 2)
+    if delta > 0:
+        check["status"] = "rejected"
+        check["reason"] = "Rewrite has a higher estimated cost"
+    else:
+        check["status"] = "verified"
+    return check
+
+
+def plan_findings(
+    query: str, analyze: bool = False, limiter: Optional[ContextManager] = None
+) -> Dict[str, any]:
+    """EXPLAIN-based findings. They depend only on the query's shape, so they
+    are cached by fingerprint and shared between queries that differ only in
+    their literals.
+    """
+    findings = {
+        "explain_plan": "N/A",
+        "plan_nodes": [],
+        "issues": [],
+        "suggestions": [],
+        "cacheable": not analyze,
+    }
+    try:
+        if os.getenv("ENV") == "test":
+            raise OperationalError("Skipping EXPLAIN in test mode")
+        relation_rows = {}
+        explain_plan = explain(query, analyze, relation_rows, limiter)
+        analysis = analyze_plan(explain_plan[0]["Plan"], analyze, relation_rows)
+        findings.update(
+            explain_plan=explain_plan,
+            plan_nodes=analysis["nodes"],
+            issues=analysis["issues"],
+            suggestions=analysis["suggestions"],
+        )
+    except (OperationalError, UndefinedTable, PoolError) as e:
+        findings["explain_plan"] = f"EXPLAIN skipped: {str(e)}"
+        findings["cacheable"] = os.getenv("ENV") == "test" or isinstance(
+            e, UndefinedTable
+        )
+    return findings
+
+
+def index_advice(
+    query: str, stmt, mode: str = "auto", limiter: Optional[ContextManager] = None
+) -> Dict[str, any]:
+    if os.getenv("ENV") == "test":
+        return {"mode": mode, "skipped": "Skipping index advisor in test mode"}
+    limiter = limiter or contextlib.nullcontext()
+    try:
+        with stage("index_advisor"), limiter, pooled_connection() as connection:
+            return recommend_indexes(connection, query, stmt, mode)
+    except (AdvisorUnavailable, psycopg2.Error, PoolError) as e:
+        return {"mode": mode, "skipped": str(e).strip()}
+
+
+def optimize_query(
+    query: str,
+    use_cache: bool = True,
+    rules: Optional[List[str]] = None,
+    disabled_rules: Optional[List[str]] = None,
+    advise_indexes: bool = False,
+    advisor_mode: str = "auto",
+    analyze: bool = False,
+    limiter: Optional[ContextManager] = None,
+) -> Dict[str, any]:
+    """Rule and EXPLAIN findings for ``query``. Every EXPLAIN it runs holds
+    ``limiter``, if one is given.
+    """
+    global _cache_schema_version
     parsed = sqlparse.parse(query)
 
     if not parsed:
@@ -20,93 +253,87 @@ def optimize_query(query: str) -> Dict[str, any]:
             "issues": ["Invalid SQL query"],
             "suggestions": [],
             "explain_plan": "N/A",
+            "plan_nodes": [],
+            "rewrite_check": {"status": "unchanged"},
+            "rule_timings_ms": {},
+            "cache": {"hit": False},
         }
-    stmt = parsed[0]
-
-    issues: List[str] = []
-    suggestions: List[str] = []
-    optimized_query = query.strip()
-    explain_plan = "N/A"
-    query_upper = query.upper().strip()
-
-    print("Tokens:", [str(t).strip() for t in stmt.tokens if str(t).strip()])
 
-    if stmt.get_type().upper() == "SELECT" and "SELECT *" in query_upper:
-        issues.append("SELECT * fetches unnecessary columns (slow and risky).")
-        suggestions.append(
-            "Replace with specific columns, e.g., SELECT id, name FROM table."
+    # Fails fast with a 400; explain() does not depend on this check
+    if sum(1 for statement in parsed if _has_code(statement)) > 1:
+        raise ValueError("Only one SQL statement can be optimized at a time")
+    if advisor_mode not in ADVISOR_MODES:
+        raise ValueError(
+            f"Unknown advisor mode '{advisor_mode}', expected one of {ADVISOR_MODES}"
         )
-        optimized_query = optimized_query.replace(
-            "SELECT *", "SELECT id, name"
-        ).replace("select *", "SELECT id, name")
-
-    join_count = query_upper.count("JOIN")
-    table_names = []
-    for token in stmt.tokens:
-        if isinstance(token, sqlparse.sql.Identifier):
-            table_name = str(token).strip().lower()
-            if table_name not in table_names:
-                table_names.append(table_name)
-
-    if join_count > 0 and len(table_names) < join_count + 1:
-        issues.append("Possible redundant JOIN: Joining the same table multiple times.")
-        suggestions.append("Check if multiple JOINs to the same table are necessary.")
+    if analyze and placeholder_count(query):
+        raise ValueError("EXPLAIN ANALYZE needs literal values, not $n placeholders")
+    fingerprint, _ = fingerprint_query(query)
+    selected = tuple(rule.name for rule in select_rules(rules, disabled_rules))
+    version = schema_version.current()
+    if version != _cache_schema_version:
+        analysis_cache.clear()
+        _cache_schema_version = version
 
-    try:
-        if os.getenv("ENV") == "test":
-            raise OperationalError("Skipping EXPLAIN in test mode")
+    use_cache = use_cache and not analyze
+    # Rules are cheap and their rewrites are literal-specific, so they run
+    # on every query; only the EXPLAIN findings are shared by fingerprint.
+    with stage("rules"):
+        ctx, rule_timings = run_rules(query, parsed[0], list(selected))
+    rewritten = apply_rewrites(query, ctx.rewrites, ctx.edits)
+    plan_key = ("plan", fingerprint)
+    plan, age = analysis_cache.get(plan_key) if use_cache else (None, None)
+    hit = plan is not None
 
-        connection = psycopg2.connect(
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            database=os.getenv("DB_NAME"),
+    rewrite_check = {"status": "unchanged"}
+    rewrite_key = ("rewrite", query.strip(), rewritten)
+    pending = None
+    original = None
+    if rewritten != query.strip():
+        rewrite_check, _ = (
+            analysis_cache.get(rewrite_key) if use_cache else (None, None)
         )
-        cursor = connection.cursor()
-        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
-        explain_plan = cursor.fetchall()[0][0]
-        cursor.close()
-        connection.close()
-
-        plan = explain_plan[0]["Plan"]
-        if plan.get("Node Type") == "Seq Scan":
-            issues.append("Query uses a sequential scan (slow for large tables).")
-            suggestions.append("Consider adding an index on filtered columns.")
-        total_cost = plan.get("Total Cost", 0.0)
-        if total_cost > 1000:
-            issues.append(f"High query cost ({total_cost:.2f}): Likely inefficient.")
-            suggestions.append("Optimize filters or add indexes to reduce cost.")
-
-    except (OperationalError, UndefinedTable) as e:
-        explain_plan = f"EXPLAIN skipped: {str(e)}"
-
-    where_clause_obj = None
-    for token in stmt.tokens:
-        if isinstance(token, Where):
-            where_clause_obj = token
-            break
-
-    if where_clause_obj:
-        where_clause = str(where_clause_obj).lower().replace("  ", " ")
-        print("WHERE clause:", where_clause)
-
-        if "+" in where_clause or "-" in where_clause:
-            issues.append("Expressions in WHERE (e.g., age + 1) prevent index usage.")
-            suggestions.append("Simplify to direct column comparisons, e.g., age > 29.")
-            if "age + 1 > 30" in where_clause:
-                optimized_query = optimized_query.replace("age + 1 > 30", "age > 29")
-            optimized_query = optimized_query.replace("age - 1", "age")
-
-        if "age" in where_clause:
-            suggestions.append("Add an index: CREATE INDEX idx_age ON users(age);")
-    else:
-        suggestions.append("Consider adding a WHERE clause to filter data early.")
+        explainable = os.getenv("ENV") != "test" and not (
+            hit and isinstance(plan["explain_plan"], str)
+        )
+        if rewrite_check is None and explainable:
+            pending = explain_executor.submit(explain, rewritten, limiter=limiter)
+            if hit:
+                # The cached plan is another query's with the same
+                # fingerprint; its literals may plan differently.
+                original = explain_executor.submit(explain, query, limiter=limiter)
+    if not hit:
+        plan = plan_findings(query, analyze, limiter)
+        if use_cache and plan["cacheable"]:
+            analysis_cache.set(plan_key, plan)
+    for issue in plan["issues"]:
+        ctx.issue(issue)
+    for suggestion in plan["suggestions"]:
+        ctx.suggest(suggestion)
+    if rewrite_check is None:
+        baseline = plan["explain_plan"] if original is None else _result(original)
+        rewrite_check = check_rewrite(baseline, pending)
+        if use_cache and rewrite_check["status"] != "unverified":
+            analysis_cache.set(rewrite_key, rewrite_check)
+    rejected = rewrite_check["status"] == "rejected"
+    rewrites, edits = ([], []) if rejected else (ctx.rewrites, ctx.edits)
 
-    return {
+    result = {
         "original_query": query,
-        "optimized_query": optimized_query,
-        "issues": issues,
-        "suggestions": suggestions,
-        "explain_plan": explain_plan,
+        "optimized_query": apply_rewrites(query, rewrites, edits),
+        "issues": ctx.issues,
+        "suggestions": ctx.suggestions,
+        "explain_plan": plan["explain_plan"],
+        "plan_nodes": plan["plan_nodes"],
+        "rewrite_check": rewrite_check,
+        "rule_timings_ms": rule_timings,
+        "cache": {
+            "hit": hit,
+            "fingerprint": fingerprint,
+            "age_seconds": round(age, 3) if hit else None,
+            "schema_version": list(version),
+        },
     }
+    if advise_indexes:
+        result["index_advice"] = index_advice(query, parsed[0], advisor_mode, limiter)
+    return result
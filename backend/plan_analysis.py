@@ -0,0 +1,212 @@
+import os
+import weakref
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PLAN_HIGH_COST = float(os.getenv("PLAN_HIGH_COST", "1000"))
+PLAN_SEQ_SCAN_ROWS = int(os.getenv("PLAN_SEQ_SCAN_ROWS", "10000"))
+PLAN_MISESTIMATE_FACTOR = float(os.getenv("PLAN_MISESTIMATE_FACTOR", "10"))
+PLAN_NESTED_LOOP_OUTER_ROWS = int(os.getenv("PLAN_NESTED_LOOP_OUTER_ROWS", "1000"))
+PLAN_ANALYZE_TIMEOUT_MS = int(os.getenv("PLAN_ANALYZE_TIMEOUT_MS", "5000"))
+
+# User SQL is never sent as query text: it is bound as a string and run by
+# these session-local functions. A function cannot COMMIT, so a second
+# statement hidden from a client-side parser (e.g. behind a backslash in a
+# standard string) cannot end the transaction the caller rolls back. They are
+# created once per connection: the CREATE is DDL, and running it for every
+# EXPLAIN made concurrent EXPLAINs queue behind each other's DDL.
+EXPLAIN_FUNCTIONS_SQL = """
+    CREATE OR REPLACE FUNCTION pg_temp.iquerio_explain(statement TEXT)
+    RETURNS SETOF JSON LANGUAGE plpgsql AS $$
+    BEGIN
+        RETURN QUERY EXECUTE statement;
+    END;
+    $$;
+    CREATE OR REPLACE FUNCTION pg_temp.iquerio_execute(statement TEXT)
+    RETURNS VOID LANGUAGE plpgsql AS $$
+    BEGIN
+        EXECUTE statement;
+    END;
+    $$;
+"""
+
+BUFFER_FIELDS = {
+    "Shared Hit Blocks": "shared_hit",
+    "Shared Read Blocks": "shared_read",
+    "Shared Dirtied Blocks": "shared_dirtied",
+    "Temp Read Blocks": "temp_read",
+    "Temp Written Blocks": "temp_written",
+}
+
+
+_explain_sessions = weakref.WeakSet()
+
+
+def install_explain(connection):
+    """Creates the EXPLAIN functions in the connection's session, once.
+
+    The creation is committed so the functions outlive the caller's
+    rolled-back transaction; call this before anything else in it.
+    """
+    if connection in _explain_sessions:
+        return
+    cursor = connection.cursor()
+    try:
+        cursor.execute(EXPLAIN_FUNCTIONS_SQL)
+        connection.commit()
+    finally:
+        cursor.close()
+    _explain_sessions.add(connection)
+
+
+def explain_json(cursor, query: str, options: str = "FORMAT JSON") -> List[Dict]:
+    """``EXPLAIN (options) query`` through ``pg_temp.iquerio_explain``;
+    ``install_explain`` must have run on the connection.
+    """
+    cursor.execute(
+        "SELECT pg_temp.iquerio_explain(%s)", (f"EXPLAIN ({options}) {query}",)
+    )
+    return cursor.fetchone()[0]
+
+
+def walk_plan(plan: Dict, depth: int = 0) -> Iterator[Tuple[Dict, int]]:
+    yield plan, depth
+    for child in plan.get("Plans", []):
+        yield from walk_plan(child, depth + 1)
+
+
+def _rows(node: Dict, analyzed: bool) -> float:
+    if analyzed and "Actual Rows" in node:
+        return node["Actual Rows"] * node.get("Actual Loops", 1)
+    return node.get("Plan Rows", 0)
+
+
+def _scanned_rows(node: Dict, analyzed: bool, relation_rows: Dict[str, float]) -> float:
+    """Rows a scan reads per loop, not the rows it returns: the filter may
+    discard most of a large relation.
+    """
+    if analyzed and "Actual Rows" in node:
+        return node["Actual Rows"] + node.get("Rows Removed by Filter", 0)
+    # reltuples is -1 for a table that was never vacuumed or analyzed
+    reltuples = relation_rows.get(node.get("Relation Name"), -1)
+    return reltuples if reltuples >= 0 else node.get("Plan Rows", 0)
+
+
+def seq_scan_relations(plan: Dict) -> List[str]:
+    return sorted(
+        {
+            node["Relation Name"]
+            for node, _ in walk_plan(plan)
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name")
+        }
+    )
+
+
+def _label(node: Dict) -> str:
+    relation = node.get("Relation Name")
+    return f"{node['Node Type']} on {relation}" if relation else node["Node Type"]
+
+
+def _spill(node: Dict) -> Optional[str]:
+    if node.get("Sort Space Type") == "Disk" or "external" in node.get(
+        "Sort Method", ""
+    ):
+        return f"{node.get('Sort Method', 'sort')} ({node.get('Sort Space Used')} kB)"
+    if node.get("Hash Batches", 1) > 1:
+        return f"{node['Hash Batches']} hash batches"
+    if node.get("Temp Written Blocks"):
+        return f"{node['Temp Written Blocks']} temp blocks written"
+    return None
+
+
+def node_summary(node: Dict, depth: int, analyzed: bool) -> Dict[str, object]:
+    summary = {
+        "depth": depth,
+        "node_type": node["Node Type"],
+        "relation": node.get("Relation Name"),
+        "index": node.get("Index Name"),
+        "estimated_rows": node.get("Plan Rows"),
+        "total_cost": node.get("Total Cost"),
+    }
+    if analyzed and "Actual Rows" in node:
+        loops = node.get("Actual Loops", 1)
+        summary.update(
+            actual_rows=node["Actual Rows"],
+            loops=loops,
+            time_ms=round(node.get("Actual Total Time", 0.0) * loops, 3),
+            buffers={
+                key: node[field]
+                for field, key in BUFFER_FIELDS.items()
+                if field in node
+            },
+        )
+    return summary
+
+
+def analyze_plan(
+    plan: Dict,
+    analyzed: bool = False,
+    relation_rows: Optional[Dict[str, float]] = None,
+) -> Dict[str, List]:
+    """Walks every node of an EXPLAIN (FORMAT JSON) plan.
+
+    Flags sequential scans on large relations, row misestimates (only with
+    ANALYZE), sorts and hashes spilling to disk and nested loops driven by a
+    large outer side, at any depth of the tree. A scan's size is the rows it
+    read under ANALYZE, else the relation's ``reltuples`` from
+    ``relation_rows``, else its estimated output rows.
+    """
+    relation_rows = relation_rows or {}
+    issues: List[str] = []
+    suggestions: List[str] = []
+    nodes = []
+    for node, depth in walk_plan(plan):
+        nodes.append(node_summary(node, depth, analyzed))
+        label = f"{_label(node)} (depth {depth})"
+
+        if node["Node Type"] == "Seq Scan":
+            scanned = _scanned_rows(node, analyzed, relation_rows)
+            if scanned >= PLAN_SEQ_SCAN_ROWS:
+                issues.append(
+                    f"Sequential scan on a large relation: {label}, "
+                    f"~{scanned:.0f} rows scanned."
+                )
+                suggestions.append("Consider adding an index on filtered columns.")
+
+        if analyzed and node.get("Actual Loops"):
+            estimated = max(node.get("Plan Rows", 0), 1)
+            actual = max(node["Actual Rows"], 1)
+            if max(estimated / actual, actual / estimated) >= PLAN_MISESTIMATE_FACTOR:
+                issues.append(
+                    f"Row estimate off: {label} estimated {estimated:.0f} rows, "
+                    f"got {node['Actual Rows']:.0f} per loop."
+                )
+                suggestions.append(
+                    "Run ANALYZE on the tables involved or add extended statistics."
+                )
+
+        spill = _spill(node)
+        if spill:
+            issues.append(f"{label} spilled to disk: {spill}.")
+            suggestions.append("Increase work_mem or reduce the rows sorted/hashed.")
+
+        if node["Node Type"] == "Nested Loop" and node.get("Plans"):
+            outer = node["Plans"][0]
+            outer_rows = _rows(outer, analyzed)
+            if outer_rows >= PLAN_NESTED_LOOP_OUTER_ROWS:
+                issues.append(
+                    f"Nested loop with a large outer side: {label} loops over "
+                    f"~{outer_rows:.0f} rows from {_label(outer)}."
+                )
+                suggestions.append(
+                    "Index the inner join column or let the planner pick a hash join."
+                )
+
+    total_cost = plan.get("Total Cost", 0.0)
+    if total_cost > PLAN_HIGH_COST:
+        issues.append(f"High query cost ({total_cost:.2f}): Likely inefficient.")
+        suggestions.append("Optimize filters or add indexes to reduce cost.")
+    return {"issues": issues, "suggestions": suggestions, "nodes": nodes}
@@ -0,0 +1,309 @@
+import argparse
+import json
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from psycopg2 import sql
+
+from .db import connect_from_env
+from .search import build_search_sql
+from .vector_index import (
+    COMPACT_COLUMNS,
+    DISTANCES,
+    _autocommit,
+    _knn_ids,
+    _percentile,
+    apply_search_params,
+    compact_expression,
+    distance_operator,
+    list_indexes,
+    rerank_shortlist,
+)
+
+HAMMING_OPCLASS = "bit_hamming_ops"
+
+
+def _sync_function(storage: str) -> str:
+    return f"iquerio_sync_{COMPACT_COLUMNS[storage][0]}"
+
+
+def compact_index_name(storage: str, distance: str = "l2") -> str:
+    suffix = "hamming" if storage == "binary" else distance
+    return f"users_{COMPACT_COLUMNS[storage][0]}_hnsw_{suffix}_idx"
+
+
+def add_compact_column(connection, storage: str):
+    """Adds the compact column and a trigger keeping it in sync with
+    ``embedding`` for new and updated rows. Existing rows are filled by
+    ``backfill``.
+    """
+    column, column_type = COMPACT_COLUMNS[storage]
+    function = _sync_function(storage)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {column} {column_type}"
+        )
+        cursor.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.{column} := {compact_expression(storage, "NEW.embedding")};
+                RETURN NEW;
+            END;
+            $$;
+            DROP TRIGGER IF EXISTS {function}_trigger ON users;
+            CREATE TRIGGER {function}_trigger
+            BEFORE INSERT OR UPDATE OF embedding ON users
+            FOR EACH ROW EXECUTE FUNCTION {function}();
+            """
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def backfill(connection, storage: str, batch_size: int = 5000) -> int:
+    """Fills the compact column for existing rows, one committed batch at a
+    time so the migration never holds row locks on the whole table.
+    """
+    column = COMPACT_COLUMNS[storage][0]
+    statement = (
+        f"UPDATE users SET {column} = {compact_expression(storage)} "
+        f"WHERE id IN (SELECT id FROM users WHERE {column} IS NULL "
+        "AND embedding IS NOT NULL ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)"
+    )
+    updated = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(statement, (batch_size,))
+            connection.commit()
+            if not cursor.rowcount:
+                return updated
+            updated += cursor.rowcount
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def create_compact_index(
+    connection,
+    storage: str,
+    distance: str = "l2",
+    m: int = 16,
+    ef_construction: int = 64,
+) -> str:
+    distance_operator(distance)
+    if storage == "binary":
+        opclass = HAMMING_OPCLASS
+    else:
+        opclass = DISTANCES[distance][1].replace("vector_", "halfvec_")
+    name = compact_index_name(storage, distance)
+    _autocommit(
+        connection,
+        sql.SQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users "
+            "USING hnsw ({column} {opclass}) WITH (m = {m}, ef_construction = {ef})"
+        ).format(
+            name=sql.Identifier(name),
+            column=sql.Identifier(COMPACT_COLUMNS[storage][0]),
+            opclass=sql.SQL(opclass),
+            m=sql.Literal(int(m)),
+            ef=sql.Literal(int(ef_construction)),
+        ),
+    )
+    return name
+
+
+def migrate(
+    connection,
+    storage: str,
+    distance: str = "l2",
+    batch_size: int = 5000,
+    index: bool = True,
+) -> Dict[str, object]:
+    started = time.perf_counter()
+    add_compact_column(connection, storage)
+    result = {
+        "storage": storage,
+        "backfilled": backfill(connection, storage, batch_size),
+    }
+    if index:
+        result["index"] = create_compact_index(connection, storage, distance)
+    result["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def drop_compact(connection, storage: str):
+    column = COMPACT_COLUMNS[storage][0]
+    function = _sync_function(storage)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {function}_trigger ON users")
+        cursor.execute(f"DROP FUNCTION IF EXISTS {function}()")
+        cursor.execute(f"ALTER TABLE users DROP COLUMN IF EXISTS {column}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _columns(cursor) -> List[str]:
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = 'users'"
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def storage_report(
+    connection,
+    distance: str = "l2",
+    k: int = 10,
+    sample_size: int = 50,
+    ef_search: Optional[int] = None,
+) -> Dict[str, object]:
+    """Size, latency and recall@k of each storage mode against exact search
+    over the full-precision vectors.
+    """
+    operator = distance_operator(distance)
+    indexes = list_indexes(connection)
+    cursor = connection.cursor()
+    try:
+        columns = _columns(cursor)
+        cursor.execute(
+            "SELECT pg_relation_size('users'), pg_total_relation_size('users')"
+        )
+        heap_bytes, total_bytes = cursor.fetchone()
+        cursor.execute(
+            "SELECT embedding::text FROM users WHERE embedding IS NOT NULL "
+            "ORDER BY random() LIMIT %s",
+            (sample_size,),
+        )
+        queries = [row[0] for row in cursor.fetchall()]
+        connection.rollback()
+
+        exact = []
+        for embedding in queries:
+            cursor.execute("SET LOCAL enable_indexscan = off")
+            exact.append(set(_knn_ids(cursor, embedding, k, operator)))
+            connection.rollback()
+
+        modes = []
+        for storage, column in [("full", "embedding")] + [
+            (storage, spec[0]) for storage, spec in COMPACT_COLUMNS.items()
+        ]:
+            if column not in columns:
+                modes.append({"storage": storage, "available": False})
+                continue
+            cursor.execute(
+                f"SELECT COALESCE(sum(pg_column_size({column})), 0), "
+                f"count(*) FILTER (WHERE embedding IS NOT NULL AND {column} IS NULL) "
+                "FROM users"
+            )
+            column_bytes, missing = cursor.fetchone()
+            shortlist = None if storage == "full" else rerank_shortlist(storage, k)
+            setting = ef_search or (min(shortlist, 1000) if shortlist else None)
+            recalls = []
+            latencies = []
+            for embedding, truth in zip(queries, exact):
+                query, params = build_search_sql(
+                    operator, embedding, k, storage=storage
+                )
+                apply_search_params(cursor, ef_search=setting)
+                started = time.perf_counter()
+                cursor.execute(query, params)
+                found = [row[0] for row in cursor.fetchall()][:k]
+                latencies.append((time.perf_counter() - started) * 1000)
+                connection.rollback()
+                if truth:
+                    recalls.append(len(truth.intersection(found)) / len(truth))
+            modes.append(
+                {
+                    "storage": storage,
+                    "available": True,
+                    "rows_missing": missing,
+                    "column_bytes": column_bytes,
+                    "index_bytes": sum(
+                        i["size_bytes"]
+                        for i in indexes
+                        if f"({column} " in i["definition"]
+                    ),
+                    "shortlist": shortlist,
+                    "ef_search": setting,
+                    "recall_at_k": (
+                        round(statistics.mean(recalls), 4) if recalls else None
+                    ),
+                    "latency_ms_p50": (
+                        round(_percentile(latencies, 50), 3) if latencies else None
+                    ),
+                    "latency_ms_p95": (
+                        round(_percentile(latencies, 95), 3) if latencies else None
+                    ),
+                }
+            )
+    finally:
+        cursor.close()
+
+    return {
+        "distance": distance,
+        "k": k,
+        "queries": len(queries),
+        "table_bytes": heap_bytes,
+        "total_bytes": total_bytes,
+        "modes": modes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage compact (halfvec / binary) copies of users.embedding"
+    )
+    parser.add_argument("action", choices=["migrate", "backfill", "drop", "report"])
+    parser.add_argument("--storage", choices=list(COMPACT_COLUMNS), default="halfvec")
+    parser.add_argument("--distance", choices=list(DISTANCES), default="l2")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--no-index", action="store_true", help="Skip building the HNSW index"
+    )
+    parser.add_argument("--k", type=int, default=10, help="k for the report")
+    parser.add_argument("--sample-size", type=int, default=50)
+    parser.add_argument("--ef-search", type=int, help="HNSW ef_search for the report")
+    args = parser.parse_args()
+
+    connection = connect_from_env()
+    try:
+        if args.action == "migrate":
+            result = migrate(
+                connection,
+                args.storage,
+                args.distance,
+                args.batch_size,
+                index=not args.no_index,
+            )
+        elif args.action == "backfill":
+            result = {"backfilled": backfill(connection, args.storage, args.batch_size)}
+        elif args.action == "drop":
+            drop_compact(connection, args.storage)
+            result = {"dropped": COMPACT_COLUMNS[args.storage][0]}
+        else:
+            result = storage_report(
+                connection, args.distance, args.k, args.sample_size, args.ef_search
+            )
+        print(json.dumps(result, indent=2))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
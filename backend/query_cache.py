@@ -0,0 +1,222 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from sqlparse import lexer, tokens as T
+
+from .db import pooled_connection
+
+
+def normalize_query(query: str) -> str:
+    parts = []
+    for ttype, value in lexer.tokenize(query):
+        if ttype in T.Whitespace or ttype in T.Newline or ttype in T.Comment:
+            continue
+        if ttype in T.Literal.Number or ttype in T.Literal.String.Single:
+            parts.append("?")
+        elif ttype in T.Keyword or ttype in T.Name.Builtin:
+            parts.append(value.upper())
+        elif ttype in T.Name:
+            parts.append(value.lower())
+        elif ttype in T.Punctuation and value == ";":
+            continue
+        else:
+            parts.append(value)
+    normalized = " ".join(parts)
+    while "? , ?" in normalized:
+        normalized = normalized.replace("? , ?", "?")
+    return normalized
+
+
+def placeholder_count(query: str) -> int:
+    """Highest ``$n`` parameter in ``query``, as in pg_stat_statements text."""
+    highest = 0
+    for ttype, value in lexer.tokenize(query):
+        if ttype in T.Name.Placeholder and value[1:].isdigit():
+            highest = max(highest, int(value[1:]))
+    return highest
+
+
+def fingerprint_query(query: str) -> Tuple[str, str]:
+    normalized = normalize_query(query)
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+    return digest, normalized
+
+
+class TTLCache:
+    """Size- and TTL-bounded LRU mapping.
+
+    With a ``weigher`` (e.g. approximate bytes of a value), the total weight
+    of the entries is also kept under ``max_weight``; values heavier than
+    ``max_weight`` on their own are not stored.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300.0,
+        clock=time.monotonic,
+        weigher: Optional[Callable[[object], int]] = None,
+        max_weight: Optional[int] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self._clock = clock
+        self._weigher = weigher
+        self._weight = 0
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[float, float, object]]" = OrderedDict()
+        self._weights: Dict[Hashable, int] = {}
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def _pop(self, key: Hashable):
+        del self._data[key]
+        self._weight -= self._weights.pop(key, 0)
+
+    def get(self, key: Hashable) -> Tuple[Optional[object], Optional[float]]:
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value, now - stored_at
+                self._pop(key)
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return None, None
+
+    def set(self, key: Hashable, value: object, ttl: Optional[float] = None):
+        now = self._clock()
+        weight = self._weigher(value) if self._weigher else 0
+        if self.max_weight is not None and weight > self.max_weight:
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (now, now + (self.ttl if ttl is None else ttl), value)
+            if weight:
+                self._weights[key] = weight
+                self._weight += weight
+            while len(self._data) > self.maxsize or (
+                self.max_weight is not None and self._weight > self.max_weight
+            ):
+                self._pop(next(iter(self._data)))
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self._weight = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+            stats["weight"] = self._weight
+        stats["maxsize"] = self.maxsize
+        stats["max_weight"] = self.max_weight
+        stats["ttl_seconds"] = self.ttl
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS iquerio_schema_version (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO iquerio_schema_version (id, version) VALUES (1, 0)
+    ON CONFLICT (id) DO NOTHING;
+    CREATE OR REPLACE FUNCTION iquerio_bump_schema_version() RETURNS event_trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        changed BOOLEAN;
+    BEGIN
+        -- Temporary objects (session-local EXPLAIN functions, ingest staging
+        -- tables) are not schema changes. DROP reports nothing at
+        -- ddl_command_end, so drops are seen by the sql_drop trigger.
+        IF TG_EVENT = 'sql_drop' THEN
+            changed := EXISTS (
+                SELECT 1 FROM pg_event_trigger_dropped_objects()
+                WHERE NOT is_temporary
+            );
+        ELSE
+            changed := EXISTS (
+                SELECT 1 FROM pg_event_trigger_ddl_commands()
+                WHERE schema_name IS DISTINCT FROM 'pg_temp'
+            );
+        END IF;
+        IF changed THEN
+            UPDATE iquerio_schema_version SET version = version + 1 WHERE id = 1;
+        END IF;
+    END;
+    $$;
+    DROP EVENT TRIGGER IF EXISTS iquerio_schema_version_trigger;
+    CREATE EVENT TRIGGER iquerio_schema_version_trigger ON ddl_command_end
+    EXECUTE FUNCTION iquerio_bump_schema_version();
+    DROP EVENT TRIGGER IF EXISTS iquerio_schema_version_drop_trigger;
+    CREATE EVENT TRIGGER iquerio_schema_version_drop_trigger ON sql_drop
+    EXECUTE FUNCTION iquerio_bump_schema_version();
+"""
+
+
+def _read_db_version(table: str = "iquerio_schema_version") -> Optional[int]:
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"SELECT version FROM {table} WHERE id = 1")
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            cursor.close()
+
+
+class SchemaVersion:
+    """DDL version counter used to invalidate schema-dependent caches.
+
+    Combines a local counter, bumped by IQuerio's own DDL (index management,
+    setup), with the ``iquerio_schema_version`` row maintained by an event
+    trigger, which catches DDL run by anyone else. The database row is read
+    at most once every ``check_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        check_interval: float = 5.0,
+        read_db_version: Callable[[], Optional[int]] = _read_db_version,
+    ):
+        self.check_interval = check_interval
+        self._read_db_version = read_db_version
+        self._lock = threading.Lock()
+        self._local = 0
+        self._db: Optional[int] = None
+        self._checked_at = float("-inf")
+
+    def bump(self):
+        with self._lock:
+            self._local += 1
+
+    def local_version(self) -> int:
+        return self._local
+
+    def current(self) -> Tuple[int, Optional[int]]:
+        now = time.monotonic()
+        if os.getenv("ENV") != "test" and now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                self._db = self._read_db_version()
+            except Exception:
+                pass
+        return self._local, self._db
+
+
+schema_version = SchemaVersion(float(os.getenv("OPTIMIZER_SCHEMA_CHECK_INTERVAL", "5")))
@@ -0,0 +1,388 @@
+import argparse
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from .db import connect_from_env
+from .embeddings import (
+    EMBEDDING_BACKEND,
+    MODEL_NAME,
+    MODEL_VERSION,
+    CachedEncoder,
+    EmbeddingCache,
+    ModelLoader,
+    model_namespace,
+)
+
+load_dotenv()
+
+EMBEDDING_MODEL_FILTER = os.getenv("EMBEDDING_MODEL_FILTER", "false").lower() == "true"
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "512"))
+REEMBED_MAX_ACTIVE = int(os.getenv("REEMBED_MAX_ACTIVE", "8"))
+REEMBED_MAX_ROWS_PER_SECOND = float(os.getenv("REEMBED_MAX_ROWS_PER_SECOND", "0"))
+
+MODEL_VERSION_SQL = """
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS embedding_model TEXT;
+    CREATE OR REPLACE FUNCTION iquerio_stamp_embedding_model() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        session_model TEXT := NULLIF(current_setting('iquerio.embedding_model', true), '');
+    BEGIN
+        IF NEW.embedding IS NULL THEN
+            NEW.embedding_model := NULL;
+        ELSIF TG_OP = 'INSERT' THEN
+            NEW.embedding_model := COALESCE(NEW.embedding_model, session_model);
+        ELSIF NEW.embedding_model IS NOT DISTINCT FROM OLD.embedding_model THEN
+            NEW.embedding_model := session_model;
+        END IF;
+        RETURN NEW;
+    END;
+    $$;
+    DROP TRIGGER IF EXISTS iquerio_stamp_embedding_model_trigger ON users;
+    CREATE TRIGGER iquerio_stamp_embedding_model_trigger
+    BEFORE INSERT OR UPDATE OF embedding ON users
+    FOR EACH ROW EXECUTE FUNCTION iquerio_stamp_embedding_model();
+    CREATE TABLE IF NOT EXISTS iquerio_reembed_jobs (
+        model TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running',
+        started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+ACTIVE_QUERIES_SQL = """
+    SELECT count(*) FROM pg_stat_activity
+    WHERE state = 'active' AND backend_type = 'client backend'
+    AND pid <> pg_backend_pid()
+"""
+
+START_JOB_SQL = """
+    INSERT INTO iquerio_reembed_jobs AS j (model) VALUES (%(model)s)
+    ON CONFLICT (model) DO UPDATE SET
+        status = 'running',
+        updated_at = now(),
+        last_id = CASE WHEN j.status = 'done' OR %(restart)s THEN 0 ELSE j.last_id END,
+        rows_done = CASE WHEN j.status = 'done' OR %(restart)s THEN 0
+            ELSE j.rows_done END
+    RETURNING last_id, rows_done
+"""
+
+WRITE_SQL = """
+    UPDATE users u SET embedding = v.embedding, embedding_model = {version}
+    FROM (VALUES %s) AS v (id, description, embedding)
+    WHERE u.id = v.id AND u.description = v.description
+    AND u.embedding_model IS DISTINCT FROM {version}
+"""
+
+
+def search_model_filter(
+    conditions: Sequence[str] = (),
+    params: Sequence = (),
+    version: str = MODEL_VERSION,
+    enabled: bool = EMBEDDING_MODEL_FILTER,
+) -> Tuple[List[str], List]:
+    """Restricts a search to rows embedded with the model the query was
+    encoded with, so distances are never compared across model versions
+    while a re-embedding job is part way through the table.
+    """
+    if not enabled:
+        return list(conditions), list(params)
+    return [*conditions, "embedding_model = %s"], [*params, version]
+
+
+def stamp_existing_rows(
+    connection, version: str = MODEL_VERSION, batch_size: int = 5000
+) -> int:
+    """Records ``version`` for rows embedded before the column existed, one
+    committed batch at a time.
+    """
+    statement = (
+        "UPDATE users SET embedding_model = %s WHERE id IN (SELECT id FROM users "
+        "WHERE embedding_model IS NULL AND embedding IS NOT NULL "
+        "ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)"
+    )
+    stamped = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(statement, (version, batch_size))
+            connection.commit()
+            if not cursor.rowcount:
+                return stamped
+            stamped += cursor.rowcount
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def install(connection, version: str = MODEL_VERSION) -> Dict[str, object]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(MODEL_VERSION_SQL)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return {"version": version, "stamped": stamp_existing_rows(connection, version)}
+
+
+class Throttle:
+    """Paces the job's writes: waits while more than ``max_active`` other
+    queries are running on the server, and keeps the overall rate under
+    ``max_rows_per_second`` (0 disables either limit).
+    """
+
+    def __init__(
+        self,
+        max_active: int = REEMBED_MAX_ACTIVE,
+        max_rows_per_second: float = REEMBED_MAX_ROWS_PER_SECOND,
+        poll_interval: float = 1.0,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_active = max_active
+        self.max_rows_per_second = max_rows_per_second
+        self.poll_interval = poll_interval
+        self._sleep = sleep
+        self._clock = clock
+        self._started = clock()
+        self._rows = 0
+        self.waited = 0.0
+
+    def _pause(self, seconds: float):
+        self._sleep(seconds)
+        self.waited += seconds
+
+    def wait(self, connection, rows: int):
+        if self.max_rows_per_second:
+            ahead = self._rows / self.max_rows_per_second
+            ahead -= self._clock() - self._started
+            if ahead > 0:
+                self._pause(ahead)
+        if self.max_active:
+            cursor = connection.cursor()
+            try:
+                while True:
+                    cursor.execute(ACTIVE_QUERIES_SQL)
+                    active = cursor.fetchone()[0]
+                    # pg_stat_activity is a per-transaction snapshot
+                    connection.rollback()
+                    if active <= self.max_active:
+                        break
+                    self._pause(self.poll_interval)
+            finally:
+                cursor.close()
+        self._rows += rows
+
+
+def reembed(
+    read_connection,
+    write_connection,
+    encoder,
+    version: str,
+    batch_size: int = REEMBED_BATCH_SIZE,
+    throttle: Optional[Throttle] = None,
+    restart: bool = False,
+    log: Optional[Callable[[Dict[str, object]], None]] = None,
+) -> Dict[str, object]:
+    """Re-encodes every described row not yet embedded with ``version``.
+
+    Rows are read in id order, one keyset-paginated batch per short read
+    transaction, so the job never holds back vacuum for its whole run. Each
+    batch is written back with one UPDATE, in the same transaction as the
+    checkpoint in ``iquerio_reembed_jobs``, so a restarted job resumes
+    after the last committed id. Rows whose description changed since they
+    were read are left for the next run.
+    """
+    throttle = throttle or Throttle()
+    write_sql = sql.SQL(WRITE_SQL).format(version=sql.Literal(version))
+    started = time.perf_counter()
+    cursor = write_connection.cursor()
+    reader = None
+    try:
+        cursor.execute(START_JOB_SQL, {"model": version, "restart": restart})
+        last_id, rows_done = cursor.fetchone()
+        write_connection.commit()
+        resumed_from = last_id
+
+        reader = read_connection.cursor()
+        updated = skipped = 0
+        while True:
+            reader.execute(
+                "SELECT id, description FROM users WHERE id > %s "
+                "AND description IS NOT NULL AND embedding_model IS DISTINCT FROM %s "
+                "ORDER BY id LIMIT %s",
+                (last_id, version, batch_size),
+            )
+            rows = reader.fetchall()
+            read_connection.rollback()
+            if not rows:
+                break
+            embeddings = encoder.encode([row[1] for row in rows])
+            throttle.wait(write_connection, len(rows))
+            execute_values(
+                cursor,
+                write_sql,
+                [(row[0], row[1], e) for row, e in zip(rows, embeddings)],
+                template="(%s, %s, %s::vector)",
+                page_size=len(rows),
+            )
+            written = cursor.rowcount
+            last_id = rows[-1][0]
+            cursor.execute(
+                "UPDATE iquerio_reembed_jobs SET last_id = %s, "
+                "rows_done = rows_done + %s, updated_at = now() WHERE model = %s",
+                (last_id, written, version),
+            )
+            write_connection.commit()
+            updated += written
+            skipped += len(rows) - written
+            if log:
+                log({"last_id": last_id, "updated": updated, "skipped": skipped})
+
+        cursor.execute(
+            "SELECT count(*) FROM users WHERE embedding IS NOT NULL "
+            "AND embedding_model IS DISTINCT FROM %s",
+            (version,),
+        )
+        remaining = cursor.fetchone()[0]
+        cursor.execute(
+            "UPDATE iquerio_reembed_jobs SET status = 'done', updated_at = now() "
+            "WHERE model = %s",
+            (version,),
+        )
+        write_connection.commit()
+    except Exception:
+        write_connection.rollback()
+        raise
+    finally:
+        if reader is not None:
+            reader.close()
+        read_connection.rollback()
+        cursor.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "version": version,
+        "resumed_from_id": resumed_from,
+        "updated": updated,
+        "total_updated": rows_done + updated,
+        "skipped": skipped,
+        "remaining": remaining,
+        "throttled_seconds": round(throttle.waited, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(updated / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def reembed_status(connection) -> Dict[str, object]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT embedding_model, count(*) FROM users "
+            "WHERE embedding IS NOT NULL GROUP BY 1 ORDER BY 2 DESC"
+        )
+        models = [{"model": row[0], "rows": row[1]} for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT model, last_id, rows_done, status, started_at, updated_at "
+            "FROM iquerio_reembed_jobs ORDER BY updated_at DESC"
+        )
+        jobs = [
+            {
+                "model": row[0],
+                "last_id": row[1],
+                "rows_done": row[2],
+                "status": row[3],
+                "started_at": row[4].isoformat(),
+                "updated_at": row[5].isoformat(),
+            }
+            for row in cursor.fetchall()
+        ]
+    finally:
+        connection.rollback()
+        cursor.close()
+    return {"serving_model": MODEL_VERSION, "models": models, "jobs": jobs}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-embed users.embedding with a new model, resumably"
+    )
+    parser.add_argument("action", choices=["install", "run", "status"])
+    parser.add_argument("--model", default=MODEL_NAME, help="Model to re-embed with")
+    parser.add_argument("--model-path", help="Local model directory")
+    parser.add_argument(
+        "--backend", choices=["torch", "onnx", "onnx-int8"], default=EMBEDDING_BACKEND
+    )
+    parser.add_argument(
+        "--version",
+        help="Version recorded in users.embedding_model (default: "
+        "EMBEDDING_MODEL_VERSION for install, the model name for run)",
+    )
+    parser.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    parser.add_argument(
+        "--max-active",
+        type=int,
+        default=REEMBED_MAX_ACTIVE,
+        help="Pause while more than this many other queries are active (0: off)",
+    )
+    parser.add_argument(
+        "--max-rows-per-second", type=float, default=REEMBED_MAX_ROWS_PER_SECOND
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore the saved checkpoint"
+    )
+    args = parser.parse_args()
+
+    if args.action == "install":
+        connection = connect_from_env()
+        try:
+            result = install(connection, args.version or MODEL_VERSION)
+        finally:
+            connection.close()
+    elif args.action == "status":
+        connection = connect_from_env()
+        try:
+            result = reembed_status(connection)
+        finally:
+            connection.close()
+    else:
+        version = args.version or args.model
+        loader = ModelLoader(
+            name=args.model, path=args.model_path, backend=args.backend
+        )
+        encoder = CachedEncoder(
+            loader, EmbeddingCache(namespace=model_namespace(args.model, args.backend))
+        )
+        read_connection = connect_from_env(version)
+        write_connection = connect_from_env(version)
+        try:
+            result = reembed(
+                read_connection,
+                write_connection,
+                encoder,
+                version,
+                args.batch_size,
+                Throttle(args.max_active, args.max_rows_per_second),
+                args.restart,
+                log=lambda progress: print(json.dumps(progress), flush=True),
+            )
+        finally:
+            read_connection.close()
+            write_connection.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
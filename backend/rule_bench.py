@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+from typing import Dict, Sequence
+
+import sqlparse
+
+from .rules import RULES, run_rules
+
+
+def legacy_analyze(query: str, stmt) -> Dict[str, list]:
+    issues, suggestions, rewrites = [], [], []
+    query_upper = query.upper().strip()
+
+    print("Tokens:", [str(t).strip() for t in stmt.tokens if str(t).strip()])
+
+    if stmt.get_type().upper() == "SELECT" and "SELECT *" in query_upper:
+        issues.append("SELECT * fetches unnecessary columns (slow and risky).")
+        suggestions.append(
+            "Replace with specific columns, e.g., SELECT id, name FROM table."
+        )
+        rewrites += [("SELECT *", "SELECT id, name"), ("select *", "SELECT id, name")]
+
+    join_count = query_upper.count("JOIN")
+    table_names = []
+    for token in stmt.tokens:
+        if isinstance(token, sqlparse.sql.Identifier):
+            table_name = str(token).strip().lower()
+            if table_name not in table_names:
+                table_names.append(table_name)
+    if join_count > 0 and len(table_names) < join_count + 1:
+        issues.append("Possible redundant JOIN: Joining the same table multiple times.")
+        suggestions.append("Check if multiple JOINs to the same table are necessary.")
+
+    where_clause_obj = None
+    for token in stmt.tokens:
+        if isinstance(token, sqlparse.sql.Where):
+            where_clause_obj = token
+            break
+    if where_clause_obj:
+        where_clause = str(where_clause_obj).lower().replace("  ", " ")
+        print("WHERE clause:", where_clause)
+        if "+" in where_clause or "-" in where_clause:
+            issues.append("Expressions in WHERE (e.g., age + 1) prevent index usage.")
+            suggestions.append("Simplify to direct column comparisons, e.g., age > 29.")
+            if "age + 1 > 30" in where_clause:
+                rewrites.append(("age + 1 > 30", "age > 29"))
+            rewrites.append(("age - 1", "age"))
+        if "age" in where_clause:
+            suggestions.append("Add an index: CREATE INDEX idx_age ON users(age);")
+    else:
+        suggestions.append("Consider adding a WHERE clause to filter data early.")
+    return {"issues": issues, "suggestions": suggestions, "rewrites": rewrites}
+
+
+def generate_query(size: int) -> str:
+    columns = ", ".join(f"t0.col_{i}" for i in range(size))
+    joins = " ".join(
+        f"JOIN table_{i % 7} t{i + 1} ON t{i + 1}.id = t{i}.ref_id" for i in range(size)
+    )
+    predicates = " AND ".join(
+        f"t{i % (size + 1)}.col_{i} + {i} > {i * 3}" for i in range(size)
+    )
+    subquery = f"SELECT * FROM orders WHERE orders.total - 1 > {size}"
+    return (
+        f"SELECT {columns} FROM users t0 {joins} "
+        f"WHERE {predicates} AND t0.id IN ({subquery})"
+    )
+
+
+def _throughput(
+    analyse, query: str, rounds: int, include_parse: bool = False
+) -> Dict[str, float]:
+    latencies = []
+    stmt = sqlparse.parse(query)[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(rounds):
+            started = time.perf_counter()
+            if include_parse:
+                stmt = sqlparse.parse(query)[0]
+            analyse(query, stmt)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "queries_per_second": round(len(latencies) / sum(latencies), 1),
+        "latency_ms_p50": round(latencies[len(latencies) // 2] * 1000, 3),
+        "latency_ms_max": round(latencies[-1] * 1000, 3),
+    }
+
+
+def compare(sizes: Sequence[int], rounds: int = 5) -> Dict[str, object]:
+    report = {"rules": list(RULES), "rounds": rounds, "sizes": []}
+    for size in sizes:
+        query = generate_query(size)
+        stmt = sqlparse.parse(query)[0]
+        ctx, timings = run_rules(query, stmt)
+        report["sizes"].append(
+            {
+                "size": size,
+                "query_chars": len(query),
+                "legacy": _throughput(legacy_analyze, query, rounds),
+                "rule_engine": _throughput(run_rules, query, rounds),
+                "legacy_with_parse": _throughput(legacy_analyze, query, rounds, True),
+                "rule_engine_with_parse": _throughput(run_rules, query, rounds, True),
+                "rule_timings_ms": timings,
+                "rule_engine_issues": ctx.issues,
+            }
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the optimizer rule engine with the legacy string checks"
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 500])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(compare(args.sizes, args.rounds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+import functools
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlparse import sql, tokens as T
+
+_ARITHMETIC = {"+", "-", "*", "/", "%"}
+# Each comparison operator with its sides swapped
+_MIRRORED = {
+    ">": "<",
+    "<": ">",
+    ">=": "<=",
+    "<=": ">=",
+    "=": "=",
+    "<>": "<>",
+    "!=": "!=",
+}
+
+
+class RuleContext:
+    def __init__(self, query: str, stmt):
+        self.query = query
+        self.stmt = stmt
+        self.statement_type = stmt.get_type().upper()
+        self.issues: List[str] = []
+        self.suggestions: List[str] = []
+        self.rewrites: List[Tuple[str, str]] = []
+        self.edits: List[Tuple[int, str, str]] = []
+        self.state: Dict[str, dict] = {}
+        self.tables: List[Tuple[str, Optional[str]]] = []
+        self.where_depth = 0
+        self.joins = 0
+        self.subquery_depth = 0
+        self.prev_keyword: Optional[str] = None
+        self._aliases: Optional[Dict[str, str]] = None
+        self._reported = set()
+        self._parts: Dict[int, List] = {}
+        self._texts: Dict[int, str] = {}
+
+    def issue(self, text: str):
+        if ("issue", text) not in self._reported:
+            self._reported.add(("issue", text))
+            self.issues.append(text)
+
+    def suggest(self, text: str):
+        if ("suggestion", text) not in self._reported:
+            self._reported.add(("suggestion", text))
+            self.suggestions.append(text)
+
+    def edit(self, token, new: str):
+        """Replaces the leaf ``token`` alone, where a rewrite would replace
+        every occurrence of its text.
+        """
+        offset = 0
+        for leaf in self.stmt.flatten():
+            if leaf is token:
+                self.edits.append((offset, token.value, new))
+                return
+            offset += len(leaf.value)
+
+    def parts(self, token) -> List:
+        """Children of a group other than whitespace and comments, worked out
+        once per statement however many rules ask.
+        """
+        parts = self._parts.get(id(token))
+        if parts is None:
+            parts = self._parts[id(token)] = _significant(token.tokens)
+        return parts
+
+    def text(self, token) -> str:
+        """``str(token)``, joined from the cached text of its child groups so
+        a subtree is flattened once per statement however many rules ask.
+        """
+        text = self._texts.get(id(token))
+        if text is None:
+            text = "".join(
+                [
+                    self.text(child) if child.is_group else child.value
+                    for child in token.tokens
+                ]
+            )
+            self._texts[id(token)] = text
+        return text
+
+    def resolve_table(self, qualifier: Optional[str]) -> Optional[str]:
+        if self._aliases is None:
+            self._aliases = {}
+            for name, alias in self.tables:
+                self._aliases.setdefault(name, name)
+                if alias:
+                    self._aliases.setdefault(alias, name)
+        if qualifier:
+            return self._aliases.get(qualifier.lower())
+        names = {name for name, _ in self.tables}
+        return names.pop() if len(names) == 1 else None
+
+
+class Rule:
+    """Base class for SQL rules.
+
+    A rule declares which parse-tree groups (``groups``) and leaf token types
+    (``ttypes``) it wants to see. The engine walks the tree once and calls
+    ``visit`` for every matching token, then ``finish`` once at the end.
+    Rules read a group's children with ``ctx.parts`` and its SQL with
+    ``ctx.text``, which are shared with every other rule on the statement.
+    Rules that read ``ctx.tables`` set ``uses_tables``; the FROM/JOIN tables
+    are only collected when one of the selected rules does. Rules that only
+    look inside WHERE clauses set ``in_where`` and are not called elsewhere.
+    """
+
+    name = ""
+    description = ""
+    groups: Tuple[type, ...] = ()
+    ttypes: Tuple = ()
+    uses_tables = False
+    in_where = False
+
+    def visit(self, token, ctx: RuleContext):
+        pass
+
+    def finish(self, ctx: RuleContext):
+        pass
+
+
+RULES: Dict[str, Rule] = {}
+
+
+def register_rule(rule_class):
+    rule = rule_class()
+    RULES[rule.name] = rule
+    return rule_class
+
+
+@functools.lru_cache(maxsize=None)
+def _is_a(ttype, parent) -> bool:
+    """``ttype in parent``, which sqlparse answers in Python on every call."""
+    return ttype in parent
+
+
+def _significant(tokens: Iterable) -> List:
+    return [t for t in tokens if not t.is_whitespace and not _is_a(t.ttype, T.Comment)]
+
+
+def _is_integer(token) -> bool:
+    return _is_a(token.ttype, T.Literal.Number.Integer)
+
+
+def _is_name(token) -> bool:
+    return _is_a(token.ttype, T.Name)
+
+
+def _column_name(identifier) -> Tuple[Optional[str], Optional[str]]:
+    """``(qualifier, column)`` of a column reference. The plain ``col`` and
+    ``alias.col`` shapes are read directly, which is much cheaper than
+    sqlparse's generic name lookup.
+    """
+    tokens = identifier.tokens
+    if len(tokens) == 1 and _is_name(tokens[0]):
+        return None, tokens[0].value
+    if len(tokens) == 3 and tokens[1].match(T.Punctuation, "."):
+        qualifier, _, column = tokens
+        if _is_name(qualifier) and _is_name(column):
+            return qualifier.value, column.value
+    return identifier.get_parent_name(), identifier.get_real_name()
+
+
+def _table_name(identifier) -> Tuple[Optional[str], Optional[str]]:
+    """``(table, alias)`` of a FROM/JOIN item, with the same fast path for
+    ``table`` and ``table alias``.
+    """
+    tokens = identifier.tokens
+    if len(tokens) == 1 and _is_name(tokens[0]):
+        return tokens[0].value, None
+    if len(tokens) == 3 and _is_name(tokens[0]) and tokens[1].is_whitespace:
+        alias = tokens[2]
+        if isinstance(alias, sql.Identifier) and len(alias.tokens) == 1:
+            if _is_name(alias.tokens[0]):
+                return tokens[0].value, alias.tokens[0].value
+    return identifier.get_real_name(), identifier.get_alias()
+
+
+@register_rule
+class SelectStarRule(Rule):
+    name = "select_star"
+    description = "SELECT * in the outer query or any subquery"
+    ttypes = (T.Wildcard,)
+
+    def visit(self, token, ctx):
+        if ctx.prev_keyword not in ("SELECT", "DISTINCT"):
+            return
+        if ctx.subquery_depth:
+            ctx.issue("SELECT * in a subquery fetches unnecessary columns.")
+            return
+        ctx.issue("SELECT * fetches unnecessary columns (slow and risky).")
+        ctx.suggest("Replace with specific columns, e.g., SELECT id, name FROM table.")
+        if ctx.statement_type == "SELECT":
+            ctx.edit(token, "id, name")
+
+
+@register_rule
+class RedundantJoinRule(Rule):
+    name = "redundant_join"
+    description = "The same table joined more than once"
+    uses_tables = True
+
+    def finish(self, ctx):
+        if not ctx.joins:
+            return
+        names = [name for name, _ in ctx.tables]
+        if len(set(names)) < len(names):
+            ctx.issue("Possible redundant JOIN: Joining the same table multiple times.")
+            ctx.suggest("Check if multiple JOINs to the same table are necessary.")
+
+
+@register_rule
+class WhereExpressionRule(Rule):
+    name = "where_expression"
+    description = "Arithmetic on a column in a WHERE comparison"
+    groups = (sql.Comparison,)
+    in_where = True
+
+    def visit(self, token, ctx):
+        parts = ctx.parts(token)
+        if len(parts) != 3:
+            return
+        left, operator, right = parts
+        if isinstance(left, sql.Operation):
+            expression, comparison, value = left, operator.value, right
+        elif isinstance(right, sql.Operation):
+            expression, value = right, left
+            comparison = _MIRRORED.get(operator.value)
+        else:
+            return
+        operation = ctx.parts(expression)
+        if not any(
+            t.value in _ARITHMETIC and _is_a(t.ttype, T.Operator) for t in operation
+        ):
+            return
+        if not any(isinstance(t, sql.Identifier) for t in operation):
+            return
+        ctx.issue(f"Expressions in WHERE ({ctx.text(expression)}) prevent index usage.")
+        rewritten = self._rewrite(ctx, operation, comparison, value)
+        if rewritten:
+            ctx.suggest(f"Simplify to a direct column comparison: {rewritten}.")
+            ctx.rewrites.append((ctx.text(token), rewritten))
+        else:
+            ctx.suggest(f"Move the arithmetic in {ctx.text(token)} to the other side.")
+
+    def _rewrite(self, ctx, operation, operator: Optional[str], value) -> Optional[str]:
+        if len(operation) != 3 or operator not in _MIRRORED:
+            return None
+        if not _is_integer(value):
+            return None
+        column, arithmetic, literal = operation
+        if not isinstance(column, sql.Identifier) or not _is_integer(literal):
+            return None
+        value, delta = int(value.value), int(literal.value)
+        if arithmetic.value == "+":
+            return f"{ctx.text(column)} {operator} {value - delta}"
+        if arithmetic.value == "-":
+            return f"{ctx.text(column)} {operator} {value + delta}"
+        return None
+
+
+@register_rule
+class IndexHintRule(Rule):
+    name = "index_hint"
+    description = "Suggest indexes for columns filtered in WHERE"
+    groups = (sql.Comparison,)
+    uses_tables = True
+    in_where = True
+
+    def visit(self, token, ctx):
+        parts = ctx.parts(token)
+        if not parts:
+            return
+        left = parts[0]
+        if isinstance(left, sql.Operation):
+            left = next((t for t in left.tokens if isinstance(t, sql.Identifier)), None)
+        if not isinstance(left, sql.Identifier):
+            return
+        qualifier, column = _column_name(left)
+        if column:
+            columns = ctx.state.setdefault(self.name, {"columns": {}})["columns"]
+            columns[(qualifier, column.lower())] = True
+
+    def finish(self, ctx):
+        for qualifier, column in ctx.state.get(self.name, {}).get("columns", {}):
+            table = ctx.resolve_table(qualifier)
+            if table:
+                ctx.suggest(
+                    f"Add an index: CREATE INDEX idx_{column} ON {table}({column});"
+                )
+
+
+@register_rule
+class MissingWhereRule(Rule):
+    name = "missing_where"
+    description = "SELECT/UPDATE/DELETE without a WHERE clause"
+    groups = (sql.Where,)
+
+    def visit(self, token, ctx):
+        if not ctx.subquery_depth:
+            ctx.state[self.name] = {"has_where": True}
+
+    def finish(self, ctx):
+        if ctx.statement_type in ("SELECT", "UPDATE", "DELETE") and not ctx.state.get(
+            self.name
+        ):
+            ctx.suggest("Consider adding a WHERE clause to filter data early.")
+
+
+def _is_subquery(token) -> bool:
+    return isinstance(token, sql.Parenthesis) and any(
+        _is_a(t.ttype, T.DML) for t in token.tokens
+    )
+
+
+def _record_table(token, ctx: RuleContext):
+    identifiers = (
+        token.get_identifiers() if isinstance(token, sql.IdentifierList) else [token]
+    )
+    for identifier in identifiers:
+        if not isinstance(identifier, sql.Identifier):
+            continue
+        if any(isinstance(t, sql.Parenthesis) for t in identifier.tokens):
+            continue
+        name, alias = _table_name(identifier)
+        if name:
+            ctx.tables.append((name.lower(), alias.lower() if alias else None))
+
+
+def _split(rules: Iterable[Rule]) -> Tuple[Tuple[Rule, ...], Tuple[Rule, ...]]:
+    """The rules to call outside and inside WHERE clauses."""
+    rules = tuple(rules)
+    return tuple(rule for rule in rules if not rule.in_where), rules
+
+
+class RuleEngine:
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = list(rules)
+        self._track_tables = any(rule.uses_tables for rule in self.rules)
+        self._kinds: Dict[type, tuple] = {}
+        self._leaves: Dict[object, tuple] = {}
+
+    def _classify(self, ttype) -> tuple:
+        leaf = self._leaves.get(ttype)
+        if leaf is None:
+            skip = ttype in T.Whitespace or ttype in T.Newline or ttype in T.Comment
+            rules = _split(
+                rule
+                for rule in self.rules
+                if any(ttype in wanted for wanted in rule.ttypes)
+            )
+            leaf = self._leaves[ttype] = (skip, ttype in T.Keyword, *rules)
+        return leaf
+
+    def _classify_group(self, kind: type) -> tuple:
+        group = self._kinds.get(kind)
+        if group is None:
+            table_item = issubclass(kind, (sql.Identifier, sql.IdentifierList))
+            group = self._kinds[kind] = (
+                issubclass(kind, sql.Where),
+                issubclass(kind, sql.Parenthesis),
+                self._track_tables and table_item,
+                *_split(rule for rule in self.rules if kind in rule.groups),
+            )
+        return group
+
+    def run(self, query: str, stmt) -> Tuple[RuleContext, Dict[str, float]]:
+        ctx = RuleContext(query, stmt)
+        timings = {rule.name: 0.0 for rule in self.rules}
+        self._walk(stmt, ctx, timings)
+        for rule in self.rules:
+            started = time.perf_counter()
+            rule.finish(ctx)
+            timings[rule.name] += time.perf_counter() - started
+        return ctx, {name: round(t * 1000, 4) for name, t in timings.items()}
+
+    def _dispatch(self, rules, token, ctx, timings):
+        started = time.perf_counter()
+        for rule in rules:
+            rule.visit(token, ctx)
+            finished = time.perf_counter()
+            timings[rule.name] += finished - started
+            started = finished
+
+    def _walk(self, token_list, ctx: RuleContext, timings):
+        leaves = self._leaves
+        kinds = self._kinds
+        last_keyword = None
+        from_item = False
+        for token in token_list.tokens:
+            if token.is_group:
+                kind = kinds.get(type(token)) or self._classify_group(type(token))
+                is_where, is_parenthesis, table_item, outside, inside = kind
+                if from_item and table_item:
+                    _record_table(token, ctx)
+                if inside:
+                    rules = inside if ctx.where_depth else outside
+                    if rules:
+                        ctx.prev_keyword = last_keyword
+                        self._dispatch(rules, token, ctx, timings)
+                is_subquery = is_parenthesis and _is_subquery(token)
+                if not (is_where or is_subquery):
+                    self._walk(token, ctx, timings)
+                    continue
+                ctx.where_depth += is_where
+                ctx.subquery_depth += is_subquery
+                self._walk(token, ctx, timings)
+                ctx.where_depth -= is_where
+                ctx.subquery_depth -= is_subquery
+                continue
+            leaf = leaves.get(token.ttype) or self._classify(token.ttype)
+            skip, is_keyword, outside, inside = leaf
+            if skip:
+                continue
+            if inside:
+                rules = inside if ctx.where_depth else outside
+                if rules:
+                    ctx.prev_keyword = last_keyword
+                    self._dispatch(rules, token, ctx, timings)
+            if is_keyword:
+                last_keyword = token.normalized
+                joined = "JOIN" in last_keyword
+                from_item = joined or last_keyword == "FROM"
+                ctx.joins += joined
+
+
+def select_rules(
+    enabled: Optional[Iterable[str]] = None, disabled: Optional[Iterable[str]] = None
+) -> List[Rule]:
+    names = list(enabled) if enabled is not None else list(RULES)
+    unknown = [n for n in names + list(disabled or []) if n not in RULES]
+    if unknown:
+        raise ValueError(f"Unknown rules {unknown}, expected some of {list(RULES)}")
+    disabled = set(disabled or [])
+    return [RULES[name] for name in names if name not in disabled]
+
+
+@functools.lru_cache(maxsize=64)
+def _engine(
+    enabled: Optional[Tuple[str, ...]], disabled: Tuple[str, ...]
+) -> RuleEngine:
+    return RuleEngine(select_rules(enabled, disabled))
+
+
+def run_rules(
+    query: str,
+    stmt,
+    enabled: Optional[Iterable[str]] = None,
+    disabled: Optional[Iterable[str]] = None,
+) -> Tuple[RuleContext, Dict[str, float]]:
+    """Runs the selected rules, reusing one engine (and its token-type
+    dispatch table) per rule selection.
+    """
+    enabled = tuple(enabled) if enabled is not None else None
+    return _engine(enabled, tuple(disabled or ())).run(query, stmt)
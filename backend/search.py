@@ -0,0 +1,343 @@
+import base64
+import functools
+import hashlib
+import json
+import math
+import os
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from dotenv import load_dotenv
+
+from .concurrency import SingleFlight, db_executor
+from .db import pooled_connection
+from .metrics import stage
+from .query_cache import SchemaVersion, TTLCache, _read_db_version
+from .vector_index import (
+    apply_search_params,
+    compact_distance,
+    rerank_shortlist,
+    storage_mode,
+)
+
+load_dotenv()
+
+SEARCH_FETCH_SIZE = int(os.getenv("SEARCH_FETCH_SIZE", "500"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "10000"))
+HNSW_DEFAULT_EF_SEARCH = 40
+
+EMBEDDING_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS iquerio_embedding_version (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO iquerio_embedding_version (id, version) VALUES (1, 0)
+    ON CONFLICT (id) DO NOTHING;
+    CREATE OR REPLACE FUNCTION iquerio_bump_embedding_version() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE iquerio_embedding_version SET version = version + 1 WHERE id = 1;
+        RETURN NULL;
+    END;
+    $$;
+    DROP TRIGGER IF EXISTS iquerio_embedding_version_trigger ON users;
+    CREATE TRIGGER iquerio_embedding_version_trigger
+    AFTER INSERT OR DELETE OR TRUNCATE OR UPDATE OF embedding, name, description
+    ON users FOR EACH STATEMENT EXECUTE FUNCTION iquerio_bump_embedding_version();
+"""
+
+search_generation = SchemaVersion(
+    float(os.getenv("SEARCH_CACHE_CHECK_INTERVAL", "2")),
+    read_db_version=functools.partial(_read_db_version, "iquerio_embedding_version"),
+)
+
+
+class Keyset(NamedTuple):
+    """Last row of the previous page, and how many rows came before it."""
+
+    distance: float
+    id: int
+    depth: int = 0
+
+
+def _scope_digest(scope: str) -> str:
+    return hashlib.sha1(scope.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(distance: float, row_id: int, scope: str, depth: int = 0) -> str:
+    payload = json.dumps(
+        {"d": distance, "i": row_id, "n": depth, "s": _scope_digest(scope)}
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token: str, scope: str) -> Keyset:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        keyset = Keyset(float(payload["d"]), int(payload["i"]), int(payload["n"]))
+        digest = payload["s"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if digest != _scope_digest(scope):
+        raise ValueError("Cursor belongs to a different search")
+    return keyset
+
+
+def index_window(limit: int, after: Optional[Keyset] = None) -> int:
+    """Rows the ``index`` strategy reads from the ANN index for a page: every
+    row before the cursor, the page itself and one more.
+    """
+    return (after.depth if after is not None else 0) + limit + 1
+
+
+def overfetch_window(overfetch: int, limit: int, after: Optional[Keyset] = None) -> int:
+    """ANN candidates the ``overfetch`` strategy reads for a page. Like the
+    ``index`` scan it restarts from the nearest row, so the rows of earlier
+    pages are over-fetched by the same factor as the page itself.
+    """
+    return math.ceil(overfetch * index_window(limit, after) / (limit + 1))
+
+
+def build_search_sql(
+    operator: str,
+    embedding,
+    limit: int,
+    conditions: Sequence[str] = (),
+    condition_params: Sequence = (),
+    after: Optional[Keyset] = None,
+    strategy: str = "index",
+    overfetch: Optional[int] = None,
+    storage: Optional[str] = "full",
+) -> Tuple[str, List]:
+    """Keyset-paginated k-NN query ordered by ``(distance, id)``.
+
+    Fetches ``limit + 1`` rows so the caller can tell whether another page
+    exists without a second query. ``strategy`` picks how filters combine
+    with the k-NN search (see ``nl_query.plan_filtered_search``). With a
+    compact ``storage`` mode, candidates are found on the halfvec/binary
+    copy and re-ranked against the full-precision vectors.
+
+    The ``index`` strategy orders the ANN scan by distance alone, which the
+    HNSW/IVFFlat index can serve, and applies the keyset and the ``id`` tie
+    break outside it. The scan restarts from the nearest row on every page,
+    so it reads ``index_window`` rows rather than filtering on the cursor.
+    """
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    storage = storage_mode(storage)
+    distance = f"embedding {operator} %s::vector"
+    columns = f"id, name, description, {distance} AS distance"
+    keyset = []
+    keyset_params = []
+    if after is not None:
+        after = Keyset(*after)
+        keyset = [f"({distance}, id) > (%s, %s)"]
+        keyset_params = [embedding, after.distance, after.id]
+    filters = " AND ".join(conditions) or "TRUE"
+
+    if strategy == "prefilter":
+        sql = (
+            "WITH candidates AS MATERIALIZED (SELECT id, name, description, "
+            f"embedding FROM users WHERE {filters}) SELECT {columns} FROM candidates"
+        )
+        params = [*condition_params, embedding]
+        if keyset:
+            sql += f" WHERE {keyset[0]}"
+            params += keyset_params
+    elif storage != "full":
+        inner = "SELECT id, name, description, embedding FROM users"
+        if conditions:
+            inner += f" WHERE {filters}"
+        sql = (
+            f"SELECT {columns} FROM ({inner} ORDER BY "
+            f"{compact_distance(storage, operator)} LIMIT %s) candidates"
+        )
+        depth = after.depth if after is not None else 0
+        shortlist = rerank_shortlist(storage, limit, depth)
+        if overfetch:
+            shortlist = max(shortlist, overfetch_window(overfetch, limit, after))
+        params = [embedding, *condition_params, embedding, shortlist]
+        if keyset:
+            sql += f" WHERE {keyset[0]}"
+            params += keyset_params
+    elif strategy == "overfetch":
+        # Joining the candidates back to users lets the filters use any
+        # column. As with ``index``, the keyset stays outside the ANN scan.
+        sql = (
+            f"SELECT id, name, description, distance FROM (SELECT id, {distance} "
+            "AS distance FROM users ORDER BY distance LIMIT %s) candidates "
+            f"JOIN users USING (id) WHERE {filters}"
+        )
+        window = overfetch_window(overfetch, limit, after)
+        params = [embedding, window, *condition_params]
+        if keyset:
+            sql += " AND (distance, id) > (%s, %s)"
+            params += keyset_params[1:]
+    elif strategy == "iterative":
+        where = list(conditions) + keyset
+        sql = f"SELECT {columns} FROM users"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql = (
+            f"WITH results AS MATERIALIZED ({sql} ORDER BY distance LIMIT %s) "
+            "SELECT * FROM results"
+        )
+        params = [embedding, *condition_params, *keyset_params, limit + 1]
+    else:
+        inner = f"SELECT {columns} FROM users"
+        if conditions:
+            inner += f" WHERE {filters}"
+        sql = f"SELECT * FROM ({inner} ORDER BY distance LIMIT %s) candidates"
+        params = [embedding, *condition_params, index_window(limit, after)]
+        if keyset:
+            sql += " WHERE (distance, id) > (%s, %s)"
+            params += keyset_params[1:]
+    sql += " ORDER BY distance, id LIMIT %s"
+    params.append(limit + 1)
+    return sql, params
+
+
+def iter_search_batches(
+    sql: str,
+    params: Sequence,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    fetch_size: int = SEARCH_FETCH_SIZE,
+    iterative_scan: bool = False,
+) -> Iterator[List[Dict[str, object]]]:
+    with pooled_connection() as connection:
+        settings = connection.cursor()
+        try:
+            apply_search_params(settings, ef_search, probes, iterative_scan)
+        finally:
+            settings.close()
+        cursor = connection.cursor(name="iquerio_search")
+        cursor.itersize = fetch_size
+        try:
+            with stage("search_query"):
+                cursor.execute(sql, params)
+            while True:
+                with stage("search_query"):
+                    rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield [
+                    {"id": r[0], "name": r[1], "description": r[2], "distance": r[3]}
+                    for r in rows
+                ]
+        finally:
+            cursor.close()
+            connection.rollback()
+
+
+def paginate(
+    batches: Iterator[List[Dict[str, object]]],
+    limit: int,
+    scope: str,
+    depth: int = 0,
+) -> Iterator[Tuple[List[Dict[str, object]], Optional[str]]]:
+    """Yields ``(rows, None)`` chunks of at most ``limit`` rows in total, then
+    ``([], next_cursor)`` once, where ``next_cursor`` is None on the last page.
+    ``depth`` is the number of rows on earlier pages.
+    """
+    sent = 0
+    last = None
+    try:
+        for rows in batches:
+            page = rows[: limit - sent]
+            if page:
+                sent += len(page)
+                last = page[-1]
+                yield page, None
+            if sent >= limit and len(rows) > len(page):
+                yield [], encode_cursor(
+                    last["distance"], last["id"], scope, depth + sent
+                )
+                return
+        yield [], None
+    finally:
+        batches.close()
+
+
+def search_page(
+    batches: Iterator[List[Dict[str, object]]],
+    limit: int,
+    scope: str,
+    depth: int = 0,
+) -> Dict[str, object]:
+    results: List[Dict[str, object]] = []
+    next_cursor = None
+    for rows, next_cursor in paginate(batches, limit, scope, depth):
+        results += rows
+    return {"results": results, "next_cursor": next_cursor}
+
+
+class SearchResultCache:
+    """TTL- and memory-bounded cache of search pages.
+
+    Entries are dropped whenever ``generation`` changes: writes made through
+    the API bump it locally, and the ``iquerio_embedding_version`` trigger
+    catches writes to ``users`` from anywhere else. Concurrent misses for
+    the same key are collapsed so only one request runs the search.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        max_bytes: int = 64 * 1024 * 1024,
+        generation: SchemaVersion = search_generation,
+    ):
+        self.cache = TTLCache(
+            maxsize,
+            ttl,
+            weigher=lambda value: len(json.dumps(value)),
+            max_weight=max_bytes,
+        )
+        self.generation = generation
+        self.flights = SingleFlight()
+        self._generation = None
+
+    @classmethod
+    def from_env(cls) -> "SearchResultCache":
+        return cls(
+            maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", "60")),
+            max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+
+    async def get_or_compute(
+        self, key: Hashable, compute: Callable[[], Awaitable[Dict]]
+    ) -> Tuple[Dict, Dict[str, object]]:
+        generation = await db_executor.run(self.generation.current)
+        if generation != self._generation:
+            self.cache.clear()
+            self._generation = generation
+        value, age = self.cache.get(key)
+        if value is not None:
+            return value, {"hit": True, "age_seconds": round(age, 3)}
+
+        async def run():
+            result = await compute()
+            if self.generation.local_version() == generation[0]:
+                self.cache.set(key, result)
+            return result
+
+        value, shared = await self.flights.do(key, run)
+        return value, {"hit": False, "shared": shared}
+
+    def stats(self) -> Dict[str, object]:
+        stats = self.cache.stats()
+        stats["shared"] = self.flights.shared
+        stats["generation"] = list(self._generation) if self._generation else None
+        return stats
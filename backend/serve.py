@@ -0,0 +1,262 @@
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .embeddings import EMBEDDING_THREADS, ModelLoader, limit_threads
+from .metrics import memory_usage
+
+load_dotenv()
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+
+
+def worker_threads(workers: int, threads: int = EMBEDDING_THREADS) -> int:
+    """Intra-op threads per worker: ``threads`` if set, else the cores
+    divided evenly between the workers.
+    """
+    return threads if threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+
+
+def preload(loader: ModelLoader):
+    """Loads and warms the model before forking, then freezes the objects
+    allocated so far so the garbage collector in the workers never writes
+    to (and so never copies) the pages the parent's objects live on.
+
+    The parent encodes with a single thread: an OpenMP pool started before
+    ``fork`` is unusable in the children, which size their own pool.
+    """
+    limit_threads(1)
+    loader.load()
+    if loader.error:
+        raise RuntimeError(f"Embedding model failed to load: {loader.error}")
+    gc.collect()
+    gc.freeze()
+
+
+def fork_workers(workers: int, target: Callable[[int], None]) -> List[int]:
+    pids = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                target(index)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    return pids
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    workers: int = SERVE_WORKERS,
+    threads: int = EMBEDDING_THREADS,
+    share_model: bool = True,
+    report_after: float = 0,
+):
+    """Pre-fork server: the parent imports the app, optionally loads the
+    model once, then forks ``workers`` uvicorn processes on one listening
+    socket. Workers share the parent's model weights copy-on-write and
+    are restarted if they exit.
+    """
+    import uvicorn
+
+    from . import main
+
+    threads = worker_threads(workers, threads)
+    if share_model:
+        preload(main.model_loader)
+    sock = _listen(host, port)
+
+    def run_worker(index: int):
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        limit_threads(threads)
+        main.model_loader.threads = threads
+        config = uvicorn.Config(main.app, lifespan="on", log_level="info")
+        uvicorn.Server(config).run(sockets=[sock])
+
+    pids = set(fork_workers(workers, run_worker))
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(
+        json.dumps(
+            {
+                "listening": f"{host}:{port}",
+                "workers": sorted(pids),
+                "threads_per_worker": threads,
+                "shared_model": share_model,
+                "parent": memory_usage(),
+            }
+        ),
+        flush=True,
+    )
+    if report_after > 0:
+        time.sleep(report_after)
+        print(json.dumps(process_report(sorted(pids))), flush=True)
+
+    while pids:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        pids.discard(pid)
+        if not stopping:
+            pids.update(fork_workers(1, run_worker))
+    sock.close()
+
+
+def process_report(pids: List[int]) -> Dict[str, object]:
+    workers = [{"pid": pid, **memory_usage(pid)} for pid in pids]
+    parent = {"pid": os.getpid(), **memory_usage()}
+    total_pss = sum(w["pss_kb"] or 0 for w in workers) + (parent["pss_kb"] or 0)
+    return {"parent": parent, "workers": workers, "total_pss_kb": total_pss}
+
+
+def measure_workers(
+    workers: int,
+    share_model: bool,
+    loader_factory: Callable[[], ModelLoader] = ModelLoader.from_env,
+    threads: int = EMBEDDING_THREADS,
+    texts: Optional[List[str]] = None,
+) -> Dict[str, object]:
+    """Forks ``workers`` processes that each encode a batch, and reports the
+    memory of every worker while all of them are alive. With
+    ``share_model`` the model is loaded once in the parent before forking;
+    otherwise every worker loads its own copy.
+    """
+    threads = worker_threads(workers, threads)
+    texts = texts or ["memory report warm-up"] * 8
+    loader = loader_factory()
+    if share_model:
+        preload(loader)
+    read_fd, write_fd = os.pipe()
+
+    def run_worker(index: int):
+        os.close(read_fd)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        limit_threads(threads)
+        loader.encode(texts)
+        os.write(write_fd, b"1")
+        signal.pause()
+
+    pids = fork_workers(workers, run_worker)
+    os.close(write_fd)
+    try:
+        ready = 0
+        while ready < workers:
+            chunk = os.read(read_fd, workers)
+            if not chunk:
+                raise RuntimeError("A worker exited before loading the model")
+            ready += len(chunk)
+        report = process_report(pids)
+    finally:
+        os.close(read_fd)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+        if share_model:
+            gc.unfreeze()
+    report["threads_per_worker"] = threads
+    return report
+
+
+def memory_report(
+    workers: int,
+    threads: int = EMBEDDING_THREADS,
+    loader_factory: Callable[[], ModelLoader] = ModelLoader.from_env,
+) -> Dict[str, object]:
+    """Worker memory with a model copy per worker versus one shared,
+    pre-fork copy. The per-worker run goes first, while the parent has not
+    loaded the model yet.
+    """
+    separate = measure_workers(workers, False, loader_factory, threads)
+    shared = measure_workers(workers, True, loader_factory, threads)
+    return {
+        "workers": workers,
+        "model_per_worker": separate,
+        "shared_model": shared,
+        "saved_kb": separate["total_pss_kb"] - shared["total_pss_kb"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve IQuerio from pre-forked workers sharing one model copy"
+    )
+    parser.add_argument("action", choices=["run", "memory"], nargs="?", default="run")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=EMBEDDING_THREADS,
+        help="Intra-op threads per worker (default: cores / workers)",
+    )
+    parser.add_argument(
+        "--no-share-model",
+        action="store_true",
+        help="Let every worker load its own model copy",
+    )
+    parser.add_argument(
+        "--report-after",
+        type=float,
+        default=0,
+        help="Print per-worker memory this many seconds after starting",
+    )
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        parser.error("pre-fork serving needs os.fork")
+    if args.action == "memory":
+        print(json.dumps(memory_report(args.workers, args.threads), indent=2))
+        return
+    serve(
+        args.host,
+        args.port,
+        args.workers,
+        args.threads,
+        share_model=not args.no_share_model,
+        report_after=args.report_after,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-import psycopg2
 from psycopg2 import Error as PsycopgError
 from dotenv import load_dotenv
-import os
-from sentence_transformers import SentenceTransformer
+from .db import connect_from_env
+from .embeddings import ModelLoader
+from .ingest import copy_users
+from .query_cache import SCHEMA_VERSION_SQL
+from .reembed import MODEL_VERSION_SQL
+from .search import EMBEDDING_VERSION_SQL
+from .vector_mirror import CHANGE_TRACKING_SQL
 
 load_dotenv()
 
@@ -11,13 +15,7 @@ def setup_database():
     connection = None
     cursor = None
     try:
-        connection = psycopg2.connect(
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            database=os.getenv("DB_NAME"),
-        )
+        connection = connect_from_env()
         cursor = connection.cursor()
 
         # Create auth_users table for login/registration
@@ -48,8 +46,25 @@ def setup_database():
         """
         )
 
+        # DDL version counter used to invalidate the optimizer cache
+        cursor.execute("SAVEPOINT schema_version")
+        try:
+            cursor.execute(SCHEMA_VERSION_SQL)
+        except PsycopgError as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT schema_version")
+            print(f"Schema version trigger not installed (needs superuser): {e}")
+
+        # Write counter used to invalidate cached search results
+        cursor.execute(EMBEDDING_VERSION_SQL)
+
+        # Change tracking for the in-process vector mirror
+        cursor.execute(CHANGE_TRACKING_SQL)
+
+        # Embedding model version per row, and re-embedding checkpoints
+        cursor.execute(MODEL_VERSION_SQL)
+
         # Insert sample daa with embeddings
-        model = SentenceTransformer("all-MiniLM-L6-v2")
+        model = ModelLoader.from_env()
 
         sample_data = [
             ("Soman", 25, "Young tech enthusiast who loves AI and startups"),
@@ -61,22 +76,21 @@ def setup_database():
         descriptions = [row[2] for row in sample_data]
         embeddings = model.encode(descriptions, convert_to_tensor=False).tolist()
 
-        inserted = 0
-
-        for (name, age, description), embedding in zip(sample_data, embeddings):
-            cursor.execute(
-                """
-                INSERT INTO users (name, age, description, embedding)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT DO NOTHING
-                RETURNING id;
-            """,
-                (name, age, description, embedding),
+        rows = [
+            {
+                "row_no": row_no,
+                "id": None,
+                "name": name,
+                "age": age,
+                "description": description,
+                "embedding": embedding,
+            }
+            for row_no, ((name, age, description), embedding) in enumerate(
+                zip(sample_data, embeddings), start=1
             )
-            if cursor.fetchone():
-                inserted += 1
+        ]
+        inserted, _ = copy_users(connection, rows)
 
-        connection.commit()
         print(
             f"Databse setup complete: auth users and users tables created, pgvector enabled, {inserted}/{len(sample_data)} sample users inserted."
         )
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from backend import auth, main
+from backend.auth import HasherBusy, PasswordHasher, TokenVerifier
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(schemes=("pbkdf2_sha256",), rounds=1000, workers=1)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_verify_and_rehash_on_new_cost(hasher):
+    hashed = asyncio.run(hasher.hash("secret"))
+    assert asyncio.run(hasher.verify("secret", hashed)) == (True, None)
+    assert asyncio.run(hasher.verify("wrong", hashed)) == (False, None)
+    assert asyncio.run(hasher.verify("secret", "not-a-hash")) == (False, None)
+
+    stronger = PasswordHasher(schemes=("pbkdf2_sha256",), rounds=2000, workers=1)
+    try:
+        valid, new_hash = asyncio.run(stronger.verify("secret", hashed))
+    finally:
+        stronger.shutdown()
+    assert valid
+    assert new_hash.startswith("$pbkdf2-sha256$2000$")
+
+
+def test_admission_limit_rejects_instead_of_queueing():
+    hasher = PasswordHasher(schemes=("pbkdf2_sha256",), workers=1, max_pending=0)
+    with pytest.raises(HasherBusy):
+        asyncio.run(hasher.hash("secret"))
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_token_claims_are_cached_until_expiry(monkeypatch):
+    verifier = TokenVerifier()
+    token = auth.create_access_token({"sub": "a@example.com", "user_id": 1})
+    calls = []
+    decode = jwt.decode
+    monkeypatch.setattr(
+        jwt,
+        "decode",
+        lambda *args, **kwargs: calls.append(1) or decode(*args, **kwargs),
+    )
+    assert verifier.claims(token)["user_id"] == 1
+    assert verifier.claims(token)["sub"] == "a@example.com"
+    assert len(calls) == 1
+
+    expired = jwt.encode(
+        {"sub": "a", "exp": int(time.time()) - 10}, auth.SECRET_KEY, auth.ALGORITHM
+    )
+    with pytest.raises(auth.HTTPException) as error:
+        verifier.claims(expired)
+    assert error.value.status_code == 401
+
+
+def test_login_rehashes_and_token_authorizes(monkeypatch, hasher):
+    old = PasswordHasher(schemes=("pbkdf2_sha256",), rounds=500, workers=1)
+    try:
+        stored = asyncio.run(old.hash("secret"))
+    finally:
+        old.shutdown()
+    updates = []
+    monkeypatch.setattr(main, "password_hasher", hasher)
+    monkeypatch.setattr(
+        main, "fetch_auth_user", lambda email: (7, "sam", email, stored)
+    )
+    monkeypatch.setattr(
+        main, "update_password_hash", lambda *args: updates.append(args)
+    )
+    client = TestClient(main.app)
+
+    response = client.post("/login", json={"email": "s@x.io", "password": "secret"})
+    assert response.status_code == 200
+    assert updates[0][0] == 7
+    assert updates[0][1].startswith("$pbkdf2-sha256$1000$")
+
+    token = response.json()["access_token"]
+    me = client.get("/me", headers={"Authorization": f"Bearer {token}"})
+    assert me.json()["user_id"] == 7
+    assert client.get("/me").status_code == 401
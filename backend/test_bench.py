@@ -0,0 +1,52 @@
+import asyncio
+
+from backend.bench import compare_reports, run_load
+
+
+class FakeClient:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def post(self, path, json=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.001)
+        self.active -= 1
+        return type("Response", (), {"status_code": 500 if json["n"] == 3 else 200})
+
+
+def test_run_load_reports_percentiles_and_errors():
+    client = FakeClient()
+    result = asyncio.run(
+        run_load(client, "/search-similar", [{"n": n} for n in range(20)], 4)
+    )
+    assert result["requests"] == 20
+    assert result["statuses"] == {"200": 19, "500": 1}
+    assert result["errors"] == 1
+    assert client.peak == 4
+    assert result["latency_ms_p50"] <= result["latency_ms_p99"]
+
+
+def test_compare_reports_flags_regressions():
+    old = {
+        "meta": {"git_commit": "a"},
+        "sizes": [
+            {"rows": 10000, "search_similar": {"latency_ms_p95": 10.0, "errors": 0}}
+        ],
+        "optimizer": {"queries_per_second": 1000.0},
+    }
+    new = {
+        "meta": {"git_commit": "b"},
+        "sizes": [
+            {"rows": 10000, "search_similar": {"latency_ms_p95": 15.0, "errors": 0}}
+        ],
+        "optimizer": {"queries_per_second": 980.0},
+    }
+    report = compare_reports(old, new, threshold=0.1)
+    metrics = {m["metric"]: m for m in report["metrics"]}
+    assert metrics["/sizes/10000/search_similar/latency_ms_p95"]["regression"]
+    assert metrics["/sizes/10000/search_similar/latency_ms_p95"]["change_pct"] == 50.0
+    assert not metrics["/optimizer/queries_per_second"]["regression"]
+    assert not metrics["/sizes/10000/search_similar/errors"]["regression"]
+    assert report["regressions"] == 1
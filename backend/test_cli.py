@@ -0,0 +1,84 @@
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from backend import cli, main
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def local_app(monkeypatch):
+    calls = []
+
+    def fake_optimize(query, *args):
+        calls.append(query)
+        if "bad" in query:
+            raise ValueError("Invalid SQL")
+        return {
+            "optimized_query": query,
+            "issues": [],
+            "suggestions": [],
+            "explain_plan": None,
+            "plan_nodes": [],
+            "rewrite_check": None,
+            "rule_timings_ms": {},
+            "cache": {"hit": False},
+        }
+
+    async def shutdown():
+        calls.append("shutdown")
+
+    monkeypatch.setattr(main, "optimize_query", fake_optimize)
+    monkeypatch.setattr(main.app.router, "shutdown", shutdown)
+    return calls
+
+
+def test_read_batch_accepts_text_and_json_lines(tmp_path):
+    path = tmp_path / "queries.txt"
+    path.write_text('SELECT 1\n\n{"query": "SELECT 2", "analyze": true}\n')
+    assert list(cli.read_batch(str(path), "optimize")) == [
+        {"query": "SELECT 1"},
+        {"query": "SELECT 2", "analyze": True},
+    ]
+    assert list(cli.read_batch(str(path), "search"))[0] == {"description": "SELECT 1"}
+
+
+def test_local_batch_streams_ndjson(monkeypatch, capsys, local_app):
+    queries = [f"SELECT {i}" for i in range(20)] + ["bad query", '{"query": "SELECT']
+    monkeypatch.setattr(sys, "stdin", io.StringIO("\n".join(queries)))
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["db-toolkit", "optimize", "--batch", "-", "--local", "--concurrency", "4"],
+    )
+    with pytest.raises(SystemExit) as exit:
+        cli.main()
+    assert exit.value.code == 1
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(line["index"] for line in lines) == list(range(22))
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[3]["result"]["optimized_query"] == "SELECT 3"
+    assert by_index[20]["status"] == 400
+    assert by_index[21]["error"].startswith("Line 22: invalid JSON")
+    assert local_app[-1] == "shutdown"
+
+
+def test_cli_import_skips_the_database_layer():
+    code = (
+        "import sys, backend.cli; print(sorted({'numpy', 'psycopg2', 'sqlparse', "
+        "'backend.db', 'backend.embeddings'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.strip() == "[]"
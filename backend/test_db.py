@@ -0,0 +1,139 @@
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from backend.db import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.rollbacks = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    return ConnectionPool(connect=connect, **kwargs), opened
+
+
+def test_pool_reuses_connections():
+    pool, opened = make_pool(minconn=1, maxconn=2)
+    for _ in range(5):
+        with pool.connection():
+            pass
+    stats = pool.stats()
+    assert len(opened) == 1
+    assert stats["checkouts"] == 5
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+
+
+def test_pool_checkout_timeout():
+    pool, _ = make_pool(minconn=0, maxconn=1, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_pool_waiter_gets_released_connection():
+    pool, opened = make_pool(minconn=0, maxconn=1, timeout=2)
+    conn = pool.getconn()
+    result = {}
+
+    def worker():
+        result["conn"] = pool.getconn()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.05)
+    pool.putconn(conn)
+    thread.join(1)
+    assert result["conn"] is conn
+    assert len(opened) == 1
+
+
+def test_pool_replaces_unhealthy_connection():
+    pool, opened = make_pool(minconn=1, maxconn=1, health_check_interval=0)
+    opened[0].broken = True
+    conn = pool.getconn()
+    assert conn is opened[1]
+    assert opened[0].closed
+    stats = pool.stats()
+    assert stats["health_check_failures"] == 1
+    assert stats["connections_discarded"] == 1
+
+
+def test_pool_rolls_back_open_transaction_on_release():
+    pool, _ = make_pool(minconn=0, maxconn=1)
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+
+
+def test_pool_counts_connection_under_health_check_as_in_use():
+    pool, opened = make_pool(minconn=1, maxconn=1, health_check_interval=0)
+    checking = threading.Event()
+    release = threading.Event()
+    execute = FakeCursor.execute
+
+    def slow_ping(cursor, sql, params=None):
+        checking.set()
+        release.wait(1)
+        return execute(cursor, sql, params)
+
+    FakeCursor.execute = slow_ping
+    try:
+        thread = threading.Thread(target=pool.getconn)
+        thread.start()
+        checking.wait(1)
+        with pytest.raises(PoolTimeout):
+            pool.getconn(timeout=0.05)
+        release.set()
+        thread.join(1)
+    finally:
+        FakeCursor.execute = execute
+    assert len(opened) == 1
+    assert pool.stats()["in_use"] == 1
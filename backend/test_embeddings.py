@@ -0,0 +1,230 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from backend.embedding_bench import cosine_drift
+from backend.embeddings import (
+    CachedEncoder,
+    EmbeddingCache,
+    MicroBatcher,
+    ModelLoader,
+    model_namespace,
+    normalize_text,
+)
+
+
+# Micro-batched vectors must match ``model.encode([text])`` to this absolute
+# tolerance per component, not bit for bit: padding to the longest text in a
+# batch changes the float arithmetic
+BATCH_TOLERANCE = 1e-4
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+        self.kwargs = []
+
+    def encode(self, texts, convert_to_tensor=False, **kwargs):
+        self.calls.append(list(texts))
+        self.kwargs.append(kwargs)
+        rng = [np.random.default_rng(sum(map(ord, t))) for t in texts]
+        return np.stack([r.standard_normal(8).astype(np.float32) for r in rng])
+
+
+def test_normalize_text():
+    assert normalize_text("  AI \n  startups\t") == "AI startups"
+    assert normalize_text("AI Startups", lowercase=True) == "ai startups"
+
+
+def test_cache_hit_matches_fresh_encode():
+    model = FakeModel()
+    encoder = CachedEncoder(model, EmbeddingCache(maxsize=10))
+    first = encoder.encode_one("Tech enthusiast into AI")
+    second = encoder.encode_one("  Tech enthusiast   into AI ")
+    fresh = FakeModel().encode(["Tech enthusiast into AI"])[0].tolist()
+    assert first == second == fresh
+    assert len(model.calls) == 1
+    stats = encoder.cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_cache_batches_and_dedups_misses():
+    model = FakeModel()
+    encoder = CachedEncoder(model, EmbeddingCache(maxsize=10))
+    encoder.encode_one("a")
+    vectors = encoder.encode(["a", "b", "b", "c"])
+    assert model.calls == [["a"], ["b", "c"]]
+    assert vectors[1] == vectors[2]
+
+
+def test_cache_lru_eviction():
+    cache = EmbeddingCache(maxsize=2)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    model = FakeModel()
+    CachedEncoder(model, EmbeddingCache(path=path)).encode_one("cloud computing")
+    encoder = CachedEncoder(model, EmbeddingCache(path=path))
+    vector = encoder.encode_one("cloud computing")
+    assert len(model.calls) == 1
+    assert encoder.cache.stats()["disk_hits"] == 1
+    assert vector == FakeModel().encode(["cloud computing"])[0].tolist()
+
+
+class PaddedModel(FakeModel):
+    """Like a transformer, shifts each vector slightly with the length of the
+    longest text it was batched with.
+    """
+
+    def encode(self, texts, convert_to_tensor=False, **kwargs):
+        padding = np.array([max(map(len, texts)) - len(t) for t in texts])
+        vectors = super().encode(texts, convert_to_tensor, **kwargs)
+        return vectors + (padding[:, None] * 1e-6).astype(np.float32)
+
+
+def encode_concurrently(batcher, texts):
+    results = {}
+
+    def worker(text):
+        results[text] = batcher.encode([text])[0]
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+    return results
+
+
+def test_micro_batcher_groups_concurrent_requests():
+    model = PaddedModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait=0.2)
+    texts = [f"text {i}" + " padded" * i for i in range(8)]
+    results = encode_concurrently(batcher, texts)
+
+    assert sum(len(call) for call in model.calls) == 8
+    assert len(model.calls) < 8
+    for text in texts:
+        np.testing.assert_allclose(
+            results[text], model.encode([text])[0], rtol=0, atol=BATCH_TOLERANCE
+        )
+
+
+def test_micro_batcher_matches_single_encodes_of_the_model():
+    pytest.importorskip("sentence_transformers")
+    loader = ModelLoader.from_env()
+    try:
+        model = loader.get()
+    except RuntimeError:
+        pytest.skip(f"needs the embedding model {loader.path or loader.name}")
+    texts = [
+        "AI",
+        "Tech enthusiast into AI",
+        "Backend engineer who likes Postgres, vector search and long hikes",
+        "Data scientist working on recommendation systems for online retail "
+        "with a background in statistics and a soft spot for cycling",
+    ]
+    batcher = MicroBatcher(model, max_batch_size=len(texts), max_wait=0.2)
+    results = encode_concurrently(batcher, texts)
+    for text in texts:
+        np.testing.assert_allclose(
+            results[text], model.encode([text])[0], rtol=0, atol=BATCH_TOLERANCE
+        )
+
+
+def test_micro_batcher_propagates_errors():
+    class BrokenModel:
+        def encode(self, texts, **kwargs):
+            raise RuntimeError("model failed")
+
+    batcher = MicroBatcher(BrokenModel(), max_batch_size=4, max_wait=0)
+    with pytest.raises(RuntimeError):
+        batcher.encode(["x"])
+    batcher.close()
+
+
+def test_micro_batcher_survives_a_cancelled_job():
+    model = FakeModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait=0.2)
+    encoder = CachedEncoder(batcher, EmbeddingCache(maxsize=10))
+
+    async def run():
+        cancelled = asyncio.ensure_future(encoder.aencode_one("gone"))
+        sibling = asyncio.ensure_future(encoder.aencode_one("kept"))
+        await asyncio.sleep(0.05)
+        cancelled.cancel()
+        return await asyncio.wait_for(sibling, 5)
+
+    vector = asyncio.run(run())
+    assert vector == FakeModel().encode(["kept"])[0].tolist()
+    assert model.calls == [["kept"]]
+    assert batcher._thread.is_alive()
+    assert len(batcher.encode(["later"])) == 1
+    batcher.close()
+
+
+def test_micro_batcher_only_batches_jobs_with_the_same_kwargs():
+    model = FakeModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait=0.1)
+    jobs = [
+        batcher.submit(["a"]),
+        batcher.submit(["b"], normalize_embeddings=True),
+        batcher.submit(["c"]),
+    ]
+    for job in jobs:
+        job.result(5)
+    batcher.close()
+    assert model.calls == [["a", "c"], ["b"]]
+    assert model.kwargs == [
+        {"batch_size": 2},
+        {"batch_size": 1, "normalize_embeddings": True},
+    ]
+
+
+def test_aencode_uses_batcher_futures_and_cache():
+    model = FakeModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait=0.05)
+    encoder = CachedEncoder(batcher, EmbeddingCache(maxsize=10))
+
+    async def run():
+        return await asyncio.gather(
+            *(encoder.aencode_one(t) for t in ["a", "b", "c", "a"])
+        )
+
+    vectors = asyncio.run(run())
+    batcher.close()
+    assert vectors[0] == FakeModel().encode(["a"])[0].tolist()
+    assert vectors[0] == vectors[3]
+    assert {t for call in model.calls for t in call} == {"a", "b", "c"}
+
+
+def test_model_loader_backend_selection():
+    arm = ModelLoader(backend="onnx-int8", int8_config="arm64")
+    avx2 = ModelLoader(backend="onnx-int8", int8_config="avx2")
+    assert ModelLoader(backend="onnx").onnx_file_name() is None
+    assert arm.onnx_file_name() == "onnx/model_qint8_arm64.onnx"
+    assert avx2.onnx_file_name() == "onnx/model_quint8_avx2.onnx"
+    with pytest.raises(ValueError):
+        ModelLoader(backend="tensorrt")
+    assert model_namespace("m", "torch") == "m"
+    assert model_namespace("m", "onnx-int8") == "m+onnx-int8"
+
+
+def test_cosine_drift():
+    reference = np.array([[1.0, 0.0], [0.0, 1.0]])
+    report = cosine_drift(reference, reference * 2)
+    assert report["cosine_min"] == pytest.approx(1.0)
+    assert cosine_drift(reference, np.array([[1.0, 0.0], [1.0, 0.0]]))[
+        "cosine_min"
+    ] == pytest.approx(0.0)
@@ -0,0 +1,116 @@
+import pytest
+
+from backend.index_advisor import (
+    AdvisorUnavailable,
+    candidate_indexes,
+    recommend_indexes,
+)
+
+
+class FakeHypoCursor:
+    def __init__(self, costs, hypopg=True):
+        self.costs = costs
+        self.hypopg = hypopg
+        self.active = None
+        self.executed = []
+        self.row = None
+
+    def execute(self, statement, params=None):
+        statement = str(statement)
+        self.executed.append(statement)
+        if "pg_extension" in statement:
+            self.row = (1,) if self.hypopg else None
+        elif "hypopg_create_index" in statement:
+            self.active = params[0]
+            self.row = (42,)
+        elif "hypopg_relation_size" in statement:
+            self.row = (8192,)
+        elif "hypopg_drop_index" in statement:
+            self.active = None
+        elif "iquerio_explain" in statement:
+            cost = next(
+                (
+                    c
+                    for cols, c in self.costs.items()
+                    if self.active and cols in self.active
+                ),
+                self.costs["baseline"],
+            )
+            self.row = ([{"Plan": {"Total Cost": cost}}],)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.rolled_back = False
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+@pytest.fixture(autouse=True)
+def plain_identifiers(monkeypatch):
+    from psycopg2 import sql
+
+    for composable in (sql.Composed, sql.SQL, sql.Identifier):
+        monkeypatch.setattr(composable, "as_string", lambda self, ctx: _render(self))
+
+
+def _render(composable):
+    from psycopg2 import sql
+
+    if isinstance(composable, sql.Composed):
+        return "".join(_render(part) for part in composable.seq)
+    if isinstance(composable, sql.Identifier):
+        return ".".join(composable.strings)
+    return composable.string
+
+
+def test_candidates_from_filters_joins_and_order_by():
+    candidates = candidate_indexes(
+        "SELECT u.name FROM users u JOIN orders o ON o.user_id = u.id "
+        "WHERE u.age + 1 > 30 ORDER BY u.created_at DESC"
+    )
+    columns = {(c["table"], tuple(c["columns"]), c["from"]) for c in candidates}
+    assert ("orders", ("user_id",), "join") in columns
+    assert ("users", ("age",), "filter") in columns
+    assert ("users", ("created_at",), "order") in columns
+    assert ("users", ("age", "created_at"), "filter+order") in columns
+
+
+def test_recommend_indexes_keeps_only_cheaper_candidates():
+    cursor = FakeHypoCursor({"baseline": 1000.0, "(age)": 40.0, "(name)": 990.0})
+    connection = FakeConnection(cursor)
+    report = recommend_indexes(
+        connection, "SELECT id FROM users WHERE age > 30 AND name = 'x'"
+    )
+    assert report["mode"] == "hypopg"
+    assert [r["columns"] for r in report["recommendations"]] == [["age"]]
+    best = report["recommendations"][0]
+    assert best["cost_delta"] == -960.0
+    assert best["estimated_size_bytes"] == 8192
+    assert best["sql"] == "CREATE INDEX idx_users_age ON users (age);"
+    assert {tuple(r["columns"]) for r in report["rejected"]} == {
+        ("name",),
+        ("age", "name"),
+    }
+    assert connection.rolled_back
+
+
+def test_recommend_indexes_requires_hypopg_unless_rollback_allowed():
+    connection = FakeConnection(FakeHypoCursor({"baseline": 1.0}, hypopg=False))
+    with pytest.raises(AdvisorUnavailable):
+        recommend_indexes(connection, "SELECT id FROM users WHERE age > 30")
+    assert connection.rolled_back
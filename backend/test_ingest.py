@@ -0,0 +1,112 @@
+import io
+
+import numpy as np
+import psycopg2
+
+from backend.ingest import _copy_value, detect_format, ingest_users, iter_records
+
+
+class FakeEncoder:
+    def encode(self, texts):
+        return [[float(len(t)), 0.5] for t in texts]
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        pass
+
+    def copy_expert(self, sql, buffer):
+        if "violates" in buffer.getvalue():
+            raise psycopg2.IntegrityError("new row violates check constraint")
+        self.conn.copied.append(buffer.getvalue())
+
+    def fetchone(self):
+        lines = self.conn.copied[-1].splitlines()
+        rows = [line.split("\t") for line in lines]
+        inserted = sum(1 for r in rows if r[1] == "\\N")
+        updated = [int(r[0]) for r in rows if r[1] not in ("\\N", "404")]
+        return inserted, updated
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.copied = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_detect_format():
+    assert detect_format("application/x-ndjson") == "ndjson"
+    assert detect_format("text/csv; charset=utf-8") == "csv"
+    assert detect_format(filename="users.jsonl") == "ndjson"
+    assert detect_format() == "json"
+
+
+def test_copy_value_escapes_text_and_vectors():
+    assert _copy_value(None) == "\\N"
+    assert _copy_value("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+    assert _copy_value([1.0, 0.25]) == "[1.0,0.25]"
+
+
+def test_iter_records_csv():
+    data = io.BytesIO(b"user_id,description\n1,AI researcher\n2,Cloud engineer\n")
+    records = list(iter_records(data, "csv"))
+    assert records[1] == (2, {"user_id": "2", "description": "Cloud engineer"})
+
+
+def test_ingest_reports_per_row_failures():
+    payload = b"\n".join(
+        [
+            b'{"user_id": 1, "description": "AI researcher"}',
+            b'{"user_id": 404, "description": "Missing user"}',
+            b'{"name": "Eve", "age": 31, "description": "New user"}',
+            b'{"user_id": "x", "description": "Bad id"}',
+            b"not json",
+            b'{"user_id": 1, "description": "AI researcher, updated"}',
+        ]
+    )
+    connection = FakeConnection()
+    report = ingest_users(
+        io.BytesIO(payload), "ndjson", FakeEncoder(), connection, batch_size=3
+    )
+    assert report["received"] == 6
+    assert report["inserted"] == 1
+    assert report["updated"] == 2
+    assert {f["row"] for f in report["failures"]} == {2, 4, 5}
+    assert len(connection.copied) == 2
+    assert report["rows_per_second"] > 0
+
+
+def test_database_error_fails_only_the_offending_row():
+    class ArrayEncoder:
+        def encode(self, texts):
+            return np.array([[float(len(t)), 0.5] for t in texts])
+
+    payload = b"\n".join(
+        [
+            b'{"name": "Ann", "description": "AI researcher"}',
+            b'{"name": "Bob", "description": "violates a constraint"}',
+            b'{"name": "Cy", "age": 3000000000, "description": "Too old"}',
+            b'{"user_id": 1, "description": "Cloud engineer"}',
+        ]
+    )
+    connection = FakeConnection()
+    report = ingest_users(io.BytesIO(payload), "ndjson", ArrayEncoder(), connection)
+    assert report["inserted"] == 1
+    assert report["updated"] == 1
+    assert [f["row"] for f in report["failures"]] == [3, 2]
+    assert "out of range" in report["failures"][0]["error"]
+    assert "[13.0,0.5]" in connection.copied[0]
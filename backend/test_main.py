@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.db import PoolTimeout
+from backend.embeddings import ModelLoader
+
+IMPORT_TIME_BUDGET = float(os.getenv("MAIN_IMPORT_TIME_BUDGET", "3.0"))
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeModel:
+    def encode(self, texts, convert_to_tensor=False, **kwargs):
+        return np.zeros((len(texts), 384), dtype=np.float32)
+
+
+def test_import_main_is_fast_and_does_not_load_torch():
+    code = (
+        "import sys, time; start = time.perf_counter(); import backend.main; "
+        "print(time.perf_counter() - start); "
+        "print('torch' in sys.modules or 'sentence_transformers' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert float(output[0]) < IMPORT_TIME_BUDGET
+    assert output[1] == "False"
+
+
+def test_liveness_and_readiness(monkeypatch):
+    loader = ModelLoader(warmup_batch_size=2)
+    monkeypatch.setattr(loader, "_build", FakeModel)
+    monkeypatch.setattr(main, "model_loader", loader)
+    client = TestClient(main.app)
+
+    assert client.get("/health").json() == {"status": "alive"}
+    assert client.get("/ready").status_code == 503
+
+    loader.start()
+    assert loader.wait(5)
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["warmup_seconds"] is not None
+
+
+def test_readiness_reports_load_failure(monkeypatch):
+    def broken():
+        raise OSError("model not found at /models/minilm")
+
+    loader = ModelLoader()
+    monkeypatch.setattr(loader, "_build", broken)
+    monkeypatch.setattr(main, "model_loader", loader)
+    loader.load()
+    response = TestClient(main.app).get("/ready")
+    assert response.status_code == 503
+    assert "model not found" in response.json()["error"]
+
+
+def test_pool_exhaustion_is_a_503(monkeypatch):
+    def exhausted():
+        raise PoolTimeout("Timed out after 5.00s waiting for a database connection")
+
+    monkeypatch.setattr(main, "fetch_vector_indexes", exhausted)
+    response = TestClient(main.app).get("/vector-indexes")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert "Timed out" in response.json()["detail"]
+
+
+def test_workload_parallelism_is_capped_by_the_server(monkeypatch):
+    captured = {}
+
+    def fake_analyse(body, fmt, workers, max_explains, top):
+        captured.update(workers=workers, max_explains=max_explains)
+        return {"top": []}
+
+    monkeypatch.setattr(main, "analyse_workload", fake_analyse)
+    response = TestClient(main.app).post(
+        "/optimize-workload?format=sql&workers=500&max_explains=500",
+        content=b"SELECT 1;",
+    )
+    assert response.status_code == 200
+    assert captured == {"workers": 4, "max_explains": 2}
@@ -0,0 +1,66 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.concurrency import BoundedExecutor
+from backend.metrics import Histogram, Registry, _timings, record_stage, stage
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(
+        Histogram("latency_seconds", "Latency", ("route",), (0.1, 1.0))
+    )
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5.0, "/a")
+    registry.gauge("pool", "Pool", lambda: [({"state": "idle"}, 3), ({}, None)])
+
+    text = registry.render()
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="/a"} 3' in text
+    assert 'pool{state="idle"} 3' in text
+    assert text.count("\npool") == 1
+
+
+def test_stages_in_executor_threads_reach_the_request():
+    executor = BoundedExecutor("metrics-test", max_workers=1)
+
+    def work():
+        with stage("db_work"):
+            pass
+        record_stage("db_work", 0.25)
+
+    async def request():
+        timings = {}
+        token = _timings.set(timings)
+        try:
+            await executor.run(work)
+        finally:
+            _timings.reset(token)
+        return timings
+
+    try:
+        timings = asyncio.run(request())
+    finally:
+        executor.shutdown()
+    assert timings["db_work"] >= 0.25
+
+
+def test_metrics_endpoint_and_timing_header():
+    client = TestClient(main.app)
+    response = client.get("/health", headers={"X-IQuerio-Timing": "1"})
+    assert "total;dur=" in response.headers["server-timing"]
+    assert "server-timing" not in client.get("/health").headers
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'iquerio_requests_total{method="GET",route="/health",status="200"}' in body
+    assert 'iquerio_executor_tasks{executor="db",state="running"}' in body
+    assert 'iquerio_cache_hit_ratio{cache="search"}' in body
@@ -0,0 +1,110 @@
+import pytest
+
+from backend import nl_query
+from backend.nl_query import parse_nl_query, plan_filtered_search
+from backend.search import build_search_sql
+
+
+class FakePlannerCursor:
+    def __init__(self, total, matching, extversion="0.8.0"):
+        self.total = total
+        self.matching = matching
+        self.extversion = extversion
+        self.row = None
+
+    def execute(self, statement, params=None):
+        if "pg_extension" in statement:
+            self.row = (self.extversion,)
+        elif statement.startswith("EXPLAIN"):
+            rows = self.matching if params else self.total
+            self.row = ([{"Plan": {"Plan Rows": rows}}],)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    nl_query._catalog.clear()
+    indexes = [{"name": "idx_users_embedding_hnsw", "definition": "vector_l2_ops"}]
+    monkeypatch.setattr(nl_query, "list_indexes", lambda connection: indexes)
+
+    def plan(total, matching, conditions=("age > %s",), strategy="auto", **kwargs):
+        connection = FakeConnection(FakePlannerCursor(total, matching, **kwargs))
+        return plan_filtered_search(
+            connection, "l2", list(conditions), [30], 5, strategy
+        )
+
+    yield plan
+    nl_query._catalog.clear()
+
+
+def test_parse_ranges_names_and_counts():
+    query = parse_nl_query("Top 5 users aged 25 to 35 named Sam similar to 'AI'")
+    assert query.description == "ai"
+    assert query.conditions == ["age BETWEEN %s AND %s", "name ILIKE %s"]
+    assert query.params == [25, 35, "sam"]
+    assert query.limit == 5
+
+    query = parse_nl_query("users at least 40 whose name starts with an similar to ml")
+    assert query.conditions == ["age >= %s", "name ILIKE %s"]
+    assert query.params == [40, "an%"]
+    assert query.limit is None
+
+    with pytest.raises(ValueError):
+        parse_nl_query("users over 30")
+
+
+def test_planner_picks_strategy_by_selectivity(planner):
+    assert planner(1_000_000, 500)["name"] == "prefilter"
+    assert planner(1_000_000, 500_000)["name"] == "overfetch"
+    assert planner(1_000_000, 30_000)["name"] == "iterative"
+    assert planner(1_000_000, 30_000, extversion="0.7.4")["name"] == "iterative"
+    nl_query._catalog.clear()
+    assert planner(1_000_000, 30_000, extversion="0.7.4")["name"] == "overfetch"
+    assert planner(1_000_000, 1_000_000, conditions=())["name"] == "index"
+
+    plan = planner(1_000_000, 500_000)
+    assert plan["selectivity"] == 0.5
+    assert plan["overfetch"] == 24
+
+
+def test_planner_scans_unfiltered_searches_without_materializing(planner, monkeypatch):
+    monkeypatch.setattr(nl_query, "list_indexes", lambda connection: [])
+    assert planner(1_000_000, 500, conditions=())["name"] == "index"
+    assert planner(1_000_000, 500)["name"] == "prefilter"
+
+
+def test_iterative_strategy_needs_pgvector_0_8(planner):
+    with pytest.raises(ValueError, match="pgvector 0.8"):
+        planner(1_000_000, 30_000, strategy="iterative", extversion="0.7.4")
+    nl_query._catalog.clear()
+    assert planner(1_000_000, 30_000, strategy="iterative")["name"] == "iterative"
+
+
+def test_strategy_sql_keeps_keyset_order():
+    for strategy in ("index", "prefilter", "overfetch", "iterative"):
+        sql, params = build_search_sql(
+            "<->", "[0,0]", 5, ["age > %s"], [30], (0.5, 7), strategy, 24
+        )
+        assert sql.endswith("ORDER BY distance, id LIMIT %s")
+        assert sql.count("%s") == len(params)
+        assert params[-1] == 6
+    assert (
+        "AS MATERIALIZED"
+        in build_search_sql("<->", "[0,0]", 5, strategy="prefilter")[0]
+    )
@@ -1,6 +1,19 @@
+import contextlib
 import os
+import psycopg2.errors
 import pytest
-from backend.optimizer import optimize_query
+import sqlparse
+from backend import optimizer
+from backend.db import connect_from_env
+from backend.optimizer import analysis_cache, optimize_query
+from backend.plan_analysis import EXPLAIN_FUNCTIONS_SQL, explain_json
+from backend.query_cache import (
+    SCHEMA_VERSION_SQL,
+    SchemaVersion,
+    TTLCache,
+    fingerprint_query,
+)
+from backend.rules import RULES, Rule, RuleEngine
 
 os.environ["ENV"] = "test"
 
@@ -11,6 +24,72 @@ def test_invalid_query():
     assert "Invalid SQL query" in result["issues"]
 
 
+def test_multiple_statements_are_rejected_before_explain(monkeypatch):
+    monkeypatch.setenv("ENV", "dev")
+    monkeypatch.setattr(optimizer, "explain", pytest.fail)
+    with pytest.raises(ValueError, match="one SQL statement"):
+        optimize_query("SELECT name FROM users; DROP TABLE users", use_cache=False)
+    monkeypatch.setenv("ENV", "test")
+    result = optimize_query("SELECT name FROM users; -- trailing comment")
+    assert result["optimized_query"].startswith("SELECT name FROM users")
+
+
+class RecordingConnection:
+    server_version = 160001
+
+    def __init__(self):
+        self.statements = []
+        self.bound = []
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+        self.bound += list(params or ())
+
+    def fetchone(self):
+        return ([{"Plan": {"Node Type": "Result", "Total Cost": 0.01}}],)
+
+    def close(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.mark.parametrize("analyze", [False, True])
+def test_smuggled_statements_never_reach_the_server_as_sql(monkeypatch, analyze):
+    payload = "SELECT '\\'; COMMIT; DELETE FROM users; --'"
+    connection = RecordingConnection()
+    monkeypatch.setenv("ENV", "dev")
+    monkeypatch.setattr(
+        optimizer, "pooled_connection", lambda: contextlib.nullcontext(connection)
+    )
+    result = optimize_query(payload, use_cache=False, analyze=analyze)
+    assert result["explain_plan"][0]["Plan"]["Node Type"] == "Result"
+    assert not any("DELETE" in statement for statement in connection.statements)
+    assert any("iquerio_explain(%s)" in s for s in connection.statements)
+    assert any(payload in str(value) for value in connection.bound)
+    assert ("SET TRANSACTION READ ONLY" in connection.statements) is not analyze
+
+
+def test_explain_functions_are_installed_once_per_connection(monkeypatch):
+    connection = RecordingConnection()
+    monkeypatch.setattr(
+        optimizer, "pooled_connection", lambda: contextlib.nullcontext(connection)
+    )
+    optimizer.explain("SELECT 1")
+    optimizer.explain("SELECT 2", analyze=True)
+    installs = [s for s in connection.statements if "CREATE OR REPLACE" in s]
+    assert len(installs) == 1
+    assert connection.commits == 1
+
+
 def test_select_star_replacement():
     result = optimize_query("SELECT * FROM users WHERE age + 1 > 30")
     assert result["original_query"] == "SELECT * FROM users WHERE age + 1 > 30"
@@ -20,13 +99,244 @@ def test_select_star_replacement():
     )
 
 
+def test_select_star_rewrite_leaves_subqueries_alone():
+    result = optimize_query("SELECT * FROM (SELECT * FROM users) u", use_cache=False)
+    assert result["optimized_query"] == "SELECT id, name FROM (SELECT * FROM users) u"
+    result = optimize_query(
+        "WITH x AS (SELECT * FROM users) select * from x", use_cache=False
+    )
+    assert result["optimized_query"] == (
+        "WITH x AS (SELECT * FROM users) select id, name from x"
+    )
+
+
 def test_where_expression_optimization():
     result = optimize_query("SELECT name FROM users WHERE age + 1 > 30")
     assert "age + 1 > 30" in result["optimized_query"] or any(
         "Expressions in WHERE" in issue for issue in result["issues"]
     )
+    result = optimize_query("SELECT name FROM users WHERE score * 2 < 10")
+    assert "Expressions in WHERE (score * 2) prevent index usage." in result["issues"]
+    assert "Move the arithmetic in score * 2 < 10 to the other side." in (
+        result["suggestions"]
+    )
+    result = optimize_query("SELECT name FROM users WHERE age + 5 > 50")
+    assert "Simplify to a direct column comparison: age > 45." in (
+        result["suggestions"]
+    )
+    result = optimize_query("SELECT name FROM users WHERE 30 < age + 1")
+    assert "Expressions in WHERE (age + 1) prevent index usage." in result["issues"]
+    assert result["optimized_query"] == "SELECT name FROM users WHERE age > 29"
 
 
 def test_add_where_suggestion():
     result = optimize_query("SELECT name FROM users")
     assert any("Consider adding a WHERE clause" in s for s in result["suggestions"])
+
+
+def test_fingerprint_normalizes_literals_whitespace_and_case():
+    a, normalized = fingerprint_query("select name from Users where age > 30")
+    b, _ = fingerprint_query("SELECT  name\nFROM users WHERE age > 45;")
+    c, _ = fingerprint_query("SELECT name FROM users WHERE age < 45")
+    assert a == b != c
+    assert normalized == "SELECT name FROM users WHERE age > ?"
+    in_a, _ = fingerprint_query("SELECT id FROM users WHERE id IN (1, 2, 3)")
+    in_b, _ = fingerprint_query("SELECT id FROM users WHERE id IN (7)")
+    assert in_a == in_b
+
+
+def test_optimize_query_cache_hit_reapplies_rewrites():
+    analysis_cache.clear()
+    first = optimize_query("SELECT * FROM users WHERE name = 'Soman'")
+    second = optimize_query("SELECT * FROM users WHERE name = 'Babu'")
+    assert first["cache"]["hit"] is False
+    assert second["cache"]["hit"] is True
+    assert second["cache"]["fingerprint"] == first["cache"]["fingerprint"]
+    assert second["optimized_query"] == "SELECT id, name FROM users WHERE name = 'Babu'"
+    assert second["issues"] == first["issues"]
+    assert (
+        optimize_query("SELECT * FROM users", use_cache=False)["cache"]["hit"] is False
+    )
+
+
+def test_cache_hit_reruns_literal_specific_rewrites(monkeypatch):
+    monkeypatch.setenv("ENV", "dev")
+    explained = []
+
+    # The second query's literals plan differently: its own original is
+    # cheaper than its rewrite, unlike the first query's cached plan
+    costs = {"+ 1 > 30": 120.0, "age > 29": 80.0, "+ 5 > 50": 60.0, "age > 45": 80.0}
+
+    def explain(query, analyze=False, relation_rows=None, limiter=None):
+        explained.append(query)
+        cost = next(c for fragment, c in costs.items() if fragment in query)
+        return [{"Plan": {"Node Type": "Result", "Total Cost": cost}}]
+
+    monkeypatch.setattr(optimizer, "explain", explain)
+    analysis_cache.clear()
+    first = optimize_query("SELECT name FROM users WHERE age + 1 > 30")
+    second = optimize_query("SELECT name FROM users WHERE age + 5 > 50")
+    assert second["cache"]["hit"] is True
+    assert first["optimized_query"] == "SELECT name FROM users WHERE age > 29"
+    assert first["rewrite_check"]["status"] == "verified"
+    assert second["rewrite_check"]["status"] == "rejected"
+    assert second["rewrite_check"]["original"]["total_cost"] == 60.0
+    assert second["optimized_query"] == "SELECT name FROM users WHERE age + 5 > 50"
+    assert sorted(explained[2:]) == [
+        "SELECT name FROM users WHERE age + 5 > 50",
+        "SELECT name FROM users WHERE age > 45",
+    ]
+
+    optimize_query("SELECT name FROM users WHERE age + 5 > 50")
+    assert len(explained) == 4
+
+
+def test_temporary_ddl_does_not_invalidate_the_cache(monkeypatch):
+    try:
+        connection = connect_from_env()
+    except psycopg2.OperationalError:
+        pytest.skip("needs a Postgres database (DB_* settings)")
+    cursor = connection.cursor()
+    try:
+        try:
+            cursor.execute(SCHEMA_VERSION_SQL)
+        except psycopg2.errors.InsufficientPrivilege:
+            pytest.skip("event triggers need a superuser")
+
+        def read_version():
+            cursor.execute("SELECT version FROM iquerio_schema_version WHERE id = 1")
+            return cursor.fetchone()[0]
+
+        def explain(query, analyze=False, relation_rows=None, limiter=None):
+            # The session-local DDL of the EXPLAIN path and of bulk ingestion
+            cursor.execute(EXPLAIN_FUNCTIONS_SQL)
+            cursor.execute("CREATE TEMP TABLE iquerio_staging (id INTEGER)")
+            cursor.execute("DROP TABLE iquerio_staging")
+            return explain_json(cursor, query)
+
+        monkeypatch.setenv("ENV", "dev")
+        monkeypatch.setattr(optimizer, "schema_version", SchemaVersion(0, read_version))
+        monkeypatch.setattr(optimizer, "explain", explain)
+        query = "SELECT relname FROM pg_class WHERE relpages > 10"
+        assert optimize_query(query)["cache"]["hit"] is False
+        assert optimize_query(query, use_cache=False)["cache"]["hit"] is False
+        assert optimize_query(query)["cache"]["hit"] is True
+        cursor.execute("CREATE TABLE iquerio_schema_change (id INTEGER)")
+        assert optimize_query(query)["cache"]["hit"] is False
+    finally:
+        cursor.close()
+        connection.rollback()
+        connection.close()
+
+
+def test_ttl_cache_expiry_and_eviction():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") == (None, None)
+    now[0] = 5
+    assert cache.get("b") == (2, 5)
+    now[0] = 11
+    assert cache.get("c") == (None, None)
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["expired"] == 1
+
+
+def test_rule_engine_walks_nested_subqueries_and_rewrites_generally():
+    result = optimize_query(
+        "SELECT u.id FROM users u JOIN users v ON u.id = v.id "
+        "WHERE u.score - 2 >= 10 AND u.id IN (SELECT * FROM orders)",
+        use_cache=False,
+    )
+    assert "u.score >= 12" in result["optimized_query"]
+    assert "SELECT * in a subquery fetches unnecessary columns." in result["issues"]
+    assert any("redundant JOIN" in issue for issue in result["issues"])
+    assert set(result["rule_timings_ms"]) == set(RULES)
+
+
+def test_rules_can_be_enabled_and_disabled_per_request():
+    query = "SELECT * FROM users WHERE age + 1 > 30"
+    only = optimize_query(query, use_cache=False, rules=["where_expression"])
+    assert only["optimized_query"] == "SELECT * FROM users WHERE age > 29"
+    assert list(only["rule_timings_ms"]) == ["where_expression"]
+    skipped = optimize_query(query, disabled_rules=["select_star"])
+    assert skipped["cache"]["hit"] is False
+    assert not any("SELECT *" in issue for issue in skipped["issues"])
+    with pytest.raises(ValueError):
+        optimize_query(query, rules=["no_such_rule"])
+
+
+def test_where_rules_only_see_where_clauses_and_share_token_text():
+    seen = []
+
+    class Comparisons(Rule):
+        name = "comparisons"
+        groups = (sqlparse.sql.Comparison,)
+        in_where = True
+
+        def visit(self, token, ctx):
+            seen.append((ctx.text(token), ctx.parts(token) is ctx.parts(token)))
+
+    query = "SELECT a.x FROM a JOIN b ON a.id = b.id WHERE a.x  +  1 > 2"
+    RuleEngine([Comparisons()]).run(query, sqlparse.parse(query)[0])
+    assert seen == [("a.x  +  1 > 2", True)]
+
+
+def _fake_explain(costs):
+    def explain(query, analyze=False, relation_rows=None, limiter=None):
+        for fragment, cost in costs.items():
+            if fragment in query:
+                if isinstance(cost, Exception):
+                    raise cost
+                return [{"Plan": {"Node Type": "Result", "Total Cost": cost}}]
+        raise AssertionError(query)
+
+    return explain
+
+
+def test_rewrite_is_returned_only_when_it_plans_cheaper(monkeypatch):
+    monkeypatch.setenv("ENV", "dev")
+    monkeypatch.setattr(
+        optimizer, "explain", _fake_explain({"age + 1": 120.0, "age > 29": 80.0})
+    )
+    result = optimize_query(
+        "SELECT name FROM users WHERE age + 1 > 30", use_cache=False
+    )
+    assert result["optimized_query"] == "SELECT name FROM users WHERE age > 29"
+    assert result["rewrite_check"]["status"] == "verified"
+    assert result["rewrite_check"]["cost_delta"] == -40.0
+
+    monkeypatch.setattr(
+        optimizer, "explain", _fake_explain({"age + 1": 120.0, "age > 29": 150.0})
+    )
+    result = optimize_query(
+        "SELECT name FROM users WHERE age + 1 > 30", use_cache=False
+    )
+    assert result["optimized_query"] == "SELECT name FROM users WHERE age + 1 > 30"
+    assert result["rewrite_check"]["status"] == "rejected"
+
+
+def test_rewrite_that_fails_to_plan_is_rejected(monkeypatch):
+    monkeypatch.setenv("ENV", "dev")
+    missing = psycopg2.errors.UndefinedColumn('column "name" does not exist')
+    monkeypatch.setattr(
+        optimizer, "explain", _fake_explain({"SELECT *": 10.0, "id, name": missing})
+    )
+    result = optimize_query("SELECT * FROM users WHERE id = 1", use_cache=False)
+    assert result["optimized_query"] == "SELECT * FROM users WHERE id = 1"
+    assert result["rewrite_check"]["status"] == "rejected"
+    assert "failed to plan" in result["rewrite_check"]["reason"]
+
+
+def test_ttl_cache_weight_bound():
+    cache = TTLCache(maxsize=10, ttl=10, weigher=len, max_weight=10)
+    cache.set("a", "xxxx")
+    cache.set("b", "xxxx")
+    cache.set("c", "xxxx")
+    assert cache.get("a") == (None, None)
+    assert cache.stats()["weight"] == 8
+    cache.set("huge", "x" * 11)
+    assert cache.get("huge") == (None, None)
+    assert cache.get("c")[0] == "xxxx"
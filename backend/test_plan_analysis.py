@@ -0,0 +1,95 @@
+from backend.plan_analysis import analyze_plan, seq_scan_relations, walk_plan
+
+PLAN = {
+    "Node Type": "Nested Loop",
+    "Total Cost": 52000.0,
+    "Plan Rows": 50,
+    "Actual Rows": 48000,
+    "Actual Loops": 1,
+    "Actual Total Time": 812.5,
+    "Plans": [
+        {
+            "Node Type": "Sort",
+            "Parent Relationship": "Outer",
+            "Plan Rows": 20000,
+            "Total Cost": 9000.0,
+            "Sort Method": "external merge",
+            "Sort Space Type": "Disk",
+            "Sort Space Used": 4096,
+            "Actual Rows": 20000,
+            "Actual Loops": 1,
+            "Plans": [
+                {
+                    "Node Type": "Seq Scan",
+                    "Relation Name": "orders",
+                    "Plan Rows": 20000,
+                    "Total Cost": 400.0,
+                    "Actual Rows": 20000,
+                    "Actual Loops": 1,
+                    "Actual Total Time": 12.0,
+                    "Shared Hit Blocks": 10,
+                    "Shared Read Blocks": 90,
+                }
+            ],
+        },
+        {
+            "Node Type": "Index Scan",
+            "Parent Relationship": "Inner",
+            "Relation Name": "users",
+            "Index Name": "users_pkey",
+            "Plan Rows": 1,
+            "Total Cost": 0.3,
+            "Actual Rows": 0,
+            "Actual Loops": 0,
+        },
+    ],
+}
+
+
+def test_walk_plan_visits_every_node_with_depth():
+    assert [(n["Node Type"], d) for n, d in walk_plan(PLAN)] == [
+        ("Nested Loop", 0),
+        ("Sort", 1),
+        ("Seq Scan", 2),
+        ("Index Scan", 1),
+    ]
+
+
+def test_analyze_plan_flags_deep_problems():
+    issues = analyze_plan(PLAN)["issues"]
+    assert any("Seq Scan on orders (depth 2)" in issue for issue in issues)
+    assert any("Sort (depth 1) spilled to disk" in issue for issue in issues)
+    assert any("Nested loop with a large outer side" in issue for issue in issues)
+    assert not any("Row estimate off" in issue for issue in issues)
+
+
+def test_analyze_plan_reports_misestimates_and_buffers_when_analyzed():
+    findings = analyze_plan(PLAN, analyzed=True)
+    misestimates = [i for i in findings["issues"] if "Row estimate off" in i]
+    assert misestimates == [
+        "Row estimate off: Nested Loop (depth 0) estimated 50 rows, got 48000 per loop."
+    ]
+    scan = findings["nodes"][2]
+    assert scan["time_ms"] == 12.0
+    assert scan["buffers"] == {"shared_hit": 10, "shared_read": 90}
+
+
+def test_seq_scan_size_counts_rows_read_not_rows_returned():
+    scan = {
+        "Node Type": "Seq Scan",
+        "Relation Name": "users",
+        "Plan Rows": 5,
+        "Total Cost": 900.0,
+        "Actual Rows": 4,
+        "Actual Loops": 1,
+        "Rows Removed by Filter": 49996,
+    }
+    assert seq_scan_relations(scan) == ["users"]
+    assert not analyze_plan(scan)["issues"]
+    estimated = analyze_plan(scan, relation_rows={"users": 50000.0})["issues"]
+    assert estimated == [
+        "Sequential scan on a large relation: Seq Scan on users (depth 0), "
+        "~50000 rows scanned."
+    ]
+    assert analyze_plan(scan, analyzed=True)["issues"][0] == estimated[0]
+    assert not analyze_plan(scan, relation_rows={"users": -1.0})["issues"]
@@ -0,0 +1,49 @@
+from backend.quantization import backfill, compact_index_name
+
+
+class BatchCursor:
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.rowcount = -1
+        self.executed = []
+
+    def execute(self, statement, params=None):
+        self.executed.append((statement, params))
+        self.rowcount = self.batches.pop(0) if self.batches else 0
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def test_backfill_commits_each_batch_until_done():
+    cursor = BatchCursor([1000, 1000, 250])
+    connection = FakeConnection(cursor)
+    assert backfill(connection, "binary", batch_size=1000) == 2250
+    assert connection.commits == 4
+    statement, params = cursor.executed[0]
+    assert "SET embedding_bits = binary_quantize(embedding)::bit(384)" in statement
+    assert params == (1000,)
+
+
+def test_compact_index_name():
+    assert compact_index_name("halfvec", "cosine") == (
+        "users_embedding_half_hnsw_cosine_idx"
+    )
+    assert compact_index_name("binary", "cosine") == (
+        "users_embedding_bits_hnsw_hamming_idx"
+    )
@@ -0,0 +1,199 @@
+import pytest
+
+from backend import reembed
+from backend.reembed import Throttle, search_model_filter
+
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.users = {i: {"description": d, "model": "old"} for i, d in rows}
+        self.job = None
+
+
+class FakeCursor:
+    def __init__(self, db, connection):
+        self.db = db
+        self.connection = connection
+        self.row = None
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, statement, params=None):
+        db = self.db
+        if "INSERT INTO iquerio_reembed_jobs" in statement:
+            if db.job is None or db.job["status"] == "done" or params["restart"]:
+                db.job = {"last_id": 0, "rows_done": 0}
+            db.job["status"] = "running"
+            self.row = (db.job["last_id"], db.job["rows_done"])
+        elif statement.startswith("SELECT id, description"):
+            last_id, version, limit = params
+            self.rows = [
+                (i, row["description"])
+                for i, row in sorted(db.users.items())
+                if i > last_id and row["model"] != version
+            ][:limit]
+        elif "SET last_id" in statement:
+            db.job["last_id"] = params[0]
+            db.job["rows_done"] += params[1]
+        elif "SET status = 'done'" in statement:
+            db.job["status"] = "done"
+        elif statement.startswith("SELECT count(*)"):
+            self.row = (sum(r["model"] != params[0] for r in db.users.values()),)
+
+    def fetchone(self):
+        return self.row
+
+    def fetchall(self):
+        self.connection.reads += 1
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.commits = 0
+        self.reads = 0
+        self.max_reads_per_transaction = 0
+
+    def cursor(self):
+        return FakeCursor(self.db, self)
+
+    def _end_transaction(self):
+        self.max_reads_per_transaction = max(self.max_reads_per_transaction, self.reads)
+        self.reads = 0
+
+    def commit(self):
+        self.commits += 1
+        self._end_transaction()
+
+    def rollback(self):
+        self._end_transaction()
+
+
+class FlakyEncoder:
+    def __init__(self, fail_on_call=None):
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+
+    def encode(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("worker killed")
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = FakeDatabase([(i, f"user {i}") for i in range(1, 11)])
+
+    def fake_execute_values(cursor, statement, argslist, template=None, page_size=0):
+        cursor.rowcount = 0
+        for row_id, description, embedding in argslist:
+            row = db.users[row_id]
+            if row["description"] == description and row["model"] != "new":
+                row.update(model="new", embedding=embedding)
+                cursor.rowcount += 1
+
+    monkeypatch.setattr(reembed, "execute_values", fake_execute_values)
+    return db
+
+
+def run(db, encoder, read_connection=None, **kwargs):
+    unthrottled = Throttle(max_active=0, max_rows_per_second=0)
+    return reembed.reembed(
+        read_connection or FakeConnection(db),
+        FakeConnection(db),
+        encoder,
+        "new",
+        4,
+        unthrottled,
+        **kwargs,
+    )
+
+
+def test_job_resumes_from_checkpoint_after_crash(database):
+    with pytest.raises(RuntimeError):
+        run(database, FlakyEncoder(fail_on_call=2))
+    assert database.job == {"last_id": 4, "rows_done": 4, "status": "running"}
+
+    encoder = FlakyEncoder()
+    read_connection = FakeConnection(database)
+    result = run(database, encoder, read_connection)
+    assert read_connection.max_reads_per_transaction == 1
+    assert result["resumed_from_id"] == 4
+    assert result["updated"] == 6
+    assert result["total_updated"] == 10
+    assert result["remaining"] == 0
+    assert encoder.calls == 2
+    assert database.job["status"] == "done"
+    assert all(row["model"] == "new" for row in database.users.values())
+
+    assert run(database, FlakyEncoder())["updated"] == 0
+
+
+def test_rows_changed_after_read_are_skipped(database, monkeypatch):
+    class RacingEncoder(FlakyEncoder):
+        def encode(self, texts):
+            database.users[2]["description"] = "edited while encoding"
+            return super().encode(texts)
+
+    result = run(database, RacingEncoder())
+    assert result["skipped"] == 1
+    assert result["remaining"] == 1
+    assert database.users[2]["model"] == "old"
+
+
+class ActivityConnection:
+    def __init__(self, active):
+        self.active = list(active)
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, params=None):
+        self.row = (self.active.pop(0),)
+
+    def fetchone(self):
+        return self.row
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+def test_throttle_waits_for_db_load_and_rate():
+    sleeps = []
+    now = [0.0]
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    throttle = Throttle(max_active=4, poll_interval=0.5, sleep=sleep)
+    connection = ActivityConnection([9, 6, 2])
+    throttle.wait(connection, 100)
+    assert sleeps == [0.5, 0.5]
+    assert connection.rollbacks == 3
+
+    throttle = Throttle(0, 100, sleep=sleep, clock=lambda: now[0])
+    sleeps.clear()
+    throttle.wait(None, 100)
+    throttle.wait(None, 100)
+    assert sleeps == [1.0]
+
+
+def test_search_model_filter():
+    assert search_model_filter(["age > %s"], [30], "m", enabled=False) == (
+        ["age > %s"],
+        [30],
+    )
+    assert search_model_filter(["age > %s"], [30], "m", enabled=True) == (
+        ["age > %s", "embedding_model = %s"],
+        [30, "m"],
+    )
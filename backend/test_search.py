@@ -0,0 +1,271 @@
+import asyncio
+import contextlib
+import functools
+import json
+import random
+
+import psycopg2
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main, nl_query, search
+from backend.db import connect_from_env
+from backend.query_cache import SchemaVersion
+from backend.reembed import search_model_filter
+from backend.search import (
+    Keyset,
+    SearchResultCache,
+    build_search_sql,
+    decode_cursor,
+    encode_cursor,
+    paginate,
+    search_page,
+)
+
+ROWS = [
+    {"id": i, "name": f"user{i}", "description": "", "distance": i / 10}
+    for i in range(1, 8)
+]
+
+
+def batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def test_cursor_round_trip_and_scope_check():
+    token = encode_cursor(0.1234567890123, 42, "scope-a", 20)
+    assert decode_cursor(token, "scope-a") == (0.1234567890123, 42, 20)
+    with pytest.raises(ValueError):
+        decode_cursor(token, "scope-b")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor", "scope-a")
+
+
+def test_build_search_sql_keeps_index_scan_order_single_key():
+    sql, params = build_search_sql(
+        "<->", [0.0], 3, ["age > %s"], [30], after=Keyset(0.5, 7, 9)
+    )
+    assert (
+        "FROM users WHERE age > %s ORDER BY distance LIMIT %s) candidates "
+        "WHERE (distance, id) > (%s, %s) ORDER BY distance, id LIMIT %s"
+    ) in sql
+    assert params == [[0.0], 30, 13, 0.5, 7, 4]
+    sql, params = build_search_sql("<->", [0.0], 3)
+    assert "ORDER BY distance LIMIT %s) candidates ORDER BY distance, id" in sql
+    assert params == [[0.0], 4, 4]
+    with pytest.raises(ValueError):
+        build_search_sql("<->", [0.0], 0)
+
+
+def test_overfetch_sql_filters_on_any_users_column():
+    conditions, params = search_model_filter(["age > %s"], [30], "m", enabled=True)
+    sql, params = build_search_sql(
+        "<->", [0.0], 3, conditions, params, strategy="overfetch", overfetch=24
+    )
+    assert sql.startswith(
+        "SELECT id, name, description, distance FROM "
+        "(SELECT id, embedding <-> %s::vector AS distance FROM users "
+        "ORDER BY distance LIMIT %s) candidates JOIN users USING (id) "
+        "WHERE age > %s AND embedding_model = %s"
+    )
+    assert params == [[0.0], 24, 30, "m", 4]
+
+
+def test_overfetch_pages_rescan_the_candidates_of_earlier_pages():
+    third_page = Keyset(0.5, 7, 6)
+    sql, params = build_search_sql(
+        "<->",
+        [0.0],
+        3,
+        ["age > %s"],
+        [30],
+        after=third_page,
+        strategy="overfetch",
+        overfetch=24,
+    )
+    assert "ORDER BY distance LIMIT %s) candidates JOIN users USING (id) " in sql
+    assert sql.endswith(
+        "WHERE age > %s AND (distance, id) > (%s, %s) ORDER BY distance, id LIMIT %s"
+    )
+    assert params == [[0.0], 60, 30, 0.5, 7, 4]
+
+
+def test_build_search_sql_reranks_compact_candidates():
+    sql, params = build_search_sql("<=>", [0.0], 3, storage="binary", after=(0.5, 7))
+    assert "ORDER BY embedding_bits <~> binary_quantize(%s::vector)" in sql
+    assert "candidates WHERE (embedding <=> %s::vector, id) > (%s, %s)" in sql
+    assert params == [[0.0], [0.0], 40, [0.0], 0.5, 7, 4]
+
+    sql, params = build_search_sql("<->", [0.0], 3, storage="halfvec")
+    assert "ORDER BY embedding_half <-> %s::halfvec(384) LIMIT %s" in sql
+    assert params == [[0.0], [0.0], 8, 4]
+    deep = Keyset(0.5, 7, 20)
+    _, params = build_search_sql("<->", [0.0], 10, storage="halfvec", after=deep)
+    assert params == [[0.0], [0.0], 62, [0.0], 0.5, 7, 11]
+    with pytest.raises(ValueError):
+        build_search_sql("<->", [0.0], 3, storage="int4")
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5])
+def test_paginate_returns_limit_rows_and_next_cursor(size):
+    page = search_page(batches(ROWS[:4], size), 3, "s")
+    assert [r["id"] for r in page["results"]] == [1, 2, 3]
+    assert decode_cursor(page["next_cursor"], "s") == (0.3, 3, 3)
+    page = search_page(batches(ROWS[3:], size), 3, "s", depth=3)
+    assert decode_cursor(page["next_cursor"], "s").depth == 6
+    last = search_page(batches(ROWS[:3], size), 3, "s")
+    assert last["next_cursor"] is None
+
+
+def test_paginate_closes_batches_early():
+    closed = []
+
+    def rows():
+        try:
+            yield ROWS
+        finally:
+            closed.append(True)
+
+    list(paginate(rows(), 2, "s"))
+    assert closed == [True]
+
+
+def test_search_similar_streams_ndjson(monkeypatch):
+    async def encode(text):
+        return [0.0] * 384
+
+    captured = {}
+
+    def fake_batches(sql, params, ef_search=None, probes=None, **settings):
+        captured.update(params=params, ef_search=ef_search)
+        yield ROWS[:3]
+
+    monkeypatch.setattr(main.encoder, "aencode_one", encode)
+    monkeypatch.setattr(main, "iter_search_batches", fake_batches)
+    client = TestClient(main.app)
+    response = client.post(
+        "/search-similar", json={"description": "x", "limit": 2, "stream": True}
+    )
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get("id") for line in lines[:2]] == [1, 2]
+    token = lines[2]["next_cursor"]
+
+    response = client.post(
+        "/search-similar", json={"description": "x", "limit": 2, "cursor": token}
+    )
+    assert captured["params"][-3:] == [0.2, 2, 3]
+    assert captured["ef_search"] is None
+    assert response.json()["next_cursor"] is not None
+    deep = encode_cursor(0.2, 2, json.dumps(["search-similar", "x", "l2"]), 98)
+    client.post(
+        "/search-similar", json={"description": "x", "limit": 2, "cursor": deep}
+    )
+    assert captured["ef_search"] == 101
+    deep = encode_cursor(0.2, 2, json.dumps(["search-similar", "x", "l2"]), 20)
+    client.post(
+        "/search-similar",
+        json={"description": "x", "limit": 10, "storage": "halfvec", "cursor": deep},
+    )
+    assert captured["params"][2] == 62
+    assert captured["ef_search"] == 62
+    bad = client.post(
+        "/search-similar", json={"description": "y", "limit": 2, "cursor": token}
+    )
+    assert bad.status_code == 400
+
+
+def test_search_cache_collapses_misses_and_invalidates_on_writes():
+    generation = SchemaVersion(read_db_version=lambda: None)
+    cache = SearchResultCache(generation=generation)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"results": [len(calls)]}
+
+    async def scenario():
+        first = await asyncio.gather(
+            *(cache.get_or_compute(("k",), compute) for _ in range(5))
+        )
+        hit = await cache.get_or_compute(("k",), compute)
+        generation.bump()
+        after_write = await cache.get_or_compute(("k",), compute)
+        return first, hit, after_write
+
+    first, hit, after_write = asyncio.run(scenario())
+    assert [r for r, _ in first] == [{"results": [1]}] * 5
+    assert sum(meta["shared"] for _, meta in first) == 4
+    assert hit[0] == {"results": [1]}
+    assert hit[1]["hit"] is True
+    assert after_write[0] == {"results": [2]}
+    assert cache.stats()["shared"] == 4
+
+
+def test_model_filtered_search_returns_full_pages_mid_reembedding(monkeypatch):
+    try:
+        connection = connect_from_env()
+    except psycopg2.OperationalError:
+        pytest.skip("needs a Postgres database (DB_* settings)")
+    cursor = connection.cursor()
+    try:
+        try:
+            cursor.execute("SELECT NULL::vector")
+        except psycopg2.errors.UndefinedObject:
+            pytest.skip("needs the pgvector extension")
+        # Shadows any real users table for this session only; one row in
+        # five has been re-embedded with the new model so far
+        rng = random.Random(5)
+        cursor.execute(
+            "CREATE TEMP TABLE users (id INTEGER PRIMARY KEY, name TEXT, "
+            "description TEXT, embedding vector(8), embedding_model TEXT)"
+        )
+        cursor.executemany(
+            "INSERT INTO users VALUES (%s, '', '', %s::vector, %s)",
+            [
+                (i, str([rng.random() for _ in range(8)]), "old" if i % 5 else "new")
+                for i in range(2000)
+            ],
+        )
+        cursor.execute("CREATE INDEX ON users USING hnsw (embedding vector_l2_ops)")
+        cursor.execute("ANALYZE users")
+        connection.commit()
+
+        async def encode(text):
+            return [0.5] * 8
+
+        def database():
+            return contextlib.nullcontext(connection)
+
+        monkeypatch.setenv("ENV", "test")
+        monkeypatch.setattr(main, "pooled_connection", database)
+        monkeypatch.setattr(search, "pooled_connection", database)
+        monkeypatch.setattr(main.encoder, "aencode_one", encode)
+        monkeypatch.setattr(
+            main,
+            "search_model_filter",
+            functools.partial(search_model_filter, version="new", enabled=True),
+        )
+        # Over-fetch the ANN index rather than filtering the small table first
+        monkeypatch.setattr(nl_query, "NL_PREFILTER_MAX_ROWS", 0)
+        nl_query._catalog.clear()
+        client = TestClient(main.app)
+        seen = []
+        cursor_token = None
+        for _ in range(4):
+            page = client.post(
+                "/search-similar",
+                json={"description": "x", "limit": 10, "cursor": cursor_token},
+            ).json()
+            assert len(page["results"]) == 10
+            seen += [row["id"] for row in page["results"]]
+            cursor_token = page["next_cursor"]
+        assert len(set(seen)) == 40
+        assert all(row_id % 5 == 0 for row_id in seen)
+    finally:
+        nl_query._catalog.clear()
+        cursor.close()
+        connection.rollback()
+        connection.close()
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+from backend.embeddings import ModelLoader, limit_threads
+from backend.serve import measure_workers, worker_threads
+
+WEIGHTS_MB = 64
+
+
+class FakeModel:
+    def __init__(self):
+        self.weights = np.ones(WEIGHTS_MB * 1024 * 1024 // 8)
+
+    def encode(self, texts, convert_to_tensor=False, **kwargs):
+        return np.full((len(texts), 384), self.weights[: len(texts)].sum())
+
+
+class FakeLoader(ModelLoader):
+    def __init__(self):
+        super().__init__(warmup_batch_size=0)
+
+    def _build(self):
+        return FakeModel()
+
+
+def test_workers_share_preloaded_weights():
+    separate = measure_workers(3, False, FakeLoader, threads=1)
+    shared = measure_workers(3, True, FakeLoader, threads=1)
+    assert len(shared["workers"]) == 3
+    assert all(w["rss_kb"] > WEIGHTS_MB * 1024 for w in shared["workers"])
+    saved_kb = separate["total_pss_kb"] - shared["total_pss_kb"]
+    assert saved_kb > WEIGHTS_MB * 1024
+
+
+def test_thread_cap(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 16)
+    assert worker_threads(4, 0) == 4
+    assert worker_threads(32, 0) == 1
+    assert worker_threads(4, 2) == 2
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        monkeypatch.delenv(name, raising=False)
+    limit_threads(3)
+    assert os.environ["OMP_NUM_THREADS"] == "3"
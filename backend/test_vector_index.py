@@ -0,0 +1,52 @@
+import pytest
+
+from backend.search import build_search_sql
+from backend.vector_index import (
+    _knn_ids,
+    apply_search_params,
+    distance_operator,
+    index_name,
+)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+def test_distance_operator():
+    assert distance_operator("l2") == "<->"
+    assert distance_operator("cosine") == "<=>"
+    with pytest.raises(ValueError):
+        distance_operator("manhattan")
+
+
+def test_index_name():
+    assert index_name("hnsw", "cosine") == "users_embedding_hnsw_cosine_idx"
+
+
+def test_apply_search_params_sets_local_gucs():
+    cursor = RecordingCursor()
+    apply_search_params(cursor, ef_search=80, probes=10)
+    assert cursor.executed == [
+        ("SET LOCAL hnsw.ef_search = %s", (80,)),
+        ("SET LOCAL ivfflat.probes = %s", (10,)),
+    ]
+
+
+def test_apply_search_params_validates():
+    with pytest.raises(ValueError):
+        apply_search_params(RecordingCursor(), ef_search=0)
+    with pytest.raises(ValueError):
+        apply_search_params(RecordingCursor(), probes=0)
+
+
+def test_recall_is_measured_on_the_served_search_sql():
+    cursor = RecordingCursor()
+    cursor.fetchall = lambda: [(i,) for i in range(6)]
+    assert _knn_ids(cursor, "[0,0]", 5, "<=>") == [0, 1, 2, 3, 4]
+    sql, params = cursor.executed[0]
+    assert (sql, params) == build_search_sql("<=>", "[0,0]", 5, storage="full")
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from backend import vector_mirror
+from backend.vector_mirror import MirrorState, Snapshot, VectorMirror, build_snapshot
+
+DIM = vector_mirror.EMBEDDING_DIMENSIONS
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = None
+        self.itersize = None
+
+    def execute(self, statement, params=None):
+        if "txid_snapshot_xmin" in statement:
+            self.result = [(100,)]
+        elif "count(*)" in statement:
+            self.result = [(len(self.rows),)]
+        else:
+            self.result = self.rows
+
+    def fetchone(self):
+        return self.result[0]
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, name=None):
+        return FakeCursor(self.rows)
+
+    def rollback(self):
+        pass
+
+    def commit(self):
+        pass
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(7)
+    return rng.standard_normal((50, DIM)).astype(np.float32)
+
+
+@pytest.fixture
+def mirror(tmp_path, vectors):
+    rows = [(i + 1, f"user{i + 1}", "desc", v.tolist()) for i, v in enumerate(vectors)]
+    build_snapshot(FakeConnection(rows), str(tmp_path))
+    mirror = VectorMirror(path=str(tmp_path), max_staleness=30)
+    snapshot = Snapshot(vector_mirror._current(str(tmp_path)))
+    mirror._state = MirrorState(snapshot, snapshot.watermark, {})
+    return mirror
+
+
+def test_search_matches_brute_force_and_pages(mirror, vectors):
+    query = vectors[3] + 0.01
+    exact = np.linalg.norm(vectors - query, axis=1)
+    expected = [int(i) + 1 for i in np.argsort(exact)[:10]]
+
+    rows = mirror.search(query, "<->", 5)
+    page = rows + mirror.search(query, "<->", 5, (rows[-1]["distance"], rows[-1]["id"]))
+    assert [row["id"] for row in page] == expected
+    assert page[0]["distance"] == pytest.approx(float(exact.min()), abs=1e-4)
+
+    ids = [row["id"] for row in mirror.search(query, "<=>", 3)]
+    cosine = 1 - vectors @ query / np.linalg.norm(vectors, axis=1) / np.linalg.norm(
+        query
+    )
+    assert ids == [int(i) + 1 for i in np.argsort(cosine)[:3]]
+
+
+def test_changes_overlay_the_snapshot(mirror, vectors):
+    query = vectors[0]
+    moved = np.full(DIM, 50.0, dtype=np.float32)
+    state = mirror._state
+    mirror._state = MirrorState(
+        state.snapshot,
+        101,
+        {1: None, 2: (moved, "moved", "d"), 99: (query.copy(), "new", "d")},
+    )
+    rows = mirror.search(query, "<->", 50)
+    assert rows[0]["id"] == 99 and rows[0]["name"] == "new"
+    assert 1 not in [row["id"] for row in rows]
+    assert rows[-1]["id"] == 2
+
+
+def test_stale_mirror_falls_back(mirror):
+    assert mirror.fresh()
+    mirror._state.synced_at -= 60
+    assert not mirror.fresh()
+    assert mirror.stats()["fallbacks"] == 1
+
+
+def test_labels_are_memory_mapped_and_keep_nulls(tmp_path, vectors):
+    rows = [
+        (1, "zoë", None, vectors[0].tolist()),
+        (2, None, "", vectors[1].tolist()),
+        (3, "sam", "ML 🤖", vectors[2].tolist()),
+    ]
+    build_snapshot(FakeConnection(rows), str(tmp_path))
+    snapshot = Snapshot(vector_mirror._current(str(tmp_path)))
+    assert isinstance(snapshot.label_text, np.memmap)
+    assert isinstance(snapshot.label_offsets, np.memmap)
+    assert [snapshot.label(i) for i in range(3)] == [
+        ("zoë", None),
+        (None, ""),
+        ("sam", "ML 🤖"),
+    ]
@@ -0,0 +1,115 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+from backend import optimizer, workload
+from backend.workload import _analyse, analyse_workload, iter_workload
+
+os.environ["ENV"] = "test"
+
+POSTGRES_LOG = b"""2025-01-01 10:00:00 UTC [42] LOG:  duration: 0.512 ms  statement: SELECT * FROM users WHERE age > 30
+2025-01-01 10:00:01 UTC [42] LOG:  statement: SELECT name
+\tFROM users WHERE age > 41
+2025-01-01 10:00:02 UTC [43] LOG:  execute <unnamed>: SELECT name FROM users
+2025-01-01 10:00:03 UTC [43] LOG:  checkpoint starting: time
+"""
+
+
+def test_iter_workload_parses_postgres_log():
+    statements = [q for q, _, _ in iter_workload(io.BytesIO(POSTGRES_LOG), "log")]
+    assert statements == [
+        "SELECT * FROM users WHERE age > 30",
+        "SELECT name FROM users WHERE age > 41",
+        "SELECT name FROM users",
+    ]
+
+
+def test_iter_workload_parses_pg_stat_statements_csv():
+    data = io.BytesIO(b'query,calls,total_exec_time\n"SELECT 1",10,2.5\n')
+    assert list(iter_workload(data, "csv")) == [("SELECT 1", 10, 2.5)]
+
+
+def test_analyse_workload_dedupes_by_fingerprint():
+    data = io.BytesIO(
+        b"SELECT name FROM users WHERE age > 30;\n"
+        b"select name from users where age > 55;\n"
+        b"SELECT * FROM users;\n"
+    )
+    report = analyse_workload(data, "sql", workers=2, max_explains=1)
+    assert report["statements"] == 3
+    assert report["unique_fingerprints"] == 2
+    assert report["failed"] == 0
+    calls = {s["normalized_query"]: s["calls"] for s in report["top"]}
+    assert calls["SELECT name FROM users WHERE age > ?"] == 2
+    assert all("issues" in s for s in report["top"])
+
+
+class PlanConnection:
+    def __init__(self, server_version):
+        self.server_version = server_version
+        self.executed = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, params=None):
+        self.executed.append(params[0] if params else statement)
+
+    def fetchone(self):
+        return self.fetchall()[0]
+
+    def fetchall(self):
+        plan = {"Node Type": "Index Scan", "Total Cost": 8.3, "Plan Rows": 1}
+        return [([{"Plan": plan}],)]
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.mark.parametrize("server_version", [150004, 160001])
+def test_analyse_explains_pg_stat_statements_placeholders(monkeypatch, server_version):
+    connection = PlanConnection(server_version)
+    monkeypatch.setenv("ENV", "dev")
+    monkeypatch.setattr(
+        optimizer, "pooled_connection", lambda: contextlib.nullcontext(connection)
+    )
+    result = _analyse("SELECT name FROM users WHERE id = $1 AND age > $2")
+    assert result["estimated_cost"] == 8.3
+    assert result["explain_error"] is None
+    assert connection.executed[1] == "SET TRANSACTION READ ONLY"
+    if server_version >= 160000:
+        assert connection.executed[2].startswith("EXPLAIN (GENERIC_PLAN, FORMAT JSON)")
+    else:
+        assert connection.executed[3].startswith("PREPARE iquerio_generic AS SELECT")
+        assert "EXECUTE iquerio_generic (NULL, NULL)" in connection.executed[4]
+        assert connection.executed[-1] == "DEALLOCATE iquerio_generic"
+
+
+def test_analyse_holds_an_explain_slot_for_every_explain(monkeypatch):
+    entered = []
+
+    class Slots:
+        def __enter__(self):
+            entered.append(True)
+
+        def __exit__(self, *exc_info):
+            return False
+
+    connection = PlanConnection(160001)
+    monkeypatch.setenv("ENV", "dev")
+    monkeypatch.setattr(
+        optimizer, "pooled_connection", lambda: contextlib.nullcontext(connection)
+    )
+    monkeypatch.setattr(workload, "_explain_slots", Slots())
+    result = _analyse("SELECT * FROM users WHERE id = $1")
+    assert result["optimized_query"] == "SELECT id, name FROM users WHERE id = $1"
+    assert len(entered) == 2
+    assert not hasattr(optimizer, "explain_limiter")
@@ -0,0 +1,340 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from psycopg2 import sql
+
+from .db import connect_from_env
+from .query_cache import schema_version
+
+load_dotenv()
+
+DISTANCES = {
+    "l2": ("<->", "vector_l2_ops"),
+    "cosine": ("<=>", "vector_cosine_ops"),
+    "ip": ("<#>", "vector_ip_ops"),
+}
+METHODS = ("hnsw", "ivfflat")
+
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "384"))
+STORAGE_MODES = ("full", "halfvec", "binary")
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "full")
+COMPACT_COLUMNS = {
+    "halfvec": ("embedding_half", f"halfvec({EMBEDDING_DIMENSIONS})"),
+    "binary": ("embedding_bits", f"bit({EMBEDDING_DIMENSIONS})"),
+}
+RERANK_FACTORS = {
+    "halfvec": int(os.getenv("SEARCH_RERANK_FACTOR_HALFVEC", "2")),
+    "binary": int(os.getenv("SEARCH_RERANK_FACTOR_BINARY", "10")),
+}
+
+
+def distance_operator(distance: str) -> str:
+    if distance not in DISTANCES:
+        raise ValueError(
+            f"Unknown distance '{distance}', expected one of {list(DISTANCES)}"
+        )
+    return DISTANCES[distance][0]
+
+
+def storage_mode(storage: Optional[str] = None) -> str:
+    storage = storage or EMBEDDING_STORAGE
+    if storage not in STORAGE_MODES:
+        raise ValueError(
+            f"Unknown storage mode '{storage}', expected one of {STORAGE_MODES}"
+        )
+    return storage
+
+
+def compact_expression(storage: str, source: str = "embedding") -> str:
+    """SQL computing the compact copy of ``source`` for a storage mode."""
+    if storage == "halfvec":
+        return f"{source}::{COMPACT_COLUMNS[storage][1]}"
+    return f"binary_quantize({source})::{COMPACT_COLUMNS[storage][1]}"
+
+
+def compact_distance(storage: str, operator: str) -> str:
+    """Coarse distance to a ``%s`` query vector over the compact column.
+
+    Binary codes are compared by Hamming distance whatever the final metric.
+    """
+    column = COMPACT_COLUMNS[storage][0]
+    if storage == "halfvec":
+        return f"{column} {operator} %s::{COMPACT_COLUMNS[storage][1]}"
+    return f"{column} <~> {compact_expression(storage, '%s::vector')}"
+
+
+def rerank_shortlist(storage: str, limit: int, depth: int = 0) -> int:
+    """Number of coarse candidates re-ranked at full precision. The list
+    restarts from the nearest row on every page, so it also covers the
+    ``depth`` rows of earlier pages.
+    """
+    return RERANK_FACTORS[storage] * (depth + limit + 1)
+
+
+def index_name(method: str, distance: str) -> str:
+    return f"users_embedding_{method}_{distance}_idx"
+
+
+def build_index_sql(
+    method: str = "hnsw",
+    distance: str = "l2",
+    m: int = 16,
+    ef_construction: int = 64,
+    lists: int = 100,
+    concurrently: bool = True,
+) -> sql.Composed:
+    if method not in METHODS:
+        raise ValueError(f"Unknown index method '{method}', expected one of {METHODS}")
+    distance_operator(distance)
+    if method == "hnsw":
+        options = sql.SQL("m = {}, ef_construction = {}").format(
+            sql.Literal(int(m)), sql.Literal(int(ef_construction))
+        )
+    else:
+        options = sql.SQL("lists = {}").format(sql.Literal(int(lists)))
+    return sql.SQL(
+        "CREATE INDEX {concurrently} IF NOT EXISTS {name} ON users "
+        "USING {method} (embedding {opclass}) WITH ({options})"
+    ).format(
+        concurrently=sql.SQL("CONCURRENTLY" if concurrently else ""),
+        name=sql.Identifier(index_name(method, distance)),
+        method=sql.SQL(method),
+        opclass=sql.SQL(DISTANCES[distance][1]),
+        options=options,
+    )
+
+
+def _autocommit(connection, statement):
+    previous = connection.autocommit
+    connection.autocommit = True
+    try:
+        cursor = connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+    finally:
+        connection.autocommit = previous
+    schema_version.bump()
+
+
+def create_index(connection, method: str = "hnsw", distance: str = "l2", **params):
+    _autocommit(connection, build_index_sql(method, distance, **params))
+    return index_name(method, distance)
+
+
+def drop_index(connection, method: str = "hnsw", distance: str = "l2"):
+    _autocommit(
+        connection,
+        sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(
+            sql.Identifier(index_name(method, distance))
+        ),
+    )
+
+
+def rebuild_index(connection, method: str = "hnsw", distance: str = "l2", **params):
+    if params:
+        drop_index(connection, method, distance)
+        return create_index(connection, method, distance, **params)
+    _autocommit(
+        connection,
+        sql.SQL("REINDEX INDEX CONCURRENTLY {}").format(
+            sql.Identifier(index_name(method, distance))
+        ),
+    )
+    return index_name(method, distance)
+
+
+def list_indexes(connection) -> List[Dict[str, object]]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT i.indexname, i.indexdef,
+                   pg_relation_size(format('%I.%I', i.schemaname, i.indexname)::regclass)
+            FROM pg_indexes i
+            WHERE i.tablename = 'users'
+              AND (i.indexdef ILIKE '%USING hnsw%' OR i.indexdef ILIKE '%USING ivfflat%')
+            ORDER BY i.indexname;
+            """
+        )
+        return [
+            {"name": row[0], "definition": row[1], "size_bytes": row[2]}
+            for row in cursor.fetchall()
+        ]
+    finally:
+        cursor.close()
+
+
+def validate_search_params(
+    ef_search: Optional[int] = None, probes: Optional[int] = None
+):
+    if ef_search is not None and not 1 <= int(ef_search) <= 1000:
+        raise ValueError("ef_search must be between 1 and 1000")
+    if probes is not None and int(probes) < 1:
+        raise ValueError("probes must be at least 1")
+
+
+def apply_search_params(
+    cursor,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    iterative_scan: bool = False,
+):
+    validate_search_params(ef_search, probes)
+    if ef_search is not None:
+        cursor.execute("SET LOCAL hnsw.ef_search = %s", (int(ef_search),))
+    if probes is not None:
+        cursor.execute("SET LOCAL ivfflat.probes = %s", (int(probes),))
+    if iterative_scan:
+        cursor.execute("SET LOCAL hnsw.iterative_scan = strict_order")
+        cursor.execute("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+
+
+def _knn_ids(cursor, embedding, k: int, operator: str) -> List[int]:
+    """Top-``k`` ids from the same SQL ``/search-similar`` runs."""
+    from .search import build_search_sql
+
+    query, params = build_search_sql(operator, embedding, k, storage="full")
+    cursor.execute(query, params)
+    return [row[0] for row in cursor.fetchall()][:k]
+
+
+def _percentile(values: Sequence[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def recall_report(
+    connection,
+    distance: str = "l2",
+    k: int = 10,
+    sample_size: int = 50,
+    ef_search_values: Sequence[int] = (10, 20, 40, 80, 160),
+    probes_values: Sequence[int] = (1, 5, 10, 20),
+) -> Dict[str, object]:
+    operator = distance_operator(distance)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT embedding::text FROM users WHERE embedding IS NOT NULL "
+            "ORDER BY random() LIMIT %s",
+            (sample_size,),
+        )
+        queries = [row[0] for row in cursor.fetchall()]
+        connection.rollback()
+
+        exact = []
+        exact_latencies = []
+        for embedding in queries:
+            cursor.execute("SET LOCAL enable_indexscan = off")
+            started = time.perf_counter()
+            exact.append(set(_knn_ids(cursor, embedding, k, operator)))
+            exact_latencies.append((time.perf_counter() - started) * 1000)
+            connection.rollback()
+
+        settings = [{"ef_search": v} for v in ef_search_values] + [
+            {"probes": v} for v in probes_values
+        ]
+        results = []
+        for setting in settings:
+            recalls = []
+            latencies = []
+            for embedding, truth in zip(queries, exact):
+                apply_search_params(cursor, **setting)
+                started = time.perf_counter()
+                found = _knn_ids(cursor, embedding, k, operator)
+                latencies.append((time.perf_counter() - started) * 1000)
+                connection.rollback()
+                if truth:
+                    recalls.append(len(truth.intersection(found)) / len(truth))
+            if latencies:
+                results.append(
+                    {
+                        **setting,
+                        "recall_at_k": (
+                            round(statistics.mean(recalls), 4) if recalls else None
+                        ),
+                        "latency_ms_p50": round(_percentile(latencies, 50), 3),
+                        "latency_ms_p95": round(_percentile(latencies, 95), 3),
+                    }
+                )
+    finally:
+        cursor.close()
+
+    return {
+        "distance": distance,
+        "k": k,
+        "queries": len(queries),
+        "exact": {
+            "latency_ms_p50": (
+                round(_percentile(exact_latencies, 50), 3) if exact_latencies else None
+            ),
+            "latency_ms_p95": (
+                round(_percentile(exact_latencies, 95), 3) if exact_latencies else None
+            ),
+        },
+        "indexes": list_indexes(connection),
+        "settings": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage ANN indexes on users.embedding"
+    )
+    parser.add_argument(
+        "action", choices=["create", "rebuild", "drop", "list", "report"]
+    )
+    parser.add_argument("--method", choices=METHODS, default="hnsw")
+    parser.add_argument("--distance", choices=list(DISTANCES), default="l2")
+    parser.add_argument("--m", type=int, help="HNSW max connections per layer")
+    parser.add_argument(
+        "--ef-construction", type=int, help="HNSW build candidate list size"
+    )
+    parser.add_argument("--lists", type=int, help="IVFFlat number of lists")
+    parser.add_argument("--k", type=int, default=10, help="k for the recall report")
+    parser.add_argument("--sample-size", type=int, default=50)
+    args = parser.parse_args()
+
+    params = {
+        key: value
+        for key, value in (
+            ("m", args.m),
+            ("ef_construction", args.ef_construction),
+            ("lists", args.lists),
+        )
+        if value is not None
+    }
+    connection = connect_from_env()
+    try:
+        if args.action == "create":
+            result = {
+                "created": create_index(
+                    connection, args.method, args.distance, **params
+                )
+            }
+        elif args.action == "rebuild":
+            result = {
+                "rebuilt": rebuild_index(
+                    connection, args.method, args.distance, **params
+                )
+            }
+        elif args.action == "drop":
+            drop_index(connection, args.method, args.distance)
+            result = {"dropped": index_name(args.method, args.distance)}
+        elif args.action == "list":
+            result = list_indexes(connection)
+        else:
+            result = recall_report(connection, args.distance, args.k, args.sample_size)
+        print(json.dumps(result, indent=2))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
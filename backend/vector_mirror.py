@@ -0,0 +1,541 @@
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .db import connect_from_env, pooled_connection
+from .metrics import stage
+from .vector_index import DISTANCES, EMBEDDING_DIMENSIONS
+
+load_dotenv()
+
+VECTOR_MIRROR_ENABLED = os.getenv("VECTOR_MIRROR_ENABLED", "false").lower() == "true"
+VECTOR_MIRROR_PATH = os.getenv("VECTOR_MIRROR_PATH", "vector_mirror")
+VECTOR_MIRROR_MAX_STALENESS = float(os.getenv("VECTOR_MIRROR_MAX_STALENESS", "30"))
+VECTOR_MIRROR_SYNC_INTERVAL = float(os.getenv("VECTOR_MIRROR_SYNC_INTERVAL", "2"))
+VECTOR_MIRROR_COMPACT_ROWS = int(os.getenv("VECTOR_MIRROR_COMPACT_ROWS", "50000"))
+VECTOR_MIRROR_KEEP = 2
+_L2_TOLERANCE = 1e-4
+
+METRICS = {operator: distance for distance, (operator, _) in DISTANCES.items()}
+
+CHANGE_TRACKING_SQL = """
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS embedding_txid BIGINT;
+    CREATE INDEX IF NOT EXISTS users_embedding_txid_idx ON users (embedding_txid);
+    CREATE TABLE IF NOT EXISTS iquerio_embedding_deletes (
+        id BIGINT NOT NULL,
+        txid BIGINT NOT NULL DEFAULT txid_current()
+    );
+    CREATE INDEX IF NOT EXISTS iquerio_embedding_deletes_txid_idx
+    ON iquerio_embedding_deletes (txid);
+    CREATE OR REPLACE FUNCTION iquerio_track_embedding() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO iquerio_embedding_deletes (id) VALUES (OLD.id);
+            RETURN OLD;
+        END IF;
+        NEW.embedding_txid := txid_current();
+        RETURN NEW;
+    END;
+    $$;
+    DROP TRIGGER IF EXISTS iquerio_track_embedding_trigger ON users;
+    CREATE TRIGGER iquerio_track_embedding_trigger
+    BEFORE INSERT OR DELETE OR UPDATE OF embedding, name, description
+    ON users FOR EACH ROW EXECUTE FUNCTION iquerio_track_embedding();
+"""
+
+_WATERMARK_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot())"
+
+
+class Snapshot:
+    """A published snapshot: ``ids.npy`` (sorted), ``vectors.npy``,
+    ``norms.npy`` and the labels are memory-mapped read-only, so every
+    worker on the host shares the same pages through the page cache.
+
+    ``labels.npy`` holds the UTF-8 names and descriptions back to back, and
+    field ``2 * position + i`` (name, then description) of a row spans
+    ``label_offsets.npy[field:field + 2]``. A NULL field ends at ``~offset``.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.watermark = int(self.meta["watermark"])
+        self.ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(directory, "norms.npy"), mmap_mode="r")
+        self.label_text = np.load(os.path.join(directory, "labels.npy"), mmap_mode="r")
+        self.label_offsets = np.load(
+            os.path.join(directory, "label_offsets.npy"), mmap_mode="r"
+        )
+
+    def label(self, position: int) -> Tuple[Optional[str], Optional[str]]:
+        """``(name, description)`` of the row at ``position``, decoded from
+        the shared pages on demand.
+        """
+        offsets = self.label_offsets[2 * position : 2 * position + 3].tolist()
+        fields = []
+        for start, end in zip(offsets, offsets[1:]):
+            start = start if start >= 0 else ~start
+            text = self.label_text[start:end].tobytes() if end >= 0 else None
+            fields.append(text.decode("utf-8") if text is not None else None)
+        return fields[0], fields[1]
+
+
+def _current(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def _vector(value) -> np.ndarray:
+    return np.asarray(value, dtype=np.float32)
+
+
+def build_snapshot(connection, path: str = VECTOR_MIRROR_PATH) -> Dict[str, object]:
+    """Writes a full snapshot of ``users`` and publishes it atomically by
+    swapping the ``CURRENT`` pointer. Change-tracking rows older than the
+    previous snapshot are pruned.
+    """
+    os.makedirs(path, exist_ok=True)
+    started = time.perf_counter()
+    previous = _current(path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute(_WATERMARK_SQL)
+        watermark = cursor.fetchone()[0]
+        cursor.execute("SELECT count(*) FROM users WHERE embedding IS NOT NULL")
+        total = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+    name = f"snapshot-{watermark}-{time.time_ns()}"
+    directory = os.path.join(path, name)
+    os.makedirs(directory)
+    ids = np.zeros(total, dtype=np.int64)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(directory, "vectors.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(total, EMBEDDING_DIMENSIONS),
+    )
+    label_text = bytearray()
+    label_offsets = np.zeros(2 * total + 1, dtype=np.int64)
+    built = 0
+    rows = connection.cursor(name="iquerio_mirror_build")
+    try:
+        rows.itersize = 5000
+        rows.execute(
+            "SELECT id, name, description, embedding::real[] FROM users "
+            "WHERE embedding IS NOT NULL ORDER BY id"
+        )
+        for position, (row_id, row_name, description, embedding) in enumerate(rows):
+            if position >= total:
+                break
+            ids[position] = row_id
+            vectors[position] = embedding
+            for field, value in enumerate((row_name, description), 2 * position + 1):
+                if value is None:
+                    label_offsets[field] = ~len(label_text)
+                    continue
+                label_text += value.encode("utf-8")
+                label_offsets[field] = len(label_text)
+            built = position + 1
+    finally:
+        rows.close()
+        connection.rollback()
+    total = built
+    vectors.flush()
+    del vectors
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")[:total]
+    np.save(os.path.join(directory, "ids.npy"), ids[:total])
+    np.save(
+        os.path.join(directory, "norms.npy"),
+        np.einsum("ij,ij->i", vectors, vectors),
+    )
+    np.save(os.path.join(directory, "labels.npy"), np.frombuffer(label_text, np.uint8))
+    np.save(
+        os.path.join(directory, "label_offsets.npy"), label_offsets[: 2 * total + 1]
+    )
+    meta = {
+        "watermark": watermark,
+        "rows": total,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "built_at": time.time(),
+        "build_seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    pointer = os.path.join(path, f"CURRENT.{os.getpid()}")
+    with open(pointer, "w") as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(path, "CURRENT"))
+
+    snapshots = sorted(
+        (entry for entry in os.listdir(path) if entry.startswith("snapshot-")),
+        key=lambda entry: os.path.getmtime(os.path.join(path, entry)),
+    )
+    for entry in snapshots[:-VECTOR_MIRROR_KEEP]:
+        shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+    if previous and os.path.exists(os.path.join(previous, "meta.json")):
+        with open(os.path.join(previous, "meta.json")) as f:
+            pruned = json.load(f)["watermark"]
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "DELETE FROM iquerio_embedding_deletes WHERE txid < %s", (pruned,)
+            )
+            connection.commit()
+        finally:
+            cursor.close()
+    return {"snapshot": name, **meta}
+
+
+def fetch_changes(
+    connection, watermark: int
+) -> Tuple[int, Dict[int, Optional[Tuple[np.ndarray, str, str]]]]:
+    """Rows changed by transactions at or after ``watermark``.
+
+    Returns the next watermark (the oldest transaction still running) and
+    ``{id: (vector, name, description)}``, with ``None`` for removed rows.
+    Rows are re-read until every transaction that could have touched them
+    has finished, so out-of-order commits are never missed.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(_WATERMARK_SQL)
+        next_watermark = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT id, name, description, embedding::real[] FROM users "
+            "WHERE embedding_txid >= %s",
+            (watermark,),
+        )
+        changes = {
+            row_id: (
+                (_vector(embedding), row_name, description)
+                if embedding is not None
+                else None
+            )
+            for row_id, row_name, description, embedding in cursor.fetchall()
+        }
+        cursor.execute(
+            "SELECT DISTINCT d.id FROM iquerio_embedding_deletes d WHERE d.txid >= %s "
+            "AND NOT EXISTS (SELECT 1 FROM users u WHERE u.id = d.id)",
+            (watermark,),
+        )
+        changes.update((row[0], None) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+        connection.rollback()
+    return next_watermark, changes
+
+
+def _scores(metric: str, vectors, norms, query: np.ndarray, query_norm: float):
+    """Final distances for ``cosine``/``ip``; for ``l2`` the squared distance
+    via ``|x|^2 - 2x.q + |q|^2``, which is fast but loses precision, so the
+    shortlist is re-scored by ``_exact_l2``.
+    """
+    if not len(vectors):
+        return np.zeros(0)
+    dots = np.asarray(vectors @ query, dtype=np.float64)
+    if metric == "ip":
+        return -dots
+    if metric == "cosine":
+        return 1.0 - dots / np.maximum(np.sqrt(norms) * np.sqrt(query_norm), 1e-12)
+    return norms - 2.0 * dots + query_norm
+
+
+def _exact_l2(state, positions: np.ndarray, query: np.ndarray) -> np.ndarray:
+    base = len(state.snapshot.ids)
+    distances = np.empty(len(positions))
+    in_snapshot = positions < base
+    for mask, vectors, offset in (
+        (in_snapshot, state.snapshot.vectors, 0),
+        (~in_snapshot, state.delta_vectors, base),
+    ):
+        if mask.any():
+            diff = vectors[positions[mask] - offset] - query
+            distances[mask] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    return distances
+
+
+class MirrorState:
+    def __init__(self, snapshot: Snapshot, watermark: int, changes: Dict):
+        self.snapshot = snapshot
+        self.watermark = watermark
+        self.changes = changes
+        self.synced_at = time.monotonic()
+        live = {k: v for k, v in changes.items() if v is not None}
+        self.delta_ids = np.fromiter(live, dtype=np.int64, count=len(live))
+        self.delta_vectors = (
+            np.stack([v[0] for v in live.values()])
+            if live
+            else np.zeros((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+        )
+        self.delta_norms = np.einsum("ij,ij->i", self.delta_vectors, self.delta_vectors)
+        self.delta_labels = [v[1:] for v in live.values()]
+        changed = np.fromiter(changes, dtype=np.int64, count=len(changes))
+        positions = np.searchsorted(snapshot.ids, changed)
+        found = positions < len(snapshot.ids)
+        found[found] = snapshot.ids[positions[found]] == changed[found]
+        self.masked = positions[found]
+
+
+class VectorMirror:
+    """In-process exact k-NN over a memory-mapped snapshot of
+    ``users.embedding`` plus the rows changed since it was taken.
+
+    A background thread pulls changes every ``sync_interval`` seconds using
+    the ``embedding_txid`` change-tracking column; searches go to Postgres
+    instead whenever the last successful sync is older than
+    ``max_staleness``.
+    """
+
+    def __init__(
+        self,
+        path: str = VECTOR_MIRROR_PATH,
+        max_staleness: float = VECTOR_MIRROR_MAX_STALENESS,
+        sync_interval: float = VECTOR_MIRROR_SYNC_INTERVAL,
+        compact_rows: int = VECTOR_MIRROR_COMPACT_ROWS,
+        enabled: bool = True,
+    ):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.sync_interval = sync_interval
+        self.compact_rows = compact_rows
+        self.enabled = enabled
+        self.error: Optional[BaseException] = None
+        self.searches = 0
+        self.fallbacks = 0
+        self._state: Optional[MirrorState] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "VectorMirror":
+        return cls(enabled=VECTOR_MIRROR_ENABLED)
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="vector-mirror", daemon=True
+            )
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+                self.error = None
+            except Exception as e:
+                self.error = e
+            if self._stop.wait(self.sync_interval):
+                return
+
+    def _build(self, blocking: bool) -> bool:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            if blocking and _current(self.path):
+                return True
+            with pooled_connection() as connection:
+                build_snapshot(connection, self.path)
+            return True
+
+    def sync(self):
+        with self._lock:
+            directory = _current(self.path)
+            if directory is None:
+                self._build(blocking=True)
+                directory = _current(self.path)
+            state = self._state
+            if state is None or state.snapshot.directory != directory:
+                snapshot = Snapshot(directory)
+                watermark, changes = snapshot.watermark, {}
+            else:
+                snapshot, watermark = state.snapshot, state.watermark
+                changes = dict(state.changes)
+            with pooled_connection() as connection:
+                watermark, fetched = fetch_changes(connection, watermark)
+            if fetched or state is None or state.snapshot is not snapshot:
+                changes.update(fetched)
+                self._state = MirrorState(snapshot, watermark, changes)
+            else:
+                state.watermark = watermark
+                state.synced_at = time.monotonic()
+        if len(changes) >= self.compact_rows:
+            self._build(blocking=False)
+
+    @property
+    def staleness(self) -> Optional[float]:
+        state = self._state
+        return None if state is None else time.monotonic() - state.synced_at
+
+    def fresh(self) -> bool:
+        staleness = self.staleness
+        usable = self.enabled and staleness is not None
+        if usable and staleness <= self.max_staleness:
+            return True
+        if self.enabled:
+            self.fallbacks += 1
+        return False
+
+    def search(
+        self,
+        embedding,
+        operator: str,
+        k: int,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> List[Dict[str, object]]:
+        """Exact top-``k`` ordered by ``(distance, id)``, continuing after the
+        keyset ``after`` like the SQL search.
+        """
+        state = self._state
+        metric = METRICS[operator]
+        query = _vector(embedding)
+        query_norm = float(query @ query)
+        snapshot = state.snapshot
+        norms = np.concatenate([snapshot.norms, state.delta_norms])
+        scores = np.concatenate(
+            [
+                _scores(metric, snapshot.vectors, snapshot.norms, query, query_norm),
+                _scores(
+                    metric, state.delta_vectors, state.delta_norms, query, query_norm
+                ),
+            ]
+        )
+        scores[state.masked] = np.inf
+        ids = np.concatenate([snapshot.ids, state.delta_ids])
+        if after is not None:
+            if metric == "l2":
+                slack = _L2_TOLERANCE * (norms + query_norm)
+                scores[scores < after[0] ** 2 - slack] = np.inf
+            else:
+                before = (scores < after[0]) | (
+                    (scores == after[0]) & (ids <= after[1])
+                )
+                scores[before] = np.inf
+
+        size = k + max(k, 64) if metric == "l2" else k
+        while True:
+            if size < len(scores):
+                candidates = np.argpartition(scores, size)[:size]
+            else:
+                candidates = np.arange(len(scores))
+            candidates = candidates[np.isfinite(scores[candidates])]
+            if metric == "l2":
+                distances = _exact_l2(state, candidates, query)
+            else:
+                distances = scores[candidates]
+            if after is not None:
+                keep = (distances > after[0]) | (
+                    (distances == after[0]) & (ids[candidates] > after[1])
+                )
+                candidates, distances = candidates[keep], distances[keep]
+            if len(candidates) >= k or size >= len(scores):
+                break
+            size *= 2
+        order = np.lexsort((ids[candidates], distances))[:k]
+        self.searches += 1
+        base = len(snapshot.ids)
+        rows = []
+        for position, distance in zip(candidates[order], distances[order]):
+            if position < base:
+                name, description = snapshot.label(position)
+            else:
+                name, description = state.delta_labels[position - base]
+            rows.append(
+                {
+                    "id": int(ids[position]),
+                    "name": name,
+                    "description": description,
+                    "distance": float(distance),
+                }
+            )
+        return rows
+
+    def iter_batches(
+        self,
+        embedding,
+        operator: str,
+        k: int,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> Iterator[List[Dict[str, object]]]:
+        with stage("mirror_search"):
+            rows = self.search(embedding, operator, k, after)
+        yield rows
+
+    def stats(self) -> Dict[str, object]:
+        state = self._state
+        staleness = self.staleness
+        return {
+            "enabled": self.enabled,
+            "snapshot": os.path.basename(state.snapshot.directory) if state else None,
+            "snapshot_rows": len(state.snapshot.ids) if state else 0,
+            "changed_rows": len(state.changes) if state else 0,
+            "staleness_seconds": round(staleness, 3) if staleness is not None else None,
+            "max_staleness_seconds": self.max_staleness,
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+            "error": repr(self.error) if self.error else None,
+        }
+
+
+def install_change_tracking(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CHANGE_TRACKING_SQL)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage the memory-mapped snapshot of users.embedding"
+    )
+    parser.add_argument("action", choices=["install", "build", "stats"])
+    parser.add_argument("--path", default=VECTOR_MIRROR_PATH)
+    args = parser.parse_args()
+
+    if args.action == "stats":
+        directory = _current(args.path)
+        print(json.dumps(Snapshot(directory).meta if directory else None, indent=2))
+        return
+    connection = connect_from_env()
+    try:
+        if args.action == "install":
+            install_change_tracking(connection)
+            result = {"installed": "embedding_txid"}
+        else:
+            result = build_snapshot(connection, args.path)
+        print(json.dumps(result, indent=2))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
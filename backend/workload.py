@@ -0,0 +1,210 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+import sqlparse
+from dotenv import load_dotenv
+
+from .query_cache import fingerprint_query
+
+load_dotenv()
+
+WORKLOAD_FORMATS = ("csv", "ndjson", "log", "sql")
+WORKLOAD_MAX_WORKERS = int(os.getenv("WORKLOAD_MAX_WORKERS", "4"))
+WORKLOAD_MAX_EXPLAINS = int(os.getenv("WORKLOAD_MAX_EXPLAINS", "2"))
+
+_LOG_STATEMENT = re.compile(
+    r"(?:LOG|STATEMENT):\s+(?:duration:\s*[\d.]+\s*ms\s+)?"
+    r"(?:statement|execute [^:]*):\s*(.*)$"
+)
+_LOG_STATEMENT_ONLY = re.compile(r"STATEMENT:\s*(.*)$")
+_LOG_LINE_PREFIX = re.compile(r"^\S")
+
+
+def detect_workload_format(filename: Optional[str] = None, content_type: str = None):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    extension = os.path.splitext(filename or "")[1].lower()
+    return {
+        ".csv": "csv",
+        ".ndjson": "ndjson",
+        ".jsonl": "ndjson",
+        ".json": "ndjson",
+        ".log": "log",
+        ".sql": "sql",
+    }.get(extension, "log")
+
+
+def _calls(value) -> int:
+    try:
+        return max(int(float(value)), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _float_or_none(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pgss_record(
+    record: Dict[str, object],
+) -> Optional[Tuple[str, int, Optional[float]]]:
+    query = record.get("query")
+    if not query:
+        return None
+    total_time = record.get("total_exec_time", record.get("total_time"))
+    return str(query), _calls(record.get("calls")), _float_or_none(total_time)
+
+
+def _iter_log(text: IO[str]) -> Iterator[str]:
+    current: List[str] = []
+    for line in text:
+        if current and not _LOG_LINE_PREFIX.match(line):
+            current.append(line.strip())
+            continue
+        if current:
+            yield " ".join(current)
+            current = []
+        match = _LOG_STATEMENT.search(line) or _LOG_STATEMENT_ONLY.search(line)
+        if match and match.group(1).strip():
+            current = [match.group(1).strip()]
+    if current:
+        yield " ".join(current)
+
+
+def iter_workload(
+    stream: IO[bytes], fmt: str
+) -> Iterator[Tuple[str, int, Optional[float]]]:
+    if fmt not in WORKLOAD_FORMATS:
+        raise ValueError(
+            f"Unsupported format '{fmt}', expected one of {WORKLOAD_FORMATS}"
+        )
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    if fmt == "csv":
+        for row in csv.DictReader(text):
+            record = _pgss_record(row)
+            if record:
+                yield record
+    elif fmt == "ndjson":
+        for line in text:
+            if line.strip():
+                record = _pgss_record(json.loads(line))
+                if record:
+                    yield record
+    elif fmt == "log":
+        for statement in _iter_log(text):
+            yield statement, 1, None
+    else:
+        for statement in sqlparse.parsestream(text):
+            sql = str(statement).strip().rstrip(";").strip()
+            if sql:
+                yield sql, 1, None
+
+
+_explain_slots = None
+
+
+def _init_worker(explain_slots):
+    global _explain_slots
+    _explain_slots = explain_slots
+    os.environ["DB_POOL_MIN"] = "0"
+    # The rewrite's EXPLAIN runs alongside the original query's
+    os.environ["DB_POOL_MAX"] = "2"
+
+
+def _analyse(query: str) -> Dict[str, object]:
+    from .optimizer import optimize_query
+
+    result = optimize_query(query, use_cache=False, limiter=_explain_slots)
+    plan = result["explain_plan"]
+    cost = None
+    if isinstance(plan, list) and plan:
+        cost = plan[0]["Plan"].get("Total Cost")
+    return {
+        "optimized_query": result["optimized_query"],
+        "issues": result["issues"],
+        "suggestions": result["suggestions"],
+        "estimated_cost": cost,
+        "explain_error": plan if isinstance(plan, str) else None,
+    }
+
+
+def analyse_workload(
+    stream: IO[bytes],
+    fmt: str,
+    workers: int = 4,
+    max_explains: int = 2,
+    top: int = 50,
+) -> Dict[str, object]:
+    started = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    explain_slots = context.BoundedSemaphore(max(max_explains, 1))
+    shapes: Dict[str, Dict[str, object]] = {}
+    futures = {}
+    statements = 0
+
+    with ProcessPoolExecutor(
+        max_workers=max(workers, 1),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(explain_slots,),
+    ) as pool:
+        for query, calls, total_time in iter_workload(stream, fmt):
+            statements += 1
+            fingerprint, normalized = fingerprint_query(query)
+            shape = shapes.get(fingerprint)
+            if shape is None:
+                shape = shapes[fingerprint] = {
+                    "fingerprint": fingerprint,
+                    "normalized_query": normalized,
+                    "sample_query": query,
+                    "calls": 0,
+                    "total_time_ms": None,
+                }
+                futures[fingerprint] = pool.submit(_analyse, query)
+            shape["calls"] += calls
+            if total_time is not None:
+                shape["total_time_ms"] = (shape["total_time_ms"] or 0.0) + total_time
+
+        failed = 0
+        for fingerprint, future in futures.items():
+            try:
+                shapes[fingerprint].update(future.result())
+            except Exception as e:
+                failed += 1
+                shapes[fingerprint]["analysis_error"] = str(e)
+
+    for shape in shapes.values():
+        cost = shape.get("estimated_cost")
+        shape["score"] = cost * shape["calls"] if cost is not None else None
+
+    ranked = sorted(
+        shapes.values(),
+        key=lambda s: (
+            s["score"] is not None,
+            s["score"] or 0.0,
+            s["total_time_ms"] or 0.0,
+            s["calls"],
+        ),
+        reverse=True,
+    )
+    return {
+        "statements": statements,
+        "unique_fingerprints": len(shapes),
+        "failed": failed,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "ranked_by": "estimated_cost * calls",
+        "top": ranked[:top] if top else ranked,
+    }
@@ -13,6 +13,15 @@ setup(
         "sentence-transformers==5.1.1",
         "huggingface-hub==0.35.3",
     ],
+    extras_require={
+        # EMBEDDING_BACKEND=onnx / onnx-int8
+        "onnx": [
+            "optimum==2.1.0",
+            "optimum-onnx==0.1.0",
+            "onnx==1.23.2",
+            "onnxruntime==1.31.0",
+        ],
+    },
     entry_points={"console_scripts": ["db-toolkit = backend.cli:main"]},
     author="Pranav",
     description="AI-powered SQL optimizer and vector playground",